@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+
+# responses that tell the server is overloaded; MSTR answers 500 for cubes that are not
+# published, which says nothing about the load, so it is left out
+OVERLOAD_STATUS = {429, 502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the number of in-flight REST requests, with an optional requests-per-second ceiling.
+
+    The limit grows by one request per window of successful responses and is halved, at most once
+    per smoothed round trip, on 429, 502, 503 and 504 responses, on failed requests and, if latency_target is
+    set, on responses slower than the target. Retry-After pauses every new request until it expires.
+    """
+    def __init__(self, initial = 10, minimum = 1, maximum = 10, max_rps = None, latency_target = None):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.max_rps = max_rps
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.tokens = float(max_rps or 0)
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None
+        self.counters = Counter()
+        self.condition = threading.Condition()
+
+    def _tryAcquire(self):
+        """
+        Take a request slot if one is free, caller holds the condition
+
+        :return: 0 once acquired, else the seconds to wait, None to wait for a release
+        """
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.max_rps:
+            self.tokens = min(self.max_rps, self.tokens + (now - self.last_refill) * self.max_rps)
+            self.last_refill = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.max_rps
+            self.tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self):
+        """
+        Block until a request may be sent
+        """
+        with self.condition:
+            wait = self._tryAcquire()
+            if wait:
+                self.counters['waits'] += 1
+            while wait != 0:
+                self.condition.wait(wait)
+                wait = self._tryAcquire()
+
+    async def acquireAsync(self):
+        """
+        Coroutine version of acquire() for the asyncio engine
+        """
+        with self.condition:
+            wait = self._tryAcquire()
+            if wait:
+                self.counters['waits'] += 1
+        while wait != 0:
+            await asyncio.sleep(wait if wait is not None else 0.01)
+            with self.condition:
+                wait = self._tryAcquire()
+
+    def release(self, status, latency, retry_after = None):
+        """
+        Give the slot back and adjust the limit to the outcome of the request
+
+        :param status: HTTP status code, None if the request failed without a response
+        :param latency: seconds the request took
+        :param retry_after: Retry-After header of the response, if any
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + parseRetryAfter(retry_after))
+            if status is None or status in OVERLOAD_STATUS:
+                self.counters['throttled' if status == 429 else 'errors'] += 1
+                self._decrease(now)
+            elif self.latency_target is not None and latency > self.latency_target:
+                self.counters['slow'] += 1
+                self._decrease(now)
+            else:
+                # additive increase: one more slot per limit successful responses
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def _decrease(self, now):
+        # one decrease per round trip, the responses still in flight saw the same overload
+        if now - self.last_decrease < (self.latency or 0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        self.counters['decreases'] += 1
+
+    def stats(self):
+        """
+        :return: dict with the current limit and the wait, throttle, error and decrease counters
+        """
+        with self.condition:
+            stats = dict(self.counters)
+            stats['limit'] = int(self.limit)
+            return stats
+
+
+def parseRetryAfter(value):
+    """
+    :param value: Retry-After header, in seconds or as an HTTP date
+    :return: seconds to wait
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 1.0
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import time
+import distinct_elem_count
+import adaptiveLimiter
+import instrumentation
+import samplingEstimator
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncMSTRApp(distinct_elem_count.MSTRApp):
+    """
+    MSTRApp variant that runs the attribute, element and temp-report calls as coroutines.
+
+    Login, project listing, cube search and folder lookup still go through the pooled
+    requests session; everything that is issued per cube or per attribute is sent on one
+    event loop through aiohttp, capped per project by a semaphore.
+
+    All cubes of a project start at once, so there is no order to spend a time or request
+    budget in; the budget options of MSTRApp are not supported.
+    """
+    def __init__(self, pool_size = 10, timeout = 300, concurrency = 200, project_concurrency = 50, **options) -> None:
+        if aiohttp is None:
+            raise ImportError("The async engine requires the aiohttp package")
+        if options.get('time_budget') is not None or options.get('max_requests') is not None:
+            raise ValueError("The async engine does not support a time or request budget")
+        super().__init__(pool_size, timeout, **options)
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.project_concurrency = project_concurrency
+        self.project_semaphores = {}
+        # shared attributes being counted -> future of their result, so concurrent cubes await it instead of fetching again
+        self.shared_futures = {}
+        # project id -> semaphore capping the cubes that hold a temporary report at once, so released reports are reused
+        self.report_slots = {}
+        if not options.get('report_pool_size'):
+            # all cubes of a project start at once, keep as many reports as requests may be in flight
+            self.report_pool.size = project_concurrency
+        self.http = None
+        # one controller for both engines, so the rate ceiling holds for the whole run
+        limiter = self.session.limiter
+        self.session.limiter = adaptiveLimiter.AdaptiveLimiter(concurrency, 1, concurrency, limiter.max_rps, limiter.latency_target)
+
+    def run(self, projects, certified, OLAP_flag = True, MTDI_flag = True):
+        """
+        Count the elements of all given projects on a single event loop
+
+        :param projects: a list of (project id, project name)
+        :param certified: true/false
+        :param OLAP_flag: count OLAP cubes
+        :param MTDI_flag: count MTDI cubes
+        """
+        asyncio.run(self._run(projects, certified, OLAP_flag, MTDI_flag))
+
+    async def _run(self, projects, certified, OLAP_flag, MTDI_flag):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=None if distinct_elem_count.is_verified else False)
+        headers = {
+            'X-MSTR-AuthToken': self.authtoken,
+            'Accept-Encoding': 'gzip, deflate',
+            'Content-Type': 'application/json'
+        }
+        self.http = aiohttp.ClientSession(connector=connector, headers=headers, cookies=self.session.cookies(),
+                                          timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            await asyncio.gather(*[self._countProject(proj, certified, OLAP_flag, MTDI_flag) for proj in projects])
+        finally:
+            await self.http.close()
+            self.http = None
+
+    async def _countProject(self, proj, certified, OLAP_flag, MTDI_flag):
+        # the report pool puts the temporary reports of the project in this folder
+        await asyncio.to_thread(self.setFolderID, proj[0])
+        if OLAP_flag:
+            await self.countElem_OLAP_async(proj, certified)
+        if MTDI_flag:
+            await self.countElem_MTDI_async(proj, certified)
+
+    async def _request(self, method, path, projID = None, headers = None, **kwargs):
+        """
+        Send a REST request on the event loop, within the project's concurrency cap
+
+        :return: (status code, response headers, response text)
+        """
+        if projID not in self.project_semaphores:
+            self.project_semaphores[projID] = asyncio.Semaphore(self.project_concurrency)
+        request_headers = {}
+        if projID is not None:
+            request_headers['X-MSTR-ProjectID'] = projID
+        if headers:
+            request_headers.update(headers)
+        session = self.session
+        endpoint = instrumentation.endpointName(method, path)
+        retries = 0
+        throttled = 0
+        renewed = False
+        async with self.project_semaphores[projID]:
+            while True:
+                token = session.authToken()
+                # the token is sent per request, it changes when the session logs in again
+                request_headers['X-MSTR-AuthToken'] = token
+                await session.limiter.acquireAsync()
+                start = time.monotonic()
+                try:
+                    async with self.http.request(method, self.base_url + path, headers=request_headers, **kwargs) as response:
+                        status, response_headers, response_text = response.status, response.headers, await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    session.limiter.release(None, time.monotonic() - start)
+                    self.metrics.observeRequest(endpoint, None, time.monotonic() - start)
+                    delay = session.retryDelay(method, path, None, retries)
+                    if delay is None:
+                        raise
+                    logging.info(f"{method} {path} failed ({error!r}), retrying in {delay:.1f} seconds")
+                    retries += 1
+                    await asyncio.sleep(delay)
+                    continue
+                latency = time.monotonic() - start
+                retry_after = response_headers.get('Retry-After', 1 if status == 429 else None)
+                session.limiter.release(status, latency, retry_after)
+                self.metrics.observeRequest(endpoint, status, latency, len(response_text.encode('utf-8')))
+                if status == 401 and not renewed and session.canRenewToken(path):
+                    renewed = True
+                    await asyncio.to_thread(session.renewToken, token)
+                    self.http.cookie_jar.update_cookies(session.cookies())
+                    continue
+                if status == 429 and throttled < session.throttle_retries:
+                    throttled += 1
+                    session.countThrottled(method, path)
+                    logging.info(f"{method} {path} throttled by the server, attempt {throttled}")
+                    continue
+                delay = session.retryDelay(method, path, status, retries)
+                if delay is None:
+                    return status, response_headers, response_text
+                logging.info(f"{method} {path} answered {status}, retrying in {delay:.1f} seconds")
+                retries += 1
+                await asyncio.sleep(delay)
+
+    async def listAttributes_async(self, projID, cubeID):
+        """
+        Get attributes from a cube
+
+        :param projID: project id
+        :param cubeID: cube id
+        :return: a list of attribute, in the form of [(attribute id, attribute name, attribute form name list, attribute form index list, base form ids)]
+        """
+        path = "/api/v2/cubes/" + cubeID
+        version = self.cube_modified.get((projID, cubeID))
+        attributes = self.metadata_cache.get(projID, path, version)
+        if attributes is None:
+            status, headers, response_text = await self._request("GET", path, projID=projID,
+                                                                 headers=self.metadata_cache.validators(projID, path, version))
+            if status == 304:
+                attributes = self.metadata_cache.revalidate(projID, path)
+            elif status != 200:
+                return []
+            else:
+                attributes = self._parseAttributes(json.loads(response_text))
+                self.metadata_cache.put(projID, path, attributes, version, headers)
+        return [tuple(attribute) for attribute in attributes]
+
+    async def listElements_async(self, projID, path, attribute, element_limit = 10000, page_size = 100000):
+        """
+        Get the distinct element counts in an attribute
+
+        :param projID: project id
+        :param path: "/api/cubes/{cube id}" for MTDI cubes or "/api/reports/{report id}" for OLAP temp reports
+        :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :return: distinct element counts
+        """
+        element_limit = self._elementLimit(element_limit)
+        # paging, with pages sized to the remaining element budget
+        offset = 0
+        counter = self._newCounter(attribute[3], element_limit)
+        stats = self._newFetchStats()
+        element_counts = 0
+        while True:
+            limit = self._pageLimit(page_size, element_limit, offset)
+            elements = await self._listElements_async(projID, path, attribute[0], attribute[4], limit, offset, stats)
+            logging.info(f"fetch offset: {offset}, page_size: {limit}.")
+            if isinstance(elements, int) or elements == distinct_elem_count.FETCH_FAILED:
+                return elements
+            counter.add(elements)
+            if counter.exceeded:
+                self._logFetchStats(attribute, stats, counter.element_count)
+                if self.sample_windows:
+                    return await self._sampleElements_async(projID, path, attribute, stats['total'])
+                logging.info(f"Attribute {attribute[0]} ignored because element count exceeds the limit {element_limit}.")
+                return 10000
+            if limit == -1 or len(elements) < limit:
+                break
+            offset += len(elements)
+
+        self._logFetchStats(attribute, stats, counter.element_count)
+        if counter.element_count:
+            element_counts = counter.counts()
+        return element_counts
+
+    async def _sampleElements_async(self, projID, path, attribute, total):
+        """
+        Same as _sampleElements, with the windows fetched concurrently
+        """
+        if total is None:
+            logging.info(f"Attribute {attribute[0]} ignored because the server did not report its element count.")
+            return 10000
+        stats = self._newFetchStats()
+        offsets = samplingEstimator.sampleOffsets(total, self.sample_windows, self.sample_window_size, attribute[0])
+        windows = await asyncio.gather(*[self._listElements_async(projID, path, attribute[0], attribute[4], self.sample_window_size, offset, stats)
+                                         for offset in offsets])
+        values = [[] for _ in attribute[3]]
+        for elements in windows:
+            if elements == distinct_elem_count.FETCH_FAILED:
+                return elements
+            if isinstance(elements, int):
+                logging.info(f"Attribute {attribute[0]} ignored because its sample could not be fetched.")
+                return 10000
+            self._addSample(values, elements, attribute)
+        return self._estimateSample(values, attribute, total)
+
+    async def _listElements_async(self, projID, path, attributeID, baseFormIds, page_size, offset, stats):
+        """
+        Fetch one page of elements
+
+        :return: the list of the form values of each element, -1 if the cube is not published,
+                 FETCH_FAILED if the page could not be fetched
+        """
+        params = [('limit', str(page_size)), ('offset', str(offset))] + [('baseFormIds', formID) for formID in baseFormIds]
+        status, headers, response_text = await self._request("GET", path + "/attributes/" + attributeID + "/elements", projID=projID, params=params)
+        if status == 500:
+            return -1
+        elif status != 200:
+            logging.info(f"Elements of attribute {attributeID} could not be fetched: HTTP {status}")
+            return distinct_elem_count.FETCH_FAILED
+        self._updateFetchStats(stats, headers, len(response_text.encode('utf-8')))
+        # the counter decides whether the attribute is over the element limit, as for the streamed pages of the sync engine
+        return list(self._formValues(json.loads(response_text)))
+
+    async def _costCube_async(self, projID, cube, type, counting):
+        start = time.perf_counter()
+        records = await counting
+        seconds = time.perf_counter() - start
+        self.metrics.cubeCost(projID, cube, type, seconds, len(records))
+        return records, seconds
+
+    async def _countCube_MTDI_async(self, projID, cube):
+        self._startCube(projID, cube)
+        attributes = await self.listAttributes_async(projID, cube[0])
+        return await self._countAttributes_async(projID, "/api/cubes/" + cube[0], cube, attributes, "MTDI")
+
+    async def _countAttributes_async(self, projID, path, cube, attributes, type, stop_at_exceed = True):
+        shared = type == "OLAP"
+        counts = await asyncio.gather(*[self._countAttribute_async(projID, path, cube, attribute, shared) for attribute in attributes])
+        records = self._collectRecords(projID, cube, attributes, counts, type, stop_at_exceed)
+        logging.info(f"Distinct element count of Cube: {cube[1]} done.")
+        return records
+
+    async def _countAttribute_async(self, projID, path, cube, attribute, shared):
+        distinctElemCount = self._knownCount(projID, cube[0], attribute, shared)
+        if distinctElemCount is None:
+            if shared:
+                distinctElemCount = await self._countShared_async(projID, attribute, lambda: self.listElements_async(projID, path, attribute))
+            else:
+                distinctElemCount = await self.listElements_async(projID, path, attribute)
+        self._recordCount(projID, cube[0], attribute, distinctElemCount, shared)
+        return distinctElemCount
+
+    async def _countShared_async(self, projID, attribute, count):
+        """
+        Same as _countShared, on the event loop: a shared attribute is counted once while other cubes ask for it
+
+        :param count: function returning the coroutine that fetches and counts the attribute's elements
+        :return: distinct element counts
+        """
+        key = (projID, attribute[0], tuple(attribute[4]))
+        future = self.shared_futures.get(key)
+        if future is not None:
+            distinctElemCount = await asyncio.shield(future)
+            if distinctElemCount != distinct_elem_count.SKIPPED and distinctElemCount != -1:
+                return distinctElemCount
+            return await count()
+        future = self.shared_futures[key] = asyncio.get_running_loop().create_future()
+        distinctElemCount = distinct_elem_count.SKIPPED
+        try:
+            distinctElemCount = await count()
+            return distinctElemCount
+        finally:
+            del self.shared_futures[key]
+            future.set_result(distinctElemCount)
+
+    async def _countCube_OLAP_async(self, projID, cube):
+        self._startCube(projID, cube)
+        attributes = await self.listAttributes_async(projID, cube[0])
+        # a managed cube, or a cube whose attribute results are all known already, needs no temporary report
+        path = self._knownCubePath(projID, cube[0], attributes)
+        if path == distinct_elem_count.MANAGED_PATH:
+            return await self._countAttributes_async(projID, "/api/cubes/" + cube[0], cube, attributes, "OLAP")
+        if path == distinct_elem_count.REPORT_PATH:
+            return await self._countAttributes_async(projID, None, cube, attributes, "OLAP", stop_at_exceed=False)
+        if projID not in self.report_slots:
+            self.report_slots[projID] = asyncio.Semaphore(self.report_pool.size)
+        async with self.report_slots[projID]:
+            # the pool sends its requests through the blocking session, off the event loop
+            with self.metrics.phase("report"):
+                reportID = await asyncio.to_thread(self.report_pool.acquire, projID, attributes)
+            if reportID is not None and reportID != -1:
+                self._recordCubePath(projID, cube[0], distinct_elem_count.REPORT_PATH)
+                try:
+                    # like the sync engine, a cube read through a report goes on after an attribute over the limit
+                    return await self._countAttributes_async(projID, "/api/reports/" + reportID, cube, attributes, "OLAP", stop_at_exceed=False)
+                finally:
+                    with self.metrics.phase("report"):
+                        await asyncio.to_thread(self.report_pool.release, projID, reportID)
+        if reportID is None:
+            logging.info(f"Cube {cube[1]} skipped, no temporary report could be created")
+            return []
+        # managed objects cannot go into a report, read them from the cube directly
+        self._recordCubePath(projID, cube[0], distinct_elem_count.MANAGED_PATH)
+        return await self._countAttributes_async(projID, "/api/cubes/" + cube[0], cube, attributes, "OLAP")
+
+    async def countElem_MTDI_async(self, proj, certified_flag):
+        """
+        Count elements in the project's MTDI cubes
+
+        :param proj: [project id, project name]
+        :param certified_flag: true/false
+        """
+        start_time = time.time()
+        mtdi_cubes = await asyncio.to_thread(lambda: list(self.listCube(proj[0], "MTDI", certified_flag)))
+        logging.info(f"Count of MTDI cubes for indexing in {proj[1]}: {len(mtdi_cubes)}")
+        results = await asyncio.gather(*[self._costCube_async(proj[0], cube, "MTDI", self._countCube_MTDI_async(proj[0], cube)) for cube in mtdi_cubes])
+        for records, seconds in results:
+            for record in records:
+                self.add_record(proj[0], *record, cube_seconds=seconds)
+        logging.info(f"The sizing time for {proj[1]}'s MTDI cubes was: {time.time() - start_time} seconds")
+
+    async def countElem_OLAP_async(self, proj, certified_flag):
+        """
+        Count elements in the project's OLAP cubes, through the temporary reports of the report pool
+
+        :param proj: [project id, project name]
+        :param certified_flag: true/false
+        """
+        start_time = time.time()
+        olap_cubes = await asyncio.to_thread(lambda: list(self.listCube(proj[0], "OLAP", certified_flag)))
+        logging.info(f"Count of OLAP cubes for indexing in {proj[1]}: {len(olap_cubes)}")
+        try:
+            results = await asyncio.gather(*[self._costCube_async(proj[0], cube, "OLAP", self._countCube_OLAP_async(proj[0], cube)) for cube in olap_cubes])
+        finally:
+            with self.metrics.phase("report"):
+                await asyncio.to_thread(self.report_pool.releaseProject, proj[0])
+        for records, seconds in results:
+            for record in records:
+                self.add_record(proj[0], *record, cube_seconds=seconds)
+        logging.info(f"The sizing time for {proj[1]}'s OLAP cubes was: {time.time() - start_time} seconds")
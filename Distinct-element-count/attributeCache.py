@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+
+class AttributeCache:
+    """
+    LRU cache of distinct element results of schema attributes, shared across OLAP cubes.
+
+    Keyed by (project id, attribute id, base form ids). Keeps hit/miss statistics and can be
+    saved to and loaded from a JSON file to outlive the run. A result is used for ttl seconds
+    after it was counted, then the attribute is counted again, as its data may have changed.
+    The file records the server and user it was filled for, and is ignored for any other.
+    """
+    def __init__(self, capacity = 10000, path = None, ttl = 86400, base_url = None, username = None):
+        self.capacity = capacity
+        self.path = path
+        self.ttl = ttl
+        self.base_url = base_url
+        self.username = username
+        # key -> (result, time it was counted)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as cache_file:
+                saved = json.load(cache_file)
+        except (OSError, json.JSONDecodeError) as error:
+            logging.info(f"Attribute cache {self.path} ignored: {error}")
+            return
+        # files written by earlier versions are a bare list, without the server and user
+        if not isinstance(saved, dict) or (saved.get('base_url'), saved.get('username')) != (self.base_url, self.username):
+            logging.info(f"Attribute cache {self.path} ignored: it was not written for {self.username} on {self.base_url}")
+            return
+        saved = saved['entries']
+        now = time.time()
+        for entry in saved:
+            # entries of files written before results were timestamped have no age, count them again
+            if len(entry) == 5 and now - entry[4] < self.ttl:
+                self.put(*entry)
+        logging.info(f"Attribute cache: {len(self.entries)} of {len(saved)} entries loaded from {self.path}")
+
+    def _fresh(self, key):
+        """
+        :return: the result of an entry younger than ttl, else None; expired entries are dropped
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] >= self.ttl:
+            del self.entries[key]
+            return None
+        return entry[0]
+
+    def get(self, projID, attributeID, baseFormIds):
+        """
+        :return: the cached result, or None on a miss
+        """
+        key = (projID, attributeID, tuple(baseFormIds))
+        with self.lock:
+            result = self._fresh(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+            return None
+
+    def peek(self, projID, attributeID, baseFormIds):
+        """
+        :return: the cached result, or None, without touching the statistics or the LRU order
+        """
+        with self.lock:
+            return self._fresh((projID, attributeID, tuple(baseFormIds)))
+
+    def put(self, projID, attributeID, baseFormIds, result, stored = None):
+        """
+        :param stored: time the result was counted, by default now, or the time of the cached
+                       entry when it holds the same result, so reusing a result does not renew it
+        """
+        if self.capacity <= 0:
+            return
+        key = (projID, attributeID, tuple(baseFormIds))
+        with self.lock:
+            if stored is None:
+                previous = self.entries.get(key)
+                stored = previous[1] if previous is not None and previous[0] == result else time.time()
+            self.entries[key] = (result, stored)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        :return: dict with hits, misses, hit ratio and number of entries
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries)
+            }
+
+    def save(self):
+        """
+        Write the cache to its file, least recently used first, if it has one
+        """
+        if not self.path:
+            return
+        with self.lock:
+            entries = [[projID, attributeID, list(baseFormIds), result, stored]
+                       for (projID, attributeID, baseFormIds), (result, stored) in self.entries.items()]
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'base_url': self.base_url, 'username': self.username, 'entries': entries}, cache_file)
+        os.replace(temp_path, self.path)
+        logging.info(f"Attribute cache saved to {self.path}: {len(entries)} entries")
@@ -0,0 +1,89 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import elementCounter
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+def generatePages(element_count, distinct_count, page_size = 1000, seed = 0):
+    """
+    Synthetic element pages shaped like an attribute with an ID, a URL and an image path form.
+    The values are new strings on every page, as if decoded from a response.
+
+    :return: a generator of lists of formValues lists
+    """
+    rng = random.Random(seed)
+    for start in range(0, element_count, page_size):
+        page = []
+        for _ in range(min(page_size, element_count - start)):
+            key = rng.randrange(distinct_count)
+            page.append([
+                str(key),
+                f"https://www.example.com/catalog/products/category-{key % 97}/item-{key}?utm_source=library&ref={key * 7919}",
+                f"/images/products/large/{key % 1000:04d}/{key}-front-view-high-resolution.jpg"
+            ])
+        yield page
+
+
+def countNothing(pages, form_indices):
+    # generating the pages alone, the baseline of the other rows
+    for _ in pages:
+        pass
+    return []
+
+
+def countDataFrame(pages, form_indices):
+    # the counting of the original tool: all elements of the attribute in one DataFrame, nunique per form column
+    elements = [element for page in pages for element in page]
+    df = pd.DataFrame(elements)
+    return [int(df[index].nunique()) for index in form_indices]
+
+
+def countWith(counter_class):
+    def count(pages, form_indices):
+        counter = counter_class(form_indices)
+        for page in pages:
+            counter.add(page)
+        return counter.counts()
+    return count
+
+
+def measure(name, count, args, form_indices):
+    # timed and traced in separate runs, tracemalloc slows allocations down several times
+    start = time.perf_counter()
+    counts = count(generatePages(args.elements, args.distinct), form_indices)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    count(generatePages(args.elements, args.distinct), form_indices)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<14} {elapsed:8.3f} s {args.elements / elapsed:14,.0f} elements/s {peak / 2 ** 20:10.1f} MiB peak  {counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory and throughput of the distinct counting modes.')
+    parser.add_argument('-elements', metavar='N', type=int, default=1000000, help='Specify the number of elements')
+    parser.add_argument('-distinct', metavar='N', type=int, default=500000, help='Specify the number of distinct elements')
+    args = parser.parse_args()
+
+    form_indices = [0, 1, 2]
+    print(f"{args.elements} elements in pages of 1000, keys drawn from {args.distinct}, forms: ID, URL, image path")
+    measure("generate only", countNothing, args, form_indices)
+    if pd is not None:
+        measure("DataFrame", countDataFrame, args, form_indices)
+    measure("sets", countWith(elementCounter.DistinctCounter), args, form_indices)
+    measure("fingerprints", countWith(elementCounter.FingerprintDistinctCounter), args, form_indices)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mockServer
+
+# MSTRApp options of every scenario, run against the same mock environment
+SCENARIOS = {
+    'sequential': {},
+    'workers=8': {'workers': 8},
+    'compact sets': {'compact_sets': True},
+    'approx': {'approx_precision': 14},
+    'in-memory reports': {'workers': 8, 'in_memory_reports': True},
+    'workers=2': {'workers': 2}
+}
+# scenarios that count more OLAP cubes than they keep temporary reports, so the report pool must reuse some
+POOLED_SCENARIOS = ('sequential', 'workers=2')
+
+
+def runPipeline(base_url, options, results):
+    """
+    Run countElem_OLAP and countElem_MTDI over every project, in a fresh process so its peak RSS is its own
+    """
+    os.chdir(tempfile.mkdtemp(prefix="benchmark_"))
+    # keep the log out of the benchmark output; setup_logging leaves a configured root logger alone
+    logging.basicConfig(level=logging.INFO, handlers=[logging.FileHandler("app.log", encoding='utf-8')])
+    os.environ["MSTR_BASE_URL"] = base_url
+    os.environ["MSTR_USERNAME"] = "benchmark"
+    os.environ["MSTR_PASSWORD"] = "benchmark"
+    import distinct_elem_count
+
+    start = time.perf_counter()
+    mstr = distinct_elem_count.MSTRApp(**options)
+    for proj in mstr.listProjects():
+        mstr.setFolderID(proj[0])
+        mstr.countElem_OLAP(proj, False)
+        mstr.countElem_MTDI(proj, False)
+    # a report reused for another cube, as it is or redefined, saves a create and a delete
+    reports_reused = mstr.report_pool.round_trips['reuse'] + mstr.report_pool.round_trips['redefine']
+    mstr.report_pool.close()
+    mstr.closeRecords()
+    records = sum(mstr.results.totals()['records'].values())
+    phases = mstr.metrics.summary()['phases']
+    del mstr
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    results.put({'wall': elapsed, 'peak_rss': peak_rss, 'records': records, 'phases': phases, 'reports_reused': reports_reused})
+
+
+def runScenario(name, options, environment_options):
+    environment = mockServer.MockEnvironment(**environment_options)
+    server = mockServer.startServer(environment)
+    try:
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        process = context.Process(target=runPipeline, args=(f"http://127.0.0.1:{server.server_port}/MicroStrategyLibrary", options, results))
+        process.start()
+        result = results.get()
+        process.join()
+    finally:
+        server.shutdown()
+    result['requests'] = sum(environment.requests.values())
+    result['endpoints'] = dict(environment.requests)
+    # element pages and sample windows, the requests -workers must not multiply
+    result['element_requests'] = sum(count for endpoint, count in environment.requests.items() if endpoint.endswith("elements"))
+    result['bytes'] = environment.bytes_sent
+    # every login after the first one renews an expired token
+    result['relogins'] = environment.logins - 1
+    result['unauthorized'] = environment.unauthorized
+    # unsaved report instances go away with the session, only saved reports would be left behind
+    result['reports_left'] = sum(report['saved'] for report in environment.reports.values())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the OLAP and MTDI counting pipelines against the mock MSTR server.')
+    parser.add_argument('-projects', metavar='N', type=int, default=2, help='Specify the number of projects')
+    parser.add_argument('-olapCubes', metavar='N', type=int, default=5, help='Specify the number of OLAP cubes per project')
+    parser.add_argument('-mtdiCubes', metavar='N', type=int, default=5, help='Specify the number of MTDI cubes per project')
+    parser.add_argument('-attributes', metavar='N', type=int, default=8, help='Specify the number of attributes per cube')
+    parser.add_argument('-cardinalities', metavar='N,N', type=str, default="10,100,1000,5000,20000", help='Specify the element counts attributes are drawn from')
+    parser.add_argument('-latency', metavar='seconds', type=float, default=0.005, help='Specify the latency added to every request')
+    parser.add_argument('-errorRate', metavar='ratio', type=float, default=0.0, help='Specify the share of GET requests answered with 503')
+    parser.add_argument('-managedRate', metavar='ratio', type=float, default=0.2, help='Specify the share of OLAP cubes with managed objects, read from the cube instead of a report')
+    parser.add_argument('-unpublishedRate', metavar='ratio', type=float, default=0.1, help='Specify the share of cubes that are not published, their elements answer 500')
+    parser.add_argument('-tokenTtl', metavar='seconds', type=float, default=2.0, help='Specify how long an auth token is valid, the pipeline logs in again on the 401 that follows')
+    parser.add_argument('-streamErrorRate', metavar='ratio', type=float, default=0.0, help='Specify the share of element pages whose connection is dropped halfway through the body')
+    parser.add_argument('-scenarios', metavar='name', nargs='*', default=list(SCENARIOS), choices=list(SCENARIOS), help='Specify the scenarios to run')
+    parser.add_argument('-endpoints', action='store_true', help='Specify to print the requests per endpoint of every scenario')
+    parser.add_argument('-phases', action='store_true', help='Specify to print the seconds spent per phase of every scenario')
+    args = parser.parse_args()
+
+    environment_options = {
+        'projects': args.projects,
+        'olap_cubes': args.olapCubes,
+        'mtdi_cubes': args.mtdiCubes,
+        'attributes': args.attributes,
+        'cardinalities': [int(value) for value in args.cardinalities.split(",")],
+        'latency': args.latency,
+        'error_rate': args.errorRate,
+        'stream_error_rate': args.streamErrorRate,
+        'managed_rate': args.managedRate,
+        'unpublished_rate': args.unpublishedRate,
+        'token_ttl': args.tokenTtl
+    }
+    print(f"{args.projects} projects x ({args.olapCubes} OLAP + {args.mtdiCubes} MTDI cubes) x {args.attributes} attributes, "
+          f"cardinalities {args.cardinalities}, {args.latency * 1000:.0f} ms latency, {args.errorRate:.0%} errors, {args.streamErrorRate:.0%} broken element pages")
+    print(f"{args.managedRate:.0%} OLAP cubes with managed objects, {args.unpublishedRate:.0%} unpublished cubes, "
+          f"auth tokens valid for {args.tokenTtl} seconds")
+    print(f"{'scenario':<20} {'wall s':>8} {'requests':>9} {'elements':>9} {'MiB sent':>9} {'peak RSS MiB':>13} {'records':>8} {'reports reused':>15} {'reports left':>13} {'401s':>5} {'relogins':>9}")
+    for name in args.scenarios:
+        result = runScenario(name, SCENARIOS[name], environment_options)
+        print(f"{name:<20} {result['wall']:8.2f} {result['requests']:9} {result['element_requests']:9} {result['bytes'] / 2 ** 20:9.1f} "
+              f"{result['peak_rss'] / 2 ** 20:13.1f} {result['records']:8} {result['reports_reused']:15} {result['reports_left']:13} "
+              f"{result['unauthorized']:5} {result['relogins']:9}")
+        if name in POOLED_SCENARIOS and result['reports_reused'] == 0:
+            print(f"    !!! no temporary report was reused, the report pool did not run in {name}")
+        if args.endpoints:
+            for endpoint, count in sorted(result['endpoints'].items()):
+                print(f"    {count:7} {endpoint}")
+        if args.phases:
+            for phase, stats in result['phases'].items():
+                print(f"    {stats['seconds']:7.2f} s {phase} ({stats['count']})")
+
+
+if __name__ == "__main__":
+    main()
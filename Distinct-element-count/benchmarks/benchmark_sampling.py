@@ -0,0 +1,69 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import samplingEstimator
+
+
+def populations(total, seed = 0):
+    """
+    Synthetic form values of an attribute with total elements, in element order
+
+    :return: dict of name -> list of values
+    """
+    rng = random.Random(seed)
+    groups = max(total // 10, 1)
+    skewed = [int(groups * rng.random() ** 3) for _ in range(total)]
+    return {
+        # an ID or description form, one value per element
+        'unique': list(range(total)),
+        # a group form repeating with the element order, like the mock server's
+        'periodic groups': [index % groups for index in range(total)],
+        # a group form with values assigned at random
+        'random groups': [rng.randrange(groups) for _ in range(total)],
+        # a few values cover most elements, many are rare
+        'skewed': skewed,
+        # the same, with elements ordered by value: the worst case for windows
+        'sorted skewed': sorted(skewed)
+    }
+
+
+def sample(values, windows, window_size, seed):
+    return [values[offset:offset + window_size] for offset in samplingEstimator.sampleOffsets(len(values), windows, window_size, seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the sampling estimators with exact distinct counts on synthetic attributes.')
+    parser.add_argument('-elements', metavar='N', type=int, nargs='*', default=[100000, 1000000], help='Specify the element counts of the attributes')
+    parser.add_argument('-windows', metavar='N', type=int, default=20, help='Specify the number of windows per attribute')
+    parser.add_argument('-windowSize', metavar='N', type=int, default=1000, help='Specify the number of elements per window')
+    parser.add_argument('-trials', metavar='N', type=int, default=20, help='Specify the number of samples per attribute, with different window positions')
+    args = parser.parse_args()
+
+    print(f"{args.windows} windows of {args.windowSize} elements, {args.trials} trials, 95% confidence intervals")
+    print(f"{'attribute':<16} {'elements':>9} {'sampled':>8} {'exact':>9} {'method':<6} {'mean est.':>10} "
+          f"{'mean |err|':>10} {'max |err|':>10} {'coverage':>9} {'ms':>6}")
+    for total in args.elements:
+        for name, values in populations(total).items():
+            exact = len(set(values))
+            for method in samplingEstimator.METHODS:
+                estimates = []
+                covered = 0
+                start = time.perf_counter()
+                for trial in range(args.trials):
+                    sampled = sample(values, args.windows, args.windowSize, trial)
+                    estimate, low, high = samplingEstimator.estimate(sampled, total, method)
+                    estimates.append(estimate)
+                    covered += low <= exact <= high
+                elapsed = (time.perf_counter() - start) / args.trials
+                errors = [abs(estimate - exact) / exact for estimate in estimates]
+                print(f"{name:<16} {total:9} {sum(map(len, sampled)):8} {exact:9} {method:<6} {sum(estimates) / len(estimates):10.0f} "
+                      f"{sum(errors) / len(errors):10.1%} {max(errors):10.1%} {covered / args.trials:9.0%} {elapsed * 1000:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
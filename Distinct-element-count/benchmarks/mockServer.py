@@ -0,0 +1,385 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SEARCH_TYPE_FOLDER = 8
+SUBTYPE_OLAP_CUBE = 776
+SUBTYPE_MTDI_CUBE = 779
+
+
+def objectId(*parts):
+    """
+    :return: a deterministic 32 character hex id, shaped like MSTR object ids
+    """
+    return hashlib.md5("/".join(map(str, parts)).encode()).hexdigest().upper()
+
+
+class MockEnvironment:
+    """
+    Synthetic MicroStrategy environment served by the mock server.
+
+    Every project has a folder with full access, OLAP cubes drawing their attributes from a
+    schema shared by the project, and MTDI cubes with attributes of their own. An attribute
+    has an integer ID form and two string forms: a description unique per element and a group
+    with a tenth as many values. Elements are generated on request, so even large
+    cardinalities cost no memory.
+
+    A managed OLAP cube has one managed object of its own among its schema attributes; a report
+    holding it is refused with 400, reports of the other OLAP cubes are created as usual.
+    Unpublished cubes are listed as loaded, but their elements answer 500; unloaded cubes have
+    status 0 and are left out by the tool. With token_ttl, auth tokens expire that many seconds
+    after the login, and requests with an expired token are rejected with 401.
+    """
+    def __init__(self, projects = 3, olap_cubes = 5, mtdi_cubes = 5, attributes = 8, cardinalities = (10, 100, 1000, 5000, 20000),
+                 latency = 0.0, error_rate = 0.0, managed_rate = 0.0, unpublished_rate = 0.0, seed = 0, stream_error_rate = 0.0,
+                 unloaded_rate = 0.0, token_ttl = None):
+        rng = random.Random(seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        # share of element pages whose connection is dropped halfway through the body
+        self.stream_error_rate = stream_error_rate
+        self.broken_streams = 0
+        self.token_ttl = token_ttl
+        # auth token -> time it expires
+        self.tokens = {}
+        self.logins = 0
+        self.unauthorized = 0
+        self.rng = random.Random(seed + 1)
+        self.projects = []
+        self.folders = {}
+        # project id -> list of search items
+        self.cubes = {}
+        # cube id -> list of attribute ids
+        self.cube_attributes = {}
+        self.cube_status = {}
+        self.managed_cubes = set()
+        # managed objects of the managed cubes, the attributes that cannot go into a report
+        self.managed_attributes = set()
+        self.unpublished_cubes = set()
+        # attribute id -> (name, cardinality)
+        self.attributes = {}
+        for p in range(projects):
+            projID = objectId("project", seed, p)
+            self.projects.append({'id': projID, 'name': f"Project {p}"})
+            self.folders[projID] = [{'id': objectId("folder", projID, 0), 'name': "Public Objects", 'acg': 255}]
+            schema = []
+            for a in range(attributes * 3):
+                attributeID = objectId("schema attribute", projID, a)
+                self.attributes[attributeID] = (f"Attribute {a}", rng.choice(cardinalities))
+                schema.append(attributeID)
+            self.cubes[projID] = []
+            for c in range(olap_cubes + mtdi_cubes):
+                olap = c < olap_cubes
+                cubeID = objectId("cube", projID, c)
+                if olap:
+                    self.cube_attributes[cubeID] = rng.sample(schema, min(attributes, len(schema)))
+                    if rng.random() < managed_rate:
+                        # one managed object of the cube's own takes the place of a schema attribute
+                        self.managed_cubes.add(cubeID)
+                        attributeID = objectId("managed attribute", cubeID)
+                        self.attributes[attributeID] = ("Managed attribute", rng.choice(cardinalities))
+                        self.managed_attributes.add(attributeID)
+                        self.cube_attributes[cubeID][-1] = attributeID
+                else:
+                    self.cube_attributes[cubeID] = []
+                    for a in range(attributes):
+                        attributeID = objectId("cube attribute", cubeID, a)
+                        self.attributes[attributeID] = (f"Column {a}", rng.choice(cardinalities))
+                        self.cube_attributes[cubeID].append(attributeID)
+                self.cube_status[cubeID] = 0 if rng.random() < unloaded_rate else 1
+                if rng.random() < unpublished_rate:
+                    self.unpublished_cubes.add(cubeID)
+                self.cubes[projID].append({
+                    'id': cubeID,
+                    'name': f"{'OLAP' if olap else 'MTDI'} cube {c}",
+                    'subtype': SUBTYPE_OLAP_CUBE if olap else SUBTYPE_MTDI_CUBE,
+                    'dateModified': "2024-01-01T00:00:00.000+0000"
+                })
+        self.certified = {projID: objectId("dossier", projID) for projID in self.cubes}
+        # report id -> {'attributes', 'saved'}
+        self.reports = {}
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.bytes_sent = 0
+
+    def newToken(self):
+        with self.lock:
+            self.logins += 1
+            token = objectId("token", time.time(), self.logins)
+            self.tokens[token] = time.time() + (self.token_ttl or 0)
+        return token
+
+    def validToken(self, token):
+        with self.lock:
+            return time.time() < self.tokens.get(token, 0)
+
+    def cubeDefinition(self, cubeID):
+        attributes = []
+        for attributeID in self.cube_attributes[cubeID]:
+            name, _ = self.attributes[attributeID]
+            attributes.append({'id': attributeID, 'name': name, 'forms': [
+                {'id': objectId("form", "ID"), 'name': "ID", 'dataType': "integer"},
+                {'id': objectId("form", "DESC"), 'name': "DESC", 'dataType': "varChar"},
+                {'id': objectId("form", "GROUP"), 'name': "Group", 'dataType': "nVarChar"}
+            ]})
+        return {'definition': {'availableObjects': {'attributes': attributes}}}
+
+    def elements(self, attributeID, offset, limit):
+        """
+        :return: (the requested page of elements, total element count)
+        """
+        name, cardinality = self.attributes[attributeID]
+        end = cardinality if limit < 0 else min(cardinality, offset + limit)
+        groups = max(1, cardinality // 10)
+        page = [{'id': f"h{i};{attributeID}", 'formValues': [str(i), f"{name} {i}", f"{name} group {i % groups}"]}
+                for i in range(offset, end)]
+        return page, cardinality
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        env = self.server.environment
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if parts[0] not in ("api", "mock"):
+            # drop the application path of the base url, e.g. /MicroStrategyLibrary
+            parts = parts[1:]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        endpoint = self._endpoint(method, parts)
+        with env.lock:
+            env.requests[endpoint] += 1
+        if env.latency:
+            time.sleep(env.latency)
+        if env.token_ttl is not None and parts[0] == "api" and parts[1] != "auth" and not env.validToken(self.headers.get('X-MSTR-AuthToken')):
+            with env.lock:
+                env.unauthorized += 1
+            return self._reply(401, {'message': "auth token expired"})
+        if method == "GET" and endpoint != "GET /mock/stats" and env.error_rate and env.rng.random() < env.error_rate:
+            return self._reply(503, {'message': "injected error"})
+        handler = getattr(self, "_" + endpoint.replace(" ", "_").replace("/", "_").replace("{", "").replace("}", "").replace("-", "_"), None)
+        if handler is None:
+            return self._reply(404, {'message': f"no mock for {method} {url.path}"})
+        handler(env, parts, query, body)
+
+    def _endpoint(self, method, parts):
+        # the path with the ids replaced by placeholders, e.g. GET /api/cubes/{id}/attributes/{id}/elements
+        names = []
+        for index, part in enumerate(parts):
+            names.append("{id}" if index > 1 and len(part) == 32 else part)
+        return method + " /" + "/".join(names)
+
+    def _reply(self, status, payload = None, headers = None):
+        data = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        if payload is not None:
+            self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.environment.lock:
+            self.server.environment.bytes_sent += len(data)
+
+    def _project(self):
+        return self.headers.get('X-MSTR-ProjectID')
+
+    def _POST__api_auth_login(self, env, parts, query, body):
+        self._reply(204, headers={'X-MSTR-AuthToken': env.newToken(), 'Set-Cookie': "JSESSIONID=mock; Path=/"})
+
+    def _POST__api_auth_logout(self, env, parts, query, body):
+        self._reply(204)
+
+    def _POST__api_auth_apiTokens(self, env, parts, query, body):
+        self._reply(201, {'apiToken': objectId("api token", time.time())})
+
+    def _replyDefinition(self, payload):
+        """
+        Answer with an ETag, or 304 Not Modified if the client already has this version
+        """
+        etag = '"' + hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._reply(304, headers={'ETag': etag})
+        self._reply(200, payload, {'ETag': etag})
+
+    def _GET__api_projects(self, env, parts, query, body):
+        self._reply(200, env.projects)
+
+    def _GET__api_dossiers(self, env, parts, query, body):
+        self._reply(200, {'result': [{'id': env.certified[self._project()]}]})
+
+    def _GET__api_v2_dossiers_id_definition(self, env, parts, query, body):
+        # the certified dashboard uses every other cube of the project
+        self._replyDefinition({'datasets': [{'id': cube['id']} for cube in env.cubes[self._project()][::2]]})
+
+    def _GET__api_cubes(self, env, parts, query, body):
+        self._reply(200, {'cubesInfos': [{'cubeId': cubeID, 'status': env.cube_status[cubeID], 'lastUpdateTime': "2024-01-01T00:00:00.000+0000"}
+                                         for cubeID in query.get('id', []) if cubeID in env.cube_status]})
+
+    def _GET__api_searches_results(self, env, parts, query, body):
+        objectType = int(query['type'][0])
+        offset = int(query.get('offset', ["0"])[0])
+        limit = int(query.get('limit', ["-1"])[0])
+        if objectType == SEARCH_TYPE_FOLDER:
+            items = env.folders[self._project()]
+        else:
+            items = [cube for cube in env.cubes[self._project()] if cube['subtype'] == objectType]
+        if 'name' in query:
+            items = [item for item in items if query['name'][0] in item['name']]
+        page = items[offset:] if limit < 0 else items[offset:offset + limit]
+        self._reply(200, {'totalItems': len(items), 'result': page})
+
+    def _GET__api_v2_cubes_id(self, env, parts, query, body):
+        if parts[3] not in env.cube_attributes:
+            return self._reply(404, {'message': "cube not found"})
+        self._replyDefinition(env.cubeDefinition(parts[3]))
+
+    def _GET__api_cubes_id_attributes_id_elements(self, env, parts, query, body):
+        if env.cube_status.get(parts[2]) == 0 or parts[2] in env.unpublished_cubes:
+            return self._reply(500, {'message': "cube is not published"})
+        self._elements(env, parts[4], query)
+
+    def _GET__api_reports_id_attributes_id_elements(self, env, parts, query, body):
+        if parts[2] not in env.reports:
+            return self._reply(404, {'message': "report not found"})
+        self._elements(env, parts[4], query)
+
+    def _elements(self, env, attributeID, query):
+        if attributeID not in env.attributes:
+            return self._reply(404, {'message': "attribute not found"})
+        page, total = env.elements(attributeID, int(query.get('offset', ["0"])[0]), int(query.get('limit', ["-1"])[0]))
+        if page and env.stream_error_rate and env.rng.random() < env.stream_error_rate:
+            return self._replyBroken(page, {'X-MSTR-Total-Count': str(total)})
+        self._reply(200, page, headers={'X-MSTR-Total-Count': str(total)})
+
+    def _replyBroken(self, payload, headers):
+        """
+        Announce the whole body, send half of it and drop the connection
+        """
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data[:len(data) // 2])
+        self.wfile.flush()
+        self.close_connection = True
+        with self.server.environment.lock:
+            self.server.environment.broken_streams += 1
+            self.server.environment.bytes_sent += len(data) // 2
+
+    def _report(self, env, body):
+        units = json.loads(body)['dataSource']['dataTemplate']['units']
+        attributeIDs = [unit['id'] for unit in units]
+        # managed objects are not schema objects and cannot be put on a report
+        managed = any(attributeID in env.managed_attributes for attributeID in attributeIDs)
+        return attributeIDs, managed
+
+    def _POST__api_model_reports(self, env, parts, query, body):
+        attributeIDs, managed = self._report(env, body)
+        if managed:
+            return self._reply(400, {'message': "managed objects cannot be used in a report"})
+        reportID = objectId("report", time.time(), len(env.reports), threading.get_ident())
+        with env.lock:
+            env.reports[reportID] = {'attributes': attributeIDs, 'saved': False}
+        self._reply(201, {'information': {'objectId': reportID}}, headers={'X-MSTR-MS-Instance': objectId("instance", reportID)})
+
+    def _PUT__api_model_reports_id(self, env, parts, query, body):
+        if parts[3] not in env.reports:
+            return self._reply(404, {'message': "report not found"})
+        attributeIDs, managed = self._report(env, body)
+        if managed:
+            return self._reply(400, {'message': "managed objects cannot be used in a report"})
+        env.reports[parts[3]]['attributes'] = attributeIDs
+        self._reply(200, {'information': {'objectId': parts[3]}})
+
+    def _POST__api_model_reports_id_instances_save(self, env, parts, query, body):
+        if parts[3] not in env.reports:
+            return self._reply(404, {'message': "report not found"})
+        env.reports[parts[3]]['saved'] = True
+        self._reply(201, {})
+
+    def _DELETE__api_objects_id(self, env, parts, query, body):
+        with env.lock:
+            report = env.reports.pop(parts[2], None)
+        self._reply(404 if report is None else 204)
+
+    def _GET__mock_stats(self, env, parts, query, body):
+        with env.lock:
+            stats = {'requests': dict(env.requests), 'bytes_sent': env.bytes_sent, 'reports_left': len(env.reports),
+                     'broken_streams': env.broken_streams, 'logins': env.logins, 'unauthorized': env.unauthorized}
+        self._reply(200, stats)
+
+
+def startServer(environment, port = 0):
+    """
+    Serve an environment on localhost from a background thread
+
+    :return: the ThreadingHTTPServer, its url is f"http://127.0.0.1:{server.server_port}"
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    server.environment = environment
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic MicroStrategy environment for local runs and benchmarks.')
+    parser.add_argument('-port', metavar='N', type=int, default=8080, help='Specify the port to listen on')
+    parser.add_argument('-projects', metavar='N', type=int, default=3, help='Specify the number of projects')
+    parser.add_argument('-olapCubes', metavar='N', type=int, default=5, help='Specify the number of OLAP cubes per project')
+    parser.add_argument('-mtdiCubes', metavar='N', type=int, default=5, help='Specify the number of MTDI cubes per project')
+    parser.add_argument('-attributes', metavar='N', type=int, default=8, help='Specify the number of attributes per cube')
+    parser.add_argument('-cardinalities', metavar='N,N', type=str, default="10,100,1000,5000,20000", help='Specify the element counts attributes are drawn from')
+    parser.add_argument('-latency', metavar='seconds', type=float, default=0.0, help='Specify the latency added to every request')
+    parser.add_argument('-errorRate', metavar='ratio', type=float, default=0.0, help='Specify the share of GET requests answered with 503')
+    parser.add_argument('-managedRate', metavar='ratio', type=float, default=0.0, help='Specify the share of OLAP cubes with managed objects')
+    parser.add_argument('-unpublishedRate', metavar='ratio', type=float, default=0.0, help='Specify the share of cubes that are listed but not published, their elements answer 500')
+    parser.add_argument('-unloadedRate', metavar='ratio', type=float, default=0.0, help='Specify the share of cubes that are not loaded (status 0)')
+    parser.add_argument('-tokenTtl', metavar='seconds', type=float, default=None, help='Specify how long an auth token is valid, requests with an expired token answer 401')
+    parser.add_argument('-streamErrorRate', metavar='ratio', type=float, default=0.0, help='Specify the share of element pages whose connection is dropped halfway through the body')
+    parser.add_argument('-seed', metavar='N', type=int, default=0, help='Specify the seed of the generated environment')
+    args = parser.parse_args()
+
+    environment = MockEnvironment(args.projects, args.olapCubes, args.mtdiCubes, args.attributes,
+                                  [int(value) for value in args.cardinalities.split(",")], args.latency, args.errorRate,
+                                  args.managedRate, args.unpublishedRate, args.seed, args.streamErrorRate,
+                                  args.unloadedRate, args.tokenTtl)
+    server = startServer(environment, args.port)
+    print(f"Mock MSTR Library at http://127.0.0.1:{server.server_port}/MicroStrategyLibrary, Ctrl-C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
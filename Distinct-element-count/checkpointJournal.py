@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+import logging
+
+
+class CheckpointJournal:
+    """
+    Append-only JSON-lines journal of completed (project, cube, attribute) units.
+
+    Each line holds the distinct element result of one attribute, or the path an OLAP cube
+    was counted through. Lines are buffered and written in batches, so journaling stays off
+    the hot path; a resumed run reads the journal back and skips the units it already contains.
+    """
+    def __init__(self, path, resume = False, batch_size = 100, flush_interval = 5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.completed = {}
+        self.cube_paths = {}
+        if resume:
+            self._load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self.file.tell() and not self._endsWithNewline():
+            # start after the partial line instead of gluing the next entry onto it
+            self.file.write('\n')
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be cut short by the crash we are resuming from
+                    continue
+                if 'attribute' in entry:
+                    self.completed[(entry['project'], entry['cube'], entry['attribute'])] = entry['result']
+                else:
+                    self.cube_paths[(entry['project'], entry['cube'])] = entry['path']
+        logging.info(f"Resuming from {self.path}: {len(self.completed)} attributes already counted")
+
+    def _endsWithNewline(self):
+        with open(self.path, 'rb') as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b'\n'
+
+    def get(self, projID, cubeID, attributeID):
+        """
+        :return: the journaled result of a unit, or None if it has not been completed
+        """
+        return self.completed.get((projID, cubeID, attributeID))
+
+    def isCompleted(self, projID, cubeID, attributeID):
+        return (projID, cubeID, attributeID) in self.completed
+
+    def record(self, projID, cubeID, attributeID, result):
+        """
+        Journal the result of a completed unit
+
+        :param result: distinct element counts as returned by listElements_MTDI/OLAP
+        """
+        line = json.dumps({'project': projID, 'cube': cubeID, 'attribute': attributeID, 'result': result})
+        with self.lock:
+            self.completed[(projID, cubeID, attributeID)] = result
+            self._append(line)
+
+    def getPath(self, projID, cubeID):
+        """
+        :return: the journaled path of an OLAP cube, "report" or "managed", or None
+        """
+        return self.cube_paths.get((projID, cubeID))
+
+    def recordPath(self, projID, cubeID, path):
+        """
+        Journal the path an OLAP cube is counted through, a resumed run counting it from the
+        journaled results alone takes the same one
+        """
+        line = json.dumps({'project': projID, 'cube': cubeID, 'path': path})
+        with self.lock:
+            if self.cube_paths.get((projID, cubeID)) == path:
+                return
+            self.cube_paths[(projID, cubeID)] = path
+            self._append(line)
+
+    def _append(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.file.write('\n'.join(self.buffer) + '\n')
+            self.file.flush()
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._flush()
+                self.file.close()
@@ -1,11 +1,27 @@
-import requests
 import os
 import json
-import pandas as pd
-import csv
-import generateJson
+import elementCounter
+import hyperLogLog
+import jsonStream
+import checkpointJournal
+import incrementalState
+import attributeCache
+import metadataCache
+import restSession
+import instrumentation
+import reportPool
+import resultSink
+import resultStore
+import runBudget
+import samplingEstimator
 import logging
 import time
+import math
+import itertools
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 is_verified = True
 
@@ -22,29 +38,165 @@ indexed_forms = {
     'longVarChar'
 }
 
+# number of cube ids sent in one /api/cubes status request
+cube_status_batch = 100
+# element pages are read from the response in chunks of this many bytes
+stream_chunk_size = 65536
+# and handed to the counter in batches of this many elements
+element_batch = 1000
+
+# object types used by /api/searches/results
+SEARCH_TYPE_FOLDER = 8
+SUBTYPE_OLAP_CUBE = 776
+SUBTYPE_MTDI_CUBE = 779
+# EnumDSSXMLSearchTypes: match names that contain the given text
+SEARCH_PATTERN_CONTAINS = 4
+
+# paths an OLAP cube is counted through: a temporary report, or the cube itself when it holds managed objects
+REPORT_PATH = "report"
+MANAGED_PATH = "managed"
+
+# result of an attribute whose elements could not be fetched, logged and counted again by the next run
+FETCH_FAILED = "failed"
+
+# result of an attribute that was dropped because an attribute before it already ended its cube
+SKIPPED = "skipped"
+
+
+class AttributeCutoff:
+    """
+    Position of the first attribute of a cube whose result ends the cube: an unpublished cube, or
+    with stop_at_exceed an attribute over the element limit. The attributes after it are not
+    recorded, so with -workers their fetches check the cutoff before they start and between
+    element batches, and the attributes fetched ahead grow only as attributes complete, instead
+    of downloading what a sequential run would never have asked for.
+    """
+    def __init__(self, attributes, stop_at_exceed = True):
+        self.positions = {}
+        for position, attribute in enumerate(attributes):
+            self.positions.setdefault(attribute[0], position)
+        self.stop_at_exceed = stop_at_exceed
+        self.position = math.inf
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def observe(self, attribute, result):
+        """
+        Move the cutoff to this attribute if its result ends the cube
+        """
+        ends = result == -1 or (self.stop_at_exceed and (result == 10000 or isinstance(result, dict)))
+        with self.lock:
+            if ends:
+                self.position = min(self.position, self.positions[attribute[0]])
+            else:
+                self.completed += 1
+
+    def lookahead(self):
+        """
+        Number of attributes that may be fetched at once: one more than the attributes that did not end
+        the cube so far, so a cube ending early does not have all its attributes in flight
+        """
+        with self.lock:
+            return self.completed + 1
+
+    def isCut(self, attribute):
+        """
+        :return: true if the attribute comes after the one that ended the cube
+        """
+        return self.positions[attribute[0]] > self.position
+
 
 class MSTRApp:
-    def __init__(self) -> None:
+    def __init__(self, pool_size = 10, timeout = 300, workers = 1, search_page_size = 1000, approx_precision = None,
+                 checkpoint_path = None, resume = False, state_path = None, attribute_cache_size = 10000,
+                 attribute_cache_path = None, report_pool_size = None, in_memory_reports = False, max_rps = None,
+                 latency_target = None, compact_sets = False, output_format = "csv", output_dir = ".", result_db = None,
+                 metadata_cache_path = None, metadata_ttl = 86400, time_budget = None, max_requests = None,
+                 sample_windows = None, sample_window_size = 1000, sample_method = "chao1", attribute_cache_ttl = 86400) -> None:
         self.base_url = os.getenv("MSTR_BASE_URL")
         self.username = os.getenv("MSTR_USERNAME")
         self.password = os.getenv("MSTR_PASSWORD")
         self.destinationFolderID = os.getenv("MSTR_DESTINATIONFOLDERID")
-        self.elem_count_OLAP = []
-        self.elem_count_MTDI = []
-        self.elem_exceeded_limit = []
+        # request, phase and per-cube timings of the run
+        self.metrics = instrumentation.Metrics()
+        # cube tasks and element fetches can both be in flight, so keep enough connections for both pools
+        self.session = restSession.RestSession(self.base_url, max(pool_size, 2 * workers), timeout, is_verified,
+                                               max_rps, latency_target, metrics=self.metrics)
+        self.workers = workers
+        self.search_page_size = search_page_size
+        # HyperLogLog precision of the approximate mode, None for exact counts
+        self.approx_precision = approx_precision
+        # exact counts on 64-bit fingerprints of the form values instead of the values
+        self.compact_sets = compact_sets
+        # attributes over the element limit are estimated from sample_windows windows of their elements, None to skip them
+        self.sample_windows = sample_windows
+        self.sample_window_size = sample_window_size
+        self.sample_method = sample_method
+        self.journal = None
+        # previous results of unchanged cubes, only in incremental mode
+        self.state = incrementalState.IncrementalState(state_path) if state_path else None
+        # OLAP schema attributes recur across cubes, their results are shared through this cache
+        self.attribute_cache = attributeCache.AttributeCache(attribute_cache_size, attribute_cache_path, attribute_cache_ttl,
+                                                             self.base_url, self.username)
+        # shared attributes being counted, so cubes counted at the same time wait for the result instead of fetching it again
+        self.shared_fetches = {}
+        self.shared_lock = threading.Lock()
+        # projects, report folders, cube definitions and certified dashboards, kept for metadata_ttl seconds
+        self.metadata_cache = metadataCache.MetadataCache(metadata_cache_path, metadata_ttl, self.base_url, self.username)
+        # temporary reports of OLAP cubes are redefined and reused instead of being created per cube
+        self.report_pool = reportPool.ReportPool(self, report_pool_size or workers, in_memory_reports)
+        self.cube_executor = None
+        self.element_executor = None
+        if workers > 1:
+            self.cube_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cube")
+            self.element_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="element")
+        self.record_lock = threading.Lock()
+        # (project id, cube id) -> cube status, kept for the whole run
+        self.cube_status = {}
+        # (project id, cube id) -> last data update time reported with the status
+        self.cube_updated = {}
+        # (project id, cube id) -> version string compared by the incremental mode
+        self.cube_versions = {}
+        # (project id, cube id) -> dateModified of the cube definition, the version of its cached attributes
+        self.cube_modified = {}
+        # project id -> ids of the cubes used by certified dashboards, shared by OLAP and MTDI
+        self.certified_cubes = {}
+        self.certified_lock = threading.Lock()
+        # with a time or request budget, work stops once it is spent and the rest is deferred
+        self.budget = None
+        if time_budget is not None or max_requests is not None:
+            self.budget = runBudget.RunBudget(time_budget, max_requests, self.metrics)
+        # project id -> (cube id, attribute id) -> count of the last run, from the result database
+        self.count_history = {}
+        # project id -> destination folder of its temporary reports
+        self.project_folders = {}
+        # (project id, cube id) -> attributes listed while planning, used once by listAttributes
+        self.planned_attributes = {}
+        # records are streamed to the output files as cubes complete
+        # with result_db, records are also kept in a SQLite database holding the earlier runs
+        store = resultStore.ResultStore(result_db, self.base_url) if result_db else None
+        self.results = resultSink.ResultWriter(output_format, output_dir, approx_precision is not None, store=store,
+                                               sampled=sample_windows is not None)
+        self.api_token = None
+        # expired auth tokens are renewed by logging in again, in the middle of any request
+        self.session.relogin = self.reauthenticate
         self.setup_logging()
+        if checkpoint_path:
+            self.journal = checkpointJournal.CheckpointJournal(checkpoint_path, resume)
         self.login()
         a = 1
 
     # logout of the MSTR session and clear the cookies when the object is out of scope
     def __del__(self):
-        url = self.base_url + "/api/auth/logout"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken
-        }
-        response = requests.request("POST", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
-        self.cookies.clear()
+        self.report_pool.close()
+        if self.journal is not None:
+            self.journal.close()
+        for executor in (self.cube_executor, self.element_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        response = self.session.request("POST", "/api/auth/logout")
+        self.session.clear()
+        self.session.close()
         logging.info("Logged out of MSTR")
 
     def login(self, login_mode = 1, api_token = None):
@@ -74,22 +226,19 @@ class MSTRApp:
                 "loginMode": DssXmlAuthApiToken
             }
 
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
         logging.info("Logging in to " + url)
-        response = requests.request("POST", url, json=payload, headers=headers, verify=is_verified)
-        self.cookies = response.cookies
+        self.session.clear()
+        response = self.session.request("POST", "/api/auth/login", json=payload)
 
         if response.status_code == 204:
             headers = response.headers
             self.authtoken = headers['X-MSTR-AuthToken']
+            self.session.setAuthToken(self.authtoken)
             logging.info("Login success")
         else:
             logging.info("Login failed")
             logging.info(response.text)
-            exit(1)
+            raise restSession.AuthenticationError(f"Login to {url} failed with status {response.status_code}")
 
     def apiToken(self , GUID: str):
         url = self.base_url + "/api/auth/apiTokens"
@@ -97,13 +246,8 @@ class MSTRApp:
             "userId": GUID
         }
 
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken
-        }
-
         logging.info("Get apiToken in to " + url)
-        response = requests.request("POST", url, json=payload, headers=headers, cookies=self.cookies, verify=is_verified)
-        self.cookies = response.cookies
+        response = self.session.request("POST", "/api/auth/apiTokens", json=payload)
 
         if response.status_code == 204 or response.status_code == 201:
             jsonResponse = response.json()
@@ -112,10 +256,19 @@ class MSTRApp:
         else:
             logging.info("Login failed")
             logging.info(response.text)
-            exit(1)
+            raise restSession.AuthenticationError(f"API token request to {url} failed with status {response.status_code}")
         
         self.login(login_mode=DssXmlAuthApiToken, api_token=self.api_token)
  
+    def reauthenticate(self):
+        """
+        Log in again the same way as before, after the auth token has expired
+        """
+        if self.api_token is not None:
+            self.login(login_mode=DssXmlAuthApiToken, api_token=self.api_token)
+        else:
+            self.login()
+
     def setup_logging(self):
         if os.path.exists("app.log"):
             os.remove("app.log")
@@ -131,19 +284,11 @@ class MSTRApp:
 
         :return: a list of project ids in the environment
         """
-        url = self.base_url + "/api/projects"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'Content-Type': 'application/json'
-        }
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
-        if response.status_code != 200:
-            return []
-        jsonResponse = response.json()
-
         # return the list of projects in the form of project id and project name
-        return [(project['id'], project['name']) for project in jsonResponse]
+        projects = self._getMetadata(None, "/api/projects", lambda jsonResponse: [(project['id'], project['name']) for project in jsonResponse])
+        if projects is None:
+            return []
+        return [tuple(project) for project in projects]
 
         # logging.info(json.dumps(jsonResponse, indent=4, sort_keys=True))
    
@@ -154,21 +299,8 @@ class MSTRApp:
         :param projID: project id
         :return: a list of dashboard ids
         """
-
-        url = self.base_url + "/api/dossiers?certifiedStatus=CERTIFIED_ONLY"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
-        if response.status_code != 200:
-            return []
-        jsonResponse = response.json()
-
-        # return the list of projects in the form of project id and project name
-        return [dashboard['id'] for dashboard in jsonResponse['result']]
+        return self._getMetadata(projID, "/api/dossiers?certifiedStatus=CERTIFIED_ONLY",
+                                 lambda jsonResponse: [dashboard['id'] for dashboard in jsonResponse['result']]) or []
     
     def listCube_CertifiedDashboard(self, projID, dashboardID):
         """
@@ -178,22 +310,54 @@ class MSTRApp:
         :param dashboardID: dashboard id 
         :return: a list of cube ids that's in the dashboard
         """
-
-        url = self.base_url + "/api/v2/dossiers/" + dashboardID + "/definition"
-        payload = {}
         headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'dossierId': dashboardID,
-            'Content-Type': 'application/json'
+            'dossierId': dashboardID
         }
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
-        if response.status_code != 200:
-            return []
-        jsonResponse = response.json()
+        return self._getMetadata(projID, "/api/v2/dossiers/" + dashboardID + "/definition",
+                                 lambda jsonResponse: [cube['id'] for cube in jsonResponse['datasets']], headers=headers) or []
 
-        # return the list of projects in the form of project id and project name
-        return [cube['id'] for cube in jsonResponse['datasets']]
+    def certifiedCubes(self, projID):
+        """
+        Get the cubes used by the certified dashboards of a project, looked up once per project
+
+        :param projID: project id
+        :return: a set of cube ids
+        """
+        with self.certified_lock:
+            if projID not in self.certified_cubes:
+                cubesInCertified = set()
+                for dashboard_id in self.listCertifiedDashboard(projID):
+                    cubesInCertified.update(self.listCube_CertifiedDashboard(projID, dashboard_id))
+                self.certified_cubes[projID] = cubesInCertified
+            return self.certified_cubes[projID]
+
+    def _getMetadata(self, projID, path, parse, version = None, headers = None, phase = "metadata"):
+        """
+        GET a metadata object through the metadata cache. An expired entry is revalidated with
+        If-None-Match/If-Modified-Since and kept if the server answers 304 Not Modified.
+
+        :param projID: project id, None for environment-wide objects
+        :param path: request path, also the cache key
+        :param parse: function turning the response JSON into the cached value
+        :param version: the cached value is only used for the same version
+        :param headers: additional request headers
+        :param phase: metrics phase of the request
+        :return: parse(response JSON), None if the request failed
+        """
+        cached = self.metadata_cache.get(projID, path, version)
+        if cached is not None:
+            return cached
+        request_headers = dict(headers or {})
+        request_headers.update(self.metadata_cache.validators(projID, path, version))
+        with self.metrics.phase(phase):
+            response = self.session.request("GET", path, projID=projID, headers=request_headers)
+        if response.status_code == 304:
+            return self.metadata_cache.revalidate(projID, path)
+        if response.status_code != 200:
+            return None
+        value = parse(response.json())
+        self.metadata_cache.put(projID, path, value, version, response.headers)
+        return value
 
     def getCubeStatus(self, projID, cubeID):
         """
@@ -203,61 +367,123 @@ class MSTRApp:
         :param cubeID: cube id
         :return: status code of the cube
         """
+        return self.getCubeStatuses(projID, [cubeID])[cubeID]
 
-        url = self.base_url + "/api/cubes?id=" + cubeID
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-
-        params = {
-        }
-
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, params=params, verify=is_verified)
-        if response.status_code != 200:
-            return ""
-        response_text = response.text
+    def getCubeStatuses(self, projID, cubeIDs):
+        """
+        Get the status codes of several cubes, asking for up to cube_status_batch ids per request.
+        Statuses are cached for the run, so only unseen cubes are requested.
 
-        results = json.loads(response_text)
-        return results["cubesInfos"][0]["status"]
+        :param projID: project id
+        :param cubeIDs: cube ids
+        :return: a dict of cube id -> status code, "" if the status could not be read
+        """
+        missing = [cubeID for cubeID in dict.fromkeys(cubeIDs) if (projID, cubeID) not in self.cube_status]
+        for start in range(0, len(missing), cube_status_batch):
+            batch = missing[start:start + cube_status_batch]
+            params = {
+                'id': batch
+            }
+            with self.metrics.phase("status"):
+                response = self.session.request("GET", "/api/cubes", projID=projID, params=params)
+            if response.status_code != 200:
+                continue
+            response_text = response.text
+
+            results = json.loads(response_text)
+            for cubeInfo in results["cubesInfos"]:
+                self.cube_status[(projID, cubeInfo["cubeId"])] = cubeInfo["status"]
+                self.cube_updated[(projID, cubeInfo["cubeId"])] = cubeInfo.get("lastUpdateTime")
+
+        return {cubeID: self.cube_status.get((projID, cubeID), "") for cubeID in cubeIDs}
     
-    def searchCubes(self, projID, cubetype):
+    def searchObjects(self, projID, objectType, name = None):
         """
-        Get the MTDI/OLAP cubes in a project
+        Page through /api/searches/results, one search_page_size page per request
 
         :param projID: project id
-        :param cubetype: "MTDI" or "OLAP"
-        :return: a list of cube ids
+        :param objectType: object type or subtype to search for, filtered by the server
+        :param name: only return objects whose name contains this text
+        :return: a generator over pages, each a list of search result items
         """
+        offset = 0
+        while True:
+            params = {
+                'type': objectType,
+                'offset': offset,
+                'limit': self.search_page_size
+            }
+            if name:
+                params['name'] = name
+                params['pattern'] = SEARCH_PATTERN_CONTAINS
+
+            with self.metrics.phase("search"):
+                response = self.session.request("GET", "/api/searches/results", projID=projID, params=params)
+            if response.status_code != 200:
+                logging.info(f"Search of type {objectType} failed at offset {offset}: {response.text}")
+                return
+            response_text = response.text
+
+            results = json.loads(response_text)
+            page = results["result"]
+            if page:
+                yield page
+            offset += len(page)
+            if len(page) < self.search_page_size or offset >= results.get("totalItems", offset + 1):
+                return
 
-        url = self.base_url + "/api/searches/results?type=3"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
+    def countObjects(self, projID, objectType):
+        """
+        Number of objects of a type in a project, from the total of a one item search page
 
+        :param projID: project id
+        :param objectType: object type or subtype to search for
+        :return: the number of objects, None if the search failed or did not report its total
+        """
         params = {
+            'type': objectType,
+            'offset': 0,
+            'limit': 1
         }
+        with self.metrics.phase("search"):
+            response = self.session.request("GET", "/api/searches/results", projID=projID, params=params)
+        if response.status_code != 200:
+            logging.info(f"Search of type {objectType} failed: {response.text}")
+            return None
+        return json.loads(response.text).get("totalItems")
 
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, params=params, verify=is_verified)
-        response_text = response.text
+    def searchCubes(self, projID, cubetype, name = None):
+        """
+        Get the MTDI/OLAP cubes in a project, yielded as the search pages arrive
 
-        results = json.loads(response_text)
-        
-        # return the list of elements in the form of element id and element name  
-        cubes = []
-        # Ignore the cube that are not loaded
-        for item in results["result"]:
-            if cubetype == "OLAP" and item["subtype"] == 776 and self.getCubeStatus(projID, item["id"]) != 0:
-                cubes.append((item["id"], item["name"]))
-            elif cubetype == "MTDI" and item["subtype"] == 779 and self.getCubeStatus(projID, item["id"]) != 0:
-                cubes.append((item["id"], item["name"]))
-        
-        return cubes
+        :param projID: project id
+        :param cubetype: "MTDI" or "OLAP"
+        :param name: only return cubes whose name contains this text
+        :return: a generator of (cube id, cube name)
+        """
+        subtype = SUBTYPE_OLAP_CUBE if cubetype == "OLAP" else SUBTYPE_MTDI_CUBE
+        for page in self.searchObjects(projID, subtype, name):
+            # return the list of elements in the form of element id and element name  
+            candidates = [(item["id"], item["name"], item.get("dateModified")) for item in page if item["subtype"] == subtype]
+            # Ignore the cube that are not loaded
+            statuses = self.getCubeStatuses(projID, [cubeID for cubeID, _, _ in candidates])
+            for cubeID, cubeName, modified in candidates:
+                if statuses[cubeID] != 0:
+                    self._setCubeVersion(projID, cubeID, modified)
+                    yield cubeID, cubeName
+
+    def _setCubeVersion(self, projID, cubeID, modified):
+        """
+        Remember which definition and data of a cube this run sees, for the incremental mode
+
+        :param modified: dateModified of the cube's search result
+        """
+        updated = self.cube_updated.get((projID, cubeID))
+        self.cube_modified[(projID, cubeID)] = modified
+        if modified is None and updated is None:
+            self.cube_versions[(projID, cubeID)] = None
+        else:
+            self.cube_versions[(projID, cubeID)] = f"{modified}|{updated}"
 
     def listCube(self, projID, cubetype, certified):
         """
@@ -266,23 +492,16 @@ class MSTRApp:
         :param projID: project id
         :param cubetype: "MTDI" or "OLAP"
         :param certified: true or false
-        :return: a list of cube ids
+        :return: a generator of (cube id, cube name)
         """
-        if certified:
-            certifiedDashboards = self.listCertifiedDashboard(projID)
-            cubesInCertified = []
-            for dashboard_id in certifiedDashboards:
-                cubesInCertified += self.listCube_CertifiedDashboard(projID, dashboard_id)
-
         if cubetype == "MTDI":
             cubes = self.searchCubes(projID, "MTDI")
         elif cubetype == "OLAP":
             cubes = self.searchCubes(projID, "OLAP")
         
         if certified:
-            cubeIds = [cube[0] for cube in cubes]
-            certified_cubes = list(set(cubeIds).intersection(set(cubesInCertified)))
-            return [(cubeID, cubeName) for cubeID, cubeName in cubes if cubeID in certified_cubes]
+            certified_cubes = self.certifiedCubes(projID)
+            return ((cubeID, cubeName) for cubeID, cubeName in cubes if cubeID in certified_cubes)
         return cubes
 
     def setFolderID(self, projID):
@@ -290,34 +509,32 @@ class MSTRApp:
         Get the folders in a project
 
         :param projID: project id
-        :param cubetype: "MTDI" or "OLAP"
-        :return: a list of cube ids
+        :return: the id of the first folder with full access, also kept as the report destination
         """
-
-        url = self.base_url + "/api/searches/results?type=8"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-
-        params = {
-        }
-
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, params=params, verify=is_verified)
-        response_text = response.text
-
-        results = json.loads(response_text)
-        
-        for folder in results["result"]:
-            if folder["acg"] == 255:
-                self.destinationFolderID = folder["id"]
-                return
+        folderID = self.metadata_cache.get(projID, "folder")
+        if folderID is not None:
+            self.destinationFolderID = folderID
+            self.project_folders[projID] = folderID
+            return folderID
+
+        # stop paging at the first folder with full access
+        for page in self.searchObjects(projID, SEARCH_TYPE_FOLDER):
+            for folder in page:
+                if folder["acg"] == 255:
+                    self.destinationFolderID = folder["id"]
+                    self.project_folders[projID] = folder["id"]
+                    self.metadata_cache.put(projID, "folder", folder["id"])
+                    return self.destinationFolderID
         
-        logging.INFO("No folder with full access found in this project.") 
+        logging.info("No folder with full access found in this project.") 
         exit(1)
 
+    def folderID(self, projID):
+        """
+        :return: the destination folder of the project's temporary reports, set by setFolderID
+        """
+        return self.project_folders.get(projID, self.destinationFolderID)
+
     def listAttributes(self, projID, cubeID):
         """
         Get attributes from a cube
@@ -326,19 +543,33 @@ class MSTRApp:
         :param cubeID: cube id
         :return: a list of attribute, in the form of [(attribute id, attribute name, attribute form name list, attribute form index list, base form ids)]
         """
-        url = self.base_url + "/api/v2/cubes/" + cubeID
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
-        if response.status_code != 200:
+        planned = self.planned_attributes.pop((projID, cubeID), None)
+        if planned is not None:
+            return planned
+        attributes = self._getMetadata(projID, "/api/v2/cubes/" + cubeID, self._parseAttributes,
+                                       self.cube_modified.get((projID, cubeID)), phase="attributes")
+        if attributes is None:
             return []
-        response_text = response.text
+        # the cache keeps them as JSON lists
+        return [tuple(attribute) for attribute in attributes]
+
+    def planAttributes(self, projID, cubeID):
+        """
+        Get the attributes of a cube ahead of counting it, the counting pass then takes them over
+
+        :return: the attribute list, as returned by listAttributes
+        """
+        attributes = self.listAttributes(projID, cubeID)
+        self.planned_attributes[(projID, cubeID)] = attributes
+        return attributes
+
+    def _parseAttributes(self, objectJson):
+        """
+        Extract the attributes and their string forms from a cube definition
 
-        objectJson = json.loads(response_text)
+        :param objectJson: the cube definition returned by /api/v2/cubes/{id}
+        :return: a list of attribute, in the form of [(attribute id, attribute name, attribute form name list, attribute form index list, base form ids)]
+        """
         attributes = objectJson['definition']['availableObjects']['attributes']
         
         attributesList = []
@@ -354,95 +585,292 @@ class MSTRApp:
             attributesList.append((attribute['id'], attribute['name'], form_names, form_indices, baseFormIds))
         return attributesList
     
-    def listElements_MTDI(self, projID, cubeID, attribute, element_limit = 10000, page_size = 100000):
+    def listElements_MTDI(self, projID, cubeID, attribute, element_limit = 10000, page_size = 100000, cancelled = None):
         """
         Get the distinct element counts in an attribute in MTDI cube
 
         :param projID: project id
         :param cubeID: cube id
         :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :param cancelled: optional function returning true once the result is no longer needed
         :return: distinct element counts
         """
-        # paging 
-        offset = 0
-        all_elements = []
-        element_counts = 0
-        elements = self._listElements_MTDI(projID, cubeID, attribute[0], attribute[4], element_limit, page_size, offset)
-        logging.info(f"fetch offset: {offset}, page_size: {page_size}.")   
-        if isinstance(elements, int):
-            return elements 
-        all_elements.extend(elements)
-
-        if page_size != -1:
-            offset += page_size                    
-            while len(elements) == page_size:
-                elements = self._listElements_MTDI(projID, cubeID, attribute[0], attribute[4], element_limit, page_size, offset)
-                logging.info(f"fetch offset: {offset}, page_size: {page_size}.")   
-                if isinstance(elements, int):
-                    return elements          
-                all_elements.extend(elements)
-                if len(all_elements) > element_limit:
-                    logging.info(f"Attribute {attribute[0]} ignored because element count exceeds the limit {element_limit}.")
-                    return 10000
-                offset += page_size
-
-        if all_elements:
-            element_counts = self._countElemByForm(all_elements, attribute[3])
-        return element_counts
+        element_limit = self._elementLimit(element_limit)
+        fetch = lambda limit, offset, stats: self._listElements_MTDI(projID, cubeID, attribute[0], attribute[4], limit, offset, stats)
+        return self._pageElements(fetch, attribute, element_limit, page_size, cancelled)
     
-    def _listElements_MTDI(self, projID, cubeID, attributeID, baseFormIds, element_limit, page_size, offset):
+    def _listElements_MTDI(self, projID, cubeID, attributeID, baseFormIds, page_size, offset, stats = None):
         """
-        Return a list of lists, where each list gives the form values for an element.
+        Return an iterator of lists, where each list gives the form values for an element.
         cubeID: the ID of the cube
         attributeID: the ID of the attribute
+        page_size: number of elements to ask the server for, -1 for all
+        stats: optional dict collecting the bytes received and the total element count reported by the server
         """
-        url = self.base_url + "/api/cubes/" + cubeID + "/attributes/" + attributeID + "/elements"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-
         params = {
-            'limit' : -1,
+            'limit' : page_size,
             'offset' : offset,
             'baseFormIds': baseFormIds
         }
 
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, params=params, verify=is_verified)
+        path = "/api/cubes/" + cubeID + "/attributes/" + attributeID + "/elements"
+        if stats is not None:
+            # a page that breaks off while it is read is retried for this endpoint
+            stats['path'] = path
+        response = self.session.request("GET", path, projID=projID, params=params, stream=True)
         if response.status_code == 500:
+            response.close()
             return -1
         elif response.status_code != 200:
-            return []
-        response_text = response.text
+            logging.info(f"Elements of attribute {attributeID} could not be fetched: HTTP {response.status_code}")
+            response.close()
+            return FETCH_FAILED
+        if stats is not None:
+            self._updateFetchStats(stats, response.headers, 0)
 
-        elementList = json.loads(response_text)
-        # We do not index attribute that has more than 10K elements
-        if len(elementList) > element_limit:
-            logging.info(f"Attribute {attributeID} ignored because element count exceeds the limit {element_limit}.")
-            return 10000
-        
-        # return the list of elements in the form of element id and element name  
-        for element in elementList:
-            if not 'formValues' in element:
-                # logging.info("elements in element list have no formValues: "+str(elementList))
-                return []
-        
-        return [element['formValues'] for element in elementList]
+        return self._streamElements(response, stats)
     
-    def _countElemByForm(self, all_elements, form_indices):
+    def probeElements(self, projID, cubeID, attribute):
+        """
+        Ask the cube for the first element of an attribute only, to learn its size without downloading it
+
+        :param projID: project id
+        :param cubeID: cube id
+        :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :return: (element count reported by the server, bytes of one element), (-1, None) if the cube is
+                 not published, (None, None) if the count could not be read
+        """
+        params = {
+            'limit': 1,
+            'offset': 0,
+            'baseFormIds': attribute[4]
+        }
+        with self.metrics.phase("probe"):
+            response = self.session.request("GET", "/api/cubes/" + cubeID + "/attributes/" + attribute[0] + "/elements", projID=projID, params=params)
+        if response.status_code == 500:
+            return -1, None
+        if response.status_code != 200 or 'X-MSTR-Total-Count' not in response.headers:
+            return None, None
+        # the body is a one element array, without its brackets it is one element of a full page
+        return int(response.headers['X-MSTR-Total-Count']), max(len(response.content) - 2, 0)
+
+    def _pageElements(self, fetch, attribute, element_limit, page_size, cancelled = None):
+        """
+        Page through the elements of an attribute and count them by form.
+        Pages are sized to the remaining element budget, so the server never ships more than
+        element_limit + 1 elements of an attribute that is going to be ignored.
+
+        :param fetch: function (limit, offset, stats) returning an iterator over one page, or an int status
+        :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :param element_limit: element count above which the attribute is not indexed
+        :param page_size: elements per request, -1 for a single unpaged request
+        :param cancelled: optional function returning true once the result is no longer needed, checked between batches
+        :return: distinct element counts, SKIPPED if cancelled
+        """
+        # paging 
+        offset = 0
+        counter = self._newCounter(attribute[3], element_limit)
+        stats = self._newFetchStats()
+        element_counts = 0
+        while True:
+            if cancelled is not None and cancelled():
+                return SKIPPED
+            limit = self._pageLimit(page_size, element_limit, offset)
+            failure, received = self._retryStream(lambda: self._readPage(fetch, counter, limit, offset, stats, cancelled),
+                                                  attribute, stats, (FETCH_FAILED, 0))
+            if failure is not None:
+                return failure
+            if cancelled is not None and cancelled():
+                logging.info(f"Attribute {attribute[0]} dropped, an attribute before it ended the cube")
+                return SKIPPED
+            if counter.exceeded:
+                self._logFetchStats(attribute, stats, counter.element_count)
+                if self.sample_windows:
+                    return self._sampleElements(fetch, attribute, stats['total'])
+                logging.info(f"Attribute {attribute[0]} ignored because element count exceeds the limit {element_limit}.")
+                return 10000
+            if limit == -1 or received < limit:
+                break
+            offset += received
+
+        self._logFetchStats(attribute, stats, counter.element_count)
+        if counter.element_count:
+            element_counts = counter.counts()
+        return element_counts
+
+    def _readPage(self, fetch, counter, limit, offset, stats, cancelled = None):
+        """
+        Fetch one page of elements and feed the counter while the page is still arriving, up to the end of
+        the page, the element limit of the counter or the cancellation. A page broken off by a stream error is
+        taken back out of the element count before the error is raised, so it can be read again from its start;
+        the values it added are counted again at no cost.
+
+        :return: (None, elements received), or (the result of a failed request, 0)
+        """
+        start = time.perf_counter()
+        elements = fetch(limit, offset, stats)
+        logging.info(f"fetch offset: {offset}, page_size: {limit}.")   
+        if isinstance(elements, int) or elements == FETCH_FAILED:
+            self.metrics.addPhase("elements", time.perf_counter() - start)
+            return elements, 0
+        received = 0
+        counting = 0.0
+        try:
+            for batch in iter(lambda: list(itertools.islice(elements, element_batch)), []):
+                counted = time.perf_counter()
+                counter.add(batch)
+                counting += time.perf_counter() - counted
+                received += len(batch)
+                if counter.exceeded or (cancelled is not None and cancelled()):
+                    break
+        except restSession.STREAM_ERRORS:
+            counter.element_count -= received
+            raise
+        finally:
+            # gives the connection and its request slot back, also when the page is left early
+            elements.close()
+            self._addElementPhases(start, counting)
+        return None, received
+
+    def _retryStream(self, read, attribute, stats, failed):
+        """
+        Read a streamed response again from its start when the connection breaks while its body arrives.
+        The session retries a request up to its response headers only, the body is read after it returned.
+
+        :param read: function sending the request and reading the whole body
+        :param attribute: the attribute being read, for the log
+        :param stats: the fetch statistics of the attribute, holding the path of its elements once requested
+        :param failed: returned once the retries are spent
+        :return: the result of read
+        """
+        retries = 0
+        while True:
+            try:
+                return read()
+            except restSession.STREAM_ERRORS as error:
+                delay = self.session.retryDelay("GET", stats.get('path', "elements"), None, retries)
+                if delay is None:
+                    logging.info(f"Elements of attribute {attribute[0]} could not be fetched: {error}")
+                    return failed
+                logging.info(f"Elements of attribute {attribute[0]} broke off ({error}), reading them again in {delay:.1f} seconds")
+                retries += 1
+                time.sleep(delay)
+
+    def _sampleElements(self, fetch, attribute, total):
+        """
+        Estimate the distinct counts of an attribute over the element limit from windows of its elements
+
+        :param fetch: function (limit, offset, stats) returning an iterator over one page, or an int status
+        :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :param total: element count reported by the server
+        :return: {'total': element count, 'sample': sampled elements, 'forms': [[estimate, lower bound, upper bound], ...]},
+                 10000 if the attribute cannot be sampled, FETCH_FAILED if a window could not be fetched
+        """
+        if total is None:
+            logging.info(f"Attribute {attribute[0]} ignored because the server did not report its element count.")
+            return 10000
+        values = [[] for _ in attribute[3]]
+        stats = self._newFetchStats()
+        for offset in samplingEstimator.sampleOffsets(total, self.sample_windows, self.sample_window_size, attribute[0]):
+            start = time.perf_counter()
+            failure = self._retryStream(lambda: self._readWindow(fetch, values, offset, stats, attribute), attribute, stats, FETCH_FAILED)
+            if failure == FETCH_FAILED:
+                return FETCH_FAILED
+            if failure is not None:
+                logging.info(f"Attribute {attribute[0]} ignored because its sample could not be fetched.")
+                return 10000
+            self.metrics.addPhase("elements", time.perf_counter() - start)
+        return self._estimateSample(values, attribute, total)
+
+    def _readWindow(self, fetch, values, offset, stats, attribute):
+        """
+        Fetch one sample window and add it to the sample, only once it has been read completely
+
+        :return: None, or the result of a failed request
+        """
+        elements = fetch(self.sample_window_size, offset, stats)
+        if isinstance(elements, int) or elements == FETCH_FAILED:
+            return elements
+        self._addSample(values, elements, attribute)
+        return None
+
+    def _addSample(self, values, elements, attribute):
+        """
+        Add a window of elements to the sample of each indexed form, as the list of its values
+        """
+        windows = [[] for _ in attribute[3]]
+        for element in elements:
+            for window, index in zip(windows, attribute[3]):
+                window.append(element[index] if index < len(element) else None)
+        for form_windows, window in zip(values, windows):
+            form_windows.append(window)
+
+    def _estimateSample(self, values, attribute, total):
+        with self.metrics.phase("count"):
+            forms = [samplingEstimator.estimate(form_windows, total, self.sample_method) for form_windows in values]
+        sample = sum(len(window) for window in values[0]) if values else 0
+        logging.info(f"Attribute {attribute[0]} estimated from {sample} of {total} elements with {self.sample_method}: {forms}")
+        return {'total': total, 'sample': sample, 'forms': forms}
+
+    def _addElementPhases(self, start, counting):
+        """
+        Split the time spent on a page into receiving and decoding it, and counting its elements
+        """
+        self.metrics.addPhase("elements", time.perf_counter() - start - counting)
+        self.metrics.addPhase("count", counting)
+
+    def _elementLimit(self, element_limit):
+        """
+        :return: the element limit to enforce, unlimited in approximate mode
         """
-        Count distinct element number by form
+        if self.approx_precision is not None:
+            # sketches have bounded memory, so no attribute is dropped for its size
+            return math.inf
+        return element_limit
+
+    def _pageLimit(self, page_size, element_limit, offset):
+        """
+        :return: the number of elements to request next: the page size, capped at one element past the limit
+        """
+        if not math.isfinite(element_limit):
+            return page_size
+        budget = element_limit + 1 - offset
+        return budget if page_size == -1 else min(page_size, budget)
+
+    def _newFetchStats(self):
+        return {'fetches': 0, 'bytes': 0, 'total': None}
+
+    def _updateFetchStats(self, stats, headers, received):
+        stats['fetches'] += 1
+        stats['bytes'] += received
+        if 'X-MSTR-Total-Count' in headers:
+            stats['total'] = int(headers['X-MSTR-Total-Count'])
+
+    def _logFetchStats(self, attribute, stats, fetched):
+        """
+        Report the requests and bytes spent on an attribute, and the bytes the element limit avoided
+        when the server told us how many elements there are in total
+        """
+        message = f"Attribute {attribute[0]}: {stats['fetches']} fetches, {stats['bytes']} bytes received"
+        if stats['total'] is not None and fetched and stats['total'] > fetched:
+            saved = (stats['total'] - fetched) * stats['bytes'] // fetched
+            message += f", about {saved} bytes saved by not fetching the remaining {stats['total'] - fetched} elements"
+        logging.info(message)
+
+    def _newCounter(self, form_indices, element_limit = None):
+        """
+        Create the counter that element pages of one attribute are fed into
 
-        :param all_elements: the elements extracted from the cube
         :param form_indices: a list of index of forms that needs indexing
-        :return: a list of distinct element count
+        :param element_limit: element count above which the attribute is not indexed
+        :return: an elementCounter.DistinctCounter, a FingerprintDistinctCounter with compact sets,
+                 or an ApproxDistinctCounter in approximate mode
         """
-        elements = pd.DataFrame(all_elements)
-        selected_forms = elements[form_indices]
-        distinct_counts = selected_forms.apply(lambda col: col.nunique())
-        return distinct_counts.tolist()
+        if self.approx_precision is not None:
+            return elementCounter.ApproxDistinctCounter(form_indices, self.approx_precision)
+        if self.compact_sets:
+            return elementCounter.FingerprintDistinctCounter(form_indices, element_limit)
+        return elementCounter.DistinctCounter(form_indices, element_limit)
 
     def _createReport(self, projID, body):
         """
@@ -450,26 +878,17 @@ class MSTRApp:
 
         :param projID: project id
         :param body: json body for REST request
-        :return: new report's report id and instance id
+        :return: new report's report id and instance id, -1 and -1 if the cube contains managed objects,
+                 None and None if the report could not be created
         """
-        url = self.base_url + "/api/model/reports"
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-        response = requests.request("POST", url, headers=headers, data=body, cookies=self.cookies, verify=is_verified)
-        response_text = response.text
-
-        objectJson = json.loads(response_text)
-        if response.status_code == 500:
-            logging.info(f"{response.text}")
-            exit(1)
-        elif response.status_code == 400:
+        response = self.session.request("POST", "/api/model/reports", projID=projID, data=body)
+        if response.status_code == 400:
             return -1, -1
         elif response.status_code != 201:
-            return 0, 0
-        
+            logging.info(f"Report creation failed: HTTP {response.status_code} {response.text}")
+            return None, None
+
+        objectJson = json.loads(response.text)
         reportID = objectJson["information"]["objectId"]
         instanceID = response.headers['x-mstr-ms-instance']
         return reportID, instanceID
@@ -480,179 +899,491 @@ class MSTRApp:
 
         :param reportID: report id
         :param instanceID: instance id
+        :return: True if the report was saved
         """
-        url = self.base_url + "/api/model/reports/" + reportID + "/instances/save"
-        payload = {}
         headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-MS-Instance': instanceID,
-            'Content-Type': 'application/json'
+            'X-MSTR-MS-Instance': instanceID
         }
-        response = requests.request("POST", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
+        response = self.session.request("POST", "/api/model/reports/" + reportID + "/instances/save", headers=headers)
         if response.status_code != 201:
             logging.info(f"!!! Report creation failed !!!")
-        else:
-            logging.info(f"Report creation succeeded.")
+            return False
+        logging.info(f"Report creation succeeded.")
+        return True
 
-    def _delReport(self, projID, reportID):
+    def _redefineReport(self, projID, reportID, instanceID, body):
         """
-        Delete the temporary report
+        Replace the template of an existing temporary report with the attributes of another cube
 
         :param projID: project id
         :param reportID: report id
+        :param instanceID: instance id the report was created with
+        :param body: json body for REST request
+        :return: True if the report was redefined, -1 if the cube contains managed objects, False otherwise
         """
-        url = self.base_url + "/api/objects/" + reportID + "?type=3"
-        payload = {}
         headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
+            'X-MSTR-MS-Instance': instanceID
         }
-        response = requests.request("DELETE", url, headers=headers, data=payload, cookies=self.cookies, verify=is_verified)
+        response = self.session.request("PUT", "/api/model/reports/" + reportID, projID=projID, headers=headers, data=body)
+        if response.status_code == 400:
+            return -1
+        return response.status_code == 200
+
+    def _probeReport(self, projID, reportID, attribute):
+        """
+        Check whether the elements of an unsaved report instance can be read
+
+        :param projID: project id
+        :param reportID: report id
+        :param attribute: one attribute of the report
+        :return: True if the server served the elements
+        """
+        params = {
+            'limit': 1,
+            'offset': 0,
+            'baseFormIds': attribute[4]
+        }
+        response = self.session.request("GET", "/api/reports/" + reportID + "/attributes/" + attribute[0] + "/elements", projID=projID, params=params)
+        return response.status_code == 200
+
+    def _delReport(self, projID, reportID):
+        """
+        Delete the temporary report
+
+        :param projID: project id
+        :param reportID: report id
+        :return: True if the report was deleted
+        """
+        response = self.session.request("DELETE", "/api/objects/" + reportID + "?type=3", projID=projID)
         if response.status_code != 204:
             logging.info(f"!!! Report deletion failed !!!")
-            exit()
-        else:
-            logging.info(f"Report deletion succeed.")
+            return False
+        logging.info(f"Report deletion succeed.")
+        return True
 
-    def listElements_OLAP(self, projID, reportID, attribute, element_limit = 10000, page_size = 100000):
+    def listElements_OLAP(self, projID, reportID, attribute, element_limit = 10000, page_size = 100000, cancelled = None):
         """
-        Get the distinct element counts in an attribute in MTDI cube
+        Get the distinct element counts in an attribute in OLAP cube
 
         :param projID: project id
-        :param cubeID: cube id
+        :param reportID: temporary report id
         :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :param cancelled: optional function returning true once the result is no longer needed
         :return: distinct element counts
         """
-        # paging 
-        offset = 0
-        all_elements = []
-        element_counts = 0
-        elements = self._listElements_OLAP(projID, reportID, attribute[0], attribute[4], element_limit, page_size, offset)
-        logging.info(f"fetch offset: {offset}, page_size: {page_size}.")   
-        if isinstance(elements, int):
-            return elements
-        all_elements.extend(elements)
-
-        if page_size != -1:
-            offset += page_size                    
-            while len(elements) == page_size:
-                elements = self._listElements_OLAP(projID, reportID, attribute[0], attribute[4], element_limit, page_size, offset)
-                logging.info(f"fetch offset: {offset}, page_size: {page_size}.")   
-                if isinstance(elements, int):
-                    return elements          
-                all_elements.extend(elements)
-                if len(all_elements) > element_limit:
-                    logging.info(f"Attribute {attribute[0]} ignored because element count exceeds the limit {element_limit}.")
-                    return 10000
-                offset += page_size
-
-        if all_elements:
-            element_counts = self._countElemByForm(all_elements, attribute[3])
-        return element_counts
+        element_limit = self._elementLimit(element_limit)
+        fetch = lambda limit, offset, stats: self._listElements_OLAP(projID, reportID, attribute[0], attribute[4], limit, offset, stats)
+        return self._pageElements(fetch, attribute, element_limit, page_size, cancelled)
     
-    def _listElements_OLAP(self, projID, reportID, attributeID, baseFormIds, element_limit, page_size, offset):
+    def _listElements_OLAP(self, projID, reportID, attributeID, baseFormIds, page_size, offset, stats = None):
         """
-        Return a list of lists, where each list gives the form values for an element.
-        cubeID: the ID of the cube
+        Return an iterator of lists, where each list gives the form values for an element.
+        reportID: the ID of the temporary report
         attributeID: the ID of the attribute
+        page_size: number of elements to ask the server for, -1 for all
+        stats: optional dict collecting the bytes received and the total element count reported by the server
         """
-        url = self.base_url + "/api/reports/" + reportID + "/attributes/" + attributeID + "/elements"
-        payload = {}
-        headers = {
-            'X-MSTR-AuthToken': self.authtoken,
-            'X-MSTR-ProjectID': projID,
-            'Content-Type': 'application/json'
-        }
-
         params = {
-            'limit' : -1,
+            'limit' : page_size,
             'offset' : offset,
             'baseFormIds': baseFormIds
         }
 
-        response = requests.request("GET", url, headers=headers, data=payload, cookies=self.cookies, params=params, verify=is_verified)
+        path = "/api/reports/" + reportID + "/attributes/" + attributeID + "/elements"
+        if stats is not None:
+            # a page that breaks off while it is read is retried for this endpoint
+            stats['path'] = path
+        response = self.session.request("GET", path, projID=projID, params=params, stream=True)
         if response.status_code == 500:
+            response.close()
             return -1
         elif response.status_code != 200:
-            return []
-        response_text = response.text
+            logging.info(f"Elements of attribute {attributeID} could not be fetched: HTTP {response.status_code}")
+            response.close()
+            return FETCH_FAILED
+        if stats is not None:
+            self._updateFetchStats(stats, response.headers, 0)
 
-        elementList = json.loads(response_text)
-        # We do not index attribute that has more than 10K elements
-        if len(elementList) > element_limit:
-            logging.info(f"Attribute {attributeID} ignored because element count exceeds the limit {element_limit}.")
-            return 10000
-        
-        # return the list of elements in the form of element id and element name  
-        for element in elementList:
+        return self._streamElements(response, stats)
+
+    def _streamElements(self, response, stats = None):
+        """
+        Yield the form values of each element of a streamed page while it is being received.
+        The page stops at the first element without formValues.
+
+        :param response: streamed requests.Response holding a JSON array of elements
+        :param stats: optional dict collecting the bytes received
+        """
+        try:
+            yield from self._formValues(jsonStream.iterArray(self._receive(response, stats)))
+        finally:
+            self.session.finish(response)
+
+    def _formValues(self, elements):
+        """
+        Yield the form values of each element of a page, up to the first element without formValues.
+        Shared by both engines, so they feed the same elements into the counter.
+
+        :param elements: iterable of the decoded elements of a page
+        """
+        for element in elements:
             if not 'formValues' in element:
-                return []
-        
-        return [element['formValues'] for element in elementList]
-    
-    def add_record(self, cube_name, attri_name, attri_form_name, elem_count, type):
+                return
+            yield element['formValues']
+
+    def _receive(self, response, stats):
+        # the session counts the bytes of responses that announce their length
+        count_bytes = 'Content-Length' not in response.headers
+        for chunk in response.iter_content(chunk_size=stream_chunk_size):
+            if stats is not None:
+                stats['bytes'] += len(chunk)
+            if count_bytes:
+                self.metrics.addBytes(response.endpoint, len(chunk))
+            yield chunk
+
+    def add_record(self, proj_id, cube_id, cube_name, attri_id, attri_name, attri_form_name, elem_count, type, cube_seconds = None):
         """
         Add the count record
 
+        :param proj_id: project id
+        :param cube_id: cube id
         :param cube_name: cube name
+        :param attri_id: attribute id
         :param attri_name: attribute name
         :param attri_form_name: attribute form name
-        :param elem_count: distinct element count
+        :param elem_count: distinct element count, ">10000", or [estimate, lower bound, upper bound] of a sampled attribute
         :param type: OLAP/MTDI/EXCEED
+        :param cube_seconds: time spent counting the whole cube
         """
+        if isinstance(elem_count, list):
+            # sampled estimate of an attribute over the limit, with its confidence interval
+            elem_count, ci_low, ci_high = elem_count
+        else:
+            ci_low = ci_high = None
         record = {
+            'project_id': proj_id,
+            'cube_id': cube_id,
             'cube_name': cube_name,
+            'attribute_id': attri_id,
             'attribute_name': attri_name,
             'attribute_form_name': attri_form_name,
-            'count_number': elem_count
+            'count_number': elem_count,
+            'ci_low': ci_low,
+            'ci_high': ci_high,
+            'cube_seconds': round(cube_seconds, 3) if cube_seconds is not None else None,
+            'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds')
         }
-        if type == "OLAP":
-            self.elem_count_OLAP.append(record)
-        elif type == "MTDI":
-            self.elem_count_MTDI.append(record)
-        elif type == "EXCEED":
-            self.elem_exceeded_limit.append(record)
+        if self.approx_precision is not None and type != "EXCEED":
+            # one standard error of the HyperLogLog estimate
+            record['error_bound'] = round(elem_count * hyperLogLog.relativeError(self.approx_precision))
+        with self.record_lock:
+            with self.metrics.phase("output"):
+                self.results.write(record, type)
         logging.info(f"Record added: {record}")
 
-    def countElemInCube_MTDI(self, projID, cube_ids):
+    def _map(self, executor, func, items, lookahead = None):
         """
-        Count the element in MTDI cube
+        Apply func to every item, in parallel when an executor is configured
+
+        Results are yielded in the order of items, so records come out the same way as a sequential run.
+        At most 2 * workers calls are queued or running at a time, or fewer as given by lookahead.
+        Closing the returned generator cancels the queued calls and waits for the running ones.
+
+        :param executor: ThreadPoolExecutor, or None to run lazily in the calling thread
+        :param func: function taking one item
+        :param items: iterable of items
+        :param lookahead: optional function returning the number of calls that may currently be queued or running
+        :return: generator over func(item)
+        """
+        if executor is None:
+            return (func(item) for item in items)
+        return self._boundedMap(executor, func, items, lookahead)
+
+    def _boundedMap(self, executor, func, items, lookahead = None):
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                limit = 2 * self.workers if lookahead is None else min(lookahead(), 2 * self.workers)
+                if len(pending) >= limit:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            wait(pending)
+
+    def _countAttribute(self, projID, cubeID, attribute, count, shared = False, cutoff = None):
+        """
+        Count one attribute unless its result is already known, and record the result
 
         :param projID: project id
-        :param cube_ids: cube ids
-        """
-        for cube in cube_ids:
-            logging.info(f"Start counting distinct elements in Cube: {cube[1]}...")
-            attributes = self.listAttributes(projID, cube[0])
-            for attribute in attributes:
-                distinctElemCount = self.listElements_MTDI(projID, cube[0], attribute)
-                if distinctElemCount == -1:
-                    logging.info(f"Cube is not published")
+        :param cubeID: cube id
+        :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :param count: function fetching and counting the attribute's elements, given a function returning true once
+                      the result is no longer needed
+        :param shared: true for OLAP schema attributes, whose result is the same in every cube of the project
+        :param cutoff: the AttributeCutoff of the cube, the attribute is not counted once an attribute before it ended the cube
+        :return: distinct element counts, SKIPPED if the attribute comes after the cutoff
+        """
+        distinctElemCount = self._knownCount(projID, cubeID, attribute, shared)
+        if distinctElemCount is None:
+            if self.budget is not None and self.budget.exhausted():
+                return runBudget.DEFERRED
+            cancelled = None
+            if cutoff is not None:
+                if cutoff.isCut(attribute):
+                    return SKIPPED
+                cancelled = lambda: cutoff.isCut(attribute)
+            if shared:
+                distinctElemCount = self._countShared(projID, attribute, lambda: count(cancelled))
+            else:
+                distinctElemCount = count(cancelled)
+        if cutoff is not None:
+            cutoff.observe(attribute, distinctElemCount)
+        self._recordCount(projID, cubeID, attribute, distinctElemCount, shared)
+        return distinctElemCount
+
+    def _countShared(self, projID, attribute, count):
+        """
+        Count a shared attribute once while other cubes of the project ask for it, they get the same result.
+        A result specific to the cube that counted it, an unpublished cube or a skipped attribute, is counted again.
+
+        :param projID: project id
+        :param attribute: (attribute id, attribute name, attribute form name list, attribute form index list, base form ids) for one attribute
+        :param count: function fetching and counting the attribute's elements
+        :return: distinct element counts
+        """
+        key = (projID, attribute[0], tuple(attribute[4]))
+        with self.shared_lock:
+            future = self.shared_fetches.get(key)
+            owner = future is None
+            if owner:
+                future = self.shared_fetches[key] = Future()
+        if not owner:
+            distinctElemCount = future.result()
+            if distinctElemCount != SKIPPED and distinctElemCount != -1:
+                return distinctElemCount
+            return count()
+        distinctElemCount = SKIPPED
+        try:
+            distinctElemCount = count()
+            return distinctElemCount
+        finally:
+            with self.shared_lock:
+                del self.shared_fetches[key]
+            future.set_result(distinctElemCount)
+
+    def _knownCount(self, projID, cubeID, attribute, shared = False):
+        """
+        :return: the result of an attribute from the checkpoint journal of an interrupted run, from
+                 the incremental state when its cube has not changed, or for shared attributes from
+                 the attribute cache, else None
+        """
+        if self.journal is not None and self.journal.isCompleted(projID, cubeID, attribute[0]):
+            return self.journal.get(projID, cubeID, attribute[0])
+        distinctElemCount = None
+        if self.state is not None:
+            distinctElemCount = self.state.get(cubeID, attribute[0])
+        if distinctElemCount is None and shared:
+            distinctElemCount = self.attribute_cache.get(projID, attribute[0], attribute[4])
+        return distinctElemCount
+
+    def _isKnown(self, projID, cubeID, attribute, shared = False):
+        """
+        Same as _knownCount is not None, without counting a cache lookup
+        """
+        return self._peekCount(projID, cubeID, attribute, shared) is not None
+
+    def _peekCount(self, projID, cubeID, attribute, shared = False):
+        """
+        Same as _knownCount, without counting a cache lookup
+        """
+        if self.journal is not None and self.journal.isCompleted(projID, cubeID, attribute[0]):
+            return self.journal.get(projID, cubeID, attribute[0])
+        distinctElemCount = None
+        if self.state is not None:
+            distinctElemCount = self.state.get(cubeID, attribute[0])
+        if distinctElemCount is None and shared:
+            distinctElemCount = self.attribute_cache.peek(projID, attribute[0], attribute[4])
+        return distinctElemCount
+
+    def _recordCount(self, projID, cubeID, attribute, distinctElemCount, shared = False):
+        # -1 means the cube is not published and a failed fetch has no result, a later run should retry both;
+        # a skipped attribute was not counted
+        if distinctElemCount == -1 or distinctElemCount == FETCH_FAILED or distinctElemCount == SKIPPED:
+            return
+        if self.journal is not None and not self.journal.isCompleted(projID, cubeID, attribute[0]):
+            self.journal.record(projID, cubeID, attribute[0], distinctElemCount)
+        if self.state is not None:
+            self.state.record(cubeID, attribute[0], distinctElemCount)
+        if shared:
+            self.attribute_cache.put(projID, attribute[0], attribute[4], distinctElemCount)
+
+    def estimateCardinality(self, projID, cubeID, attribute, shared = False):
+        """
+        :return: the expected element count of an attribute: 0 if its result is already known, its count
+                 in the last run kept in the result database, else runBudget.UNKNOWN_ESTIMATE
+        """
+        if self._isKnown(projID, cubeID, attribute, shared):
+            return 0
+        if self.results.store is None:
+            return runBudget.UNKNOWN_ESTIMATE
+        with self.record_lock:
+            if projID not in self.count_history:
+                self.count_history[projID] = self.results.store.lastCounts(projID)
+            history = self.count_history[projID]
+        return history.get((cubeID, attribute[0]), runBudget.UNKNOWN_ESTIMATE)
+
+    def cubePriority(self, projID, cube, attributes, type):
+        """
+        Sort key of a cube under a budget: cubes of certified dashboards first, then the cheapest
+
+        :param attributes: the attributes of the cube, as returned by listAttributes
+        :return: (0 for certified cubes else 1, estimated elements to download)
+        """
+        shared = type == "OLAP"
+        cost = sum(self.estimateCardinality(projID, cube[0], attribute, shared) for attribute in attributes)
+        return (0 if cube[0] in self.certifiedCubes(projID) else 1, cost)
+
+    def _mapAttributes(self, projID, cubeID, attributes, func, lookahead = None, shared = False):
+        """
+        Apply func to the attributes of a cube through _map. Under a budget they are counted cheapest first,
+        so a spent budget defers the expensive ones, but the results still come in attribute order, so the
+        cube stops at the same attribute over the element limit as without a budget.
+
+        :param func: function taking one attribute
+        :param lookahead: optional function returning the number of calls that may currently be queued or running
+        :param shared: true for OLAP schema attributes
+        :return: generator over func(attribute), in the order of attributes
+        """
+        if self.budget is None:
+            return self._map(self.element_executor, func, attributes, lookahead)
+        order = sorted(range(len(attributes)), key=lambda position: self.estimateCardinality(projID, cubeID, attributes[position], shared))
+        results = [None] * len(attributes)
+        counts = self._map(self.element_executor, func, [attributes[position] for position in order], lookahead)
+        try:
+            for position, result in zip(order, counts):
+                results[position] = result
+        finally:
+            counts.close()
+        return (result for result in results)
+
+    def _estimateRecords(self, cube, attribute, estimate):
+        """
+        :param estimate: the result of a sampled attribute, see _sampleElements
+        :return: its EXCEED records, with [estimate, lower bound, upper bound] of each form as the count
+        """
+        return [(cube[0], cube[1], attribute[0], attribute[1], attribute[2][form_index], estimate['forms'][form_index], "EXCEED")
+                for form_index in range(len(attribute[3]))]
+
+    def _collectRecords(self, projID, cube, attributes, counts, type, stop_at_exceed = True):
+        """
+        Turn the results of the attributes of a cube into records, in attribute order. Shared by both engines,
+        so they write the same records.
+
+        :param counts: iterable of the attribute results, in the order of attributes
+        :param type: "OLAP" or "MTDI", the type of the count records
+        :param stop_at_exceed: stop at the first attribute over the element limit, as MTDI cubes and OLAP cubes with
+                               managed objects do; OLAP cubes read through a report go on, with one EXCEED record for it
+        :return: a list of (cube id, cube name, attribute id, attribute name, attribute form name, count, type) records
+        """
+        records = []
+        for attribute, distinctElemCount in zip(attributes, counts):
+            if distinctElemCount == runBudget.DEFERRED:
+                self.budget.defer(projID, cube, type, attribute)
+                continue
+            if distinctElemCount == -1:
+                logging.info(f"Cube is not published")
+                break
+            elif distinctElemCount == FETCH_FAILED:
+                logging.info(f"Attribute \"{attribute[1]}\" of Cube {cube[1]} left out, its elements could not be fetched")
+            elif isinstance(distinctElemCount, dict):
+                records += self._estimateRecords(cube, attribute, distinctElemCount)
+                if stop_at_exceed:
                     break
-                elif distinctElemCount == 10000:
-                    for form_index in range(len(attribute[3])):
-                        self.add_record(cube[1], attribute[1], attribute[2][form_index], ">10000", "EXCEED")
+            elif distinctElemCount == 10000:
+                form_indices = range(len(attribute[3])) if stop_at_exceed else range(min(len(attribute[3]), 1))
+                for form_index in form_indices:
+                    records.append((cube[0], cube[1], attribute[0], attribute[1], attribute[2][form_index], ">10000", "EXCEED"))
+                if stop_at_exceed:
                     break
-                elif distinctElemCount:
-                    for form_index in range(len(attribute[3])):
-                        if distinctElemCount[form_index] != 0:
-                            self.add_record(cube[1], attribute[1], attribute[2][form_index], distinctElemCount[form_index], "MTDI")
-                else:
-                    logging.info(f"There is no element of string form in attribute \"{attribute[1]}\" to be indexed")
-            logging.info(f"Distinct element count of Cube: {cube[1]} done.")
+            elif distinctElemCount:
+                for form_index in range(len(attribute[3])):
+                    if distinctElemCount[form_index] != 0:
+                        records.append((cube[0], cube[1], attribute[0], attribute[1], attribute[2][form_index], distinctElemCount[form_index], type))
+            else:
+                logging.info(f"There is no element of string form in attribute \"{attribute[1]}\" to be indexed")
+        return records
+
+    def _startCube(self, projID, cube):
+        logging.info(f"Start counting distinct elements in Cube: {cube[1]}...")
+        if self.state is not None:
+            self.state.setVersion(projID, cube[0], self.cube_versions.get((projID, cube[0])))
+
+    def _costCube(self, projID, cube, type, count):
+        """
+        Count one cube and keep what it cost
+
+        :param count: _countCube_MTDI or _countCube_OLAP
+        :return: the records of the cube and the seconds it took
+        """
+        if self.budget is not None and self.budget.exhausted():
+            self.budget.defer(projID, cube, type)
+            return [], 0.0
+        start = time.perf_counter()
+        records = count(projID, cube)
+        seconds = time.perf_counter() - start
+        self.metrics.cubeCost(projID, cube, type, seconds, len(records))
+        return records, seconds
+
+    def countElemInCube_MTDI(self, projID, cube_ids):
+        """
+        Count the element in MTDI cube
+
+        :param projID: project id
+        :param cube_ids: an iterable of (cube id, cube name)
+        :return: the number of cubes counted
+        """
+        cube_count = 0
+        for records, seconds in self._map(self.cube_executor, lambda cube: self._costCube(projID, cube, "MTDI", self._countCube_MTDI), cube_ids):
+            cube_count += 1
+            for record in records:
+                self.add_record(projID, *record, cube_seconds=seconds)
+        return cube_count
+
+    def _countCube_MTDI(self, projID, cube):
+        """
+        Count the element in one MTDI cube
+
+        :param projID: project id
+        :param cube: (cube ID, cube name)
+        :return: a list of (cube id, cube name, attribute id, attribute name, attribute form name, count, type) records
+        """
+        self._startCube(projID, cube)
+        attributes = self.listAttributes(projID, cube[0])
+        cutoff = AttributeCutoff(attributes)
+        counts = self._mapAttributes(projID, cube[0], attributes, lambda attribute: self._countAttribute(projID, cube[0], attribute,
+                                     lambda cancelled: self.listElements_MTDI(projID, cube[0], attribute, cancelled=cancelled), cutoff=cutoff), cutoff.lookahead)
+        records = self._collectRecords(projID, cube, attributes, counts, "MTDI")
+        counts.close()
+        logging.info(f"Distinct element count of Cube: {cube[1]} done.")
+        return records
     
-    def countElem_MTDI(self, proj, certified_flag):
+    def countElem_MTDI(self, proj, certified_flag, cubes = None):
         """
         Main function of count elements in the project's MTDI cubes
 
         :param projID: project id
         :param certified_flag: true/false
+        :param cubes: the (cube id, cube name) to count, if already listed
         """
         start_time = time.time()
-        mtdi_cubes = self.listCube(proj[0], "MTDI", certified_flag)
-        logging.info(f"Count of MTDI cubes for indexing in {proj[1]}: {len(mtdi_cubes)}")
-        self.countElemInCube_MTDI(proj[0], mtdi_cubes) 
+        mtdi_cubes = cubes if cubes is not None else self.listCube(proj[0], "MTDI", certified_flag)
+        # cubes are counted while the search is still paging, so the total is only known afterwards
+        cube_count = self.countElemInCube_MTDI(proj[0], mtdi_cubes)
+        logging.info(f"Count of MTDI cubes for indexing in {proj[1]}: {cube_count}") 
         end_time = time.time()
         elapsed_time = end_time - start_time
         logging.info(f"The sizing time for {proj[1]}'s MTDI cubes was: {elapsed_time} seconds")
@@ -662,34 +1393,98 @@ class MSTRApp:
         Count the element in OLAP cube
 
         :param projID: project id
-        :param cube_ids: cube ids
-        """
-        for cube in cube_ids:
-            logging.info(f"Start counting distinct elements in Cube: {cube[1]}...")
-            attributes = self.listAttributes(projID, cube[0])
-            body = generateJson.Generator().generate(attributes, self.destinationFolderID)
-            reportID, instanceID = self._createReport(projID, body)
-            if reportID == -1 and instanceID == -1:
-                self.countManagedCube_OLAP(projID, cube, attributes)
-            else:    
-                self._saveReport(reportID, instanceID)
-                for attribute in attributes:
-                    distinctElemCount = self.listElements_OLAP(projID, reportID, attribute)
-                    if distinctElemCount == -1:
-                        logging.info(f"Cube is not published")
-                        break
-                    elif distinctElemCount == 10000:
-                        for form_index in range(len(attribute[3])):
-                            self.add_record(cube[1], attribute[1], attribute[2][form_index], ">10000", "EXCEED")
-                            break
-                    elif distinctElemCount:
-                        for form_index in range(len(attribute[3])):
-                            if distinctElemCount[form_index] != 0:
-                                self.add_record(cube[1], attribute[1], attribute[2][form_index], distinctElemCount[form_index], "OLAP")
-                    else:
-                        logging.info(f"There is no element of string form in attribute \"{attribute[1]}\" to be indexed")
-                self._delReport(projID, reportID)
-                logging.info(f"Distinct element count of Cube: {cube[1]} done.")
+        :param cube_ids: an iterable of (cube id, cube name)
+        :return: the number of cubes counted
+        """
+        cube_count = 0
+        for records, seconds in self._map(self.cube_executor, lambda cube: self._costCube(projID, cube, "OLAP", self._countCube_OLAP), cube_ids):
+            cube_count += 1
+            for record in records:
+                self.add_record(projID, *record, cube_seconds=seconds)
+        return cube_count
+
+    def _countCube_OLAP(self, projID, cube):
+        """
+        Count the element in one OLAP cube through a temporary report
+
+        :param projID: project id
+        :param cube: (cube ID, cube name)
+        :return: a list of (cube id, cube name, attribute id, attribute name, attribute form name, count, type) records
+        """
+        records = []
+        self._startCube(projID, cube)
+        attributes = self.listAttributes(projID, cube[0])
+        reportID = None
+        # a managed cube, or a cube whose attribute results are all known already, needs no temporary report
+        path = self._knownCubePath(projID, cube[0], attributes)
+        if path == MANAGED_PATH:
+            return self.countManagedCube_OLAP(projID, cube, attributes)
+        if path is None:
+            with self.metrics.phase("report"):
+                reportID = self.report_pool.acquire(projID, attributes)
+            if reportID == -1:
+                self._recordCubePath(projID, cube[0], MANAGED_PATH)
+                return self.countManagedCube_OLAP(projID, cube, attributes)
+            if reportID is None:
+                logging.info(f"Cube {cube[1]} skipped, no temporary report could be created")
+                return records
+            self._recordCubePath(projID, cube[0], REPORT_PATH)
+        try:
+            records = self._collectCube_OLAP(projID, cube, attributes, reportID)
+        finally:
+            if reportID is not None:
+                with self.metrics.phase("report"):
+                    self.report_pool.release(projID, reportID)
+        logging.info(f"Distinct element count of Cube: {cube[1]} done.")
+        return records
+
+    def _knownCubePath(self, projID, cubeID, attributes):
+        """
+        Path to count an OLAP cube without a temporary report: a managed cube is read from the cube itself,
+        and a cube whose attribute results are all known needs no report. The path matters once an attribute
+        is over the element limit: a managed cube stops there, a cube read through a report goes on. So it is
+        taken from the journal or the incremental state, and a cube known only from the attribute cache gets
+        a report unless none of its attributes is over the limit.
+
+        :return: REPORT_PATH or MANAGED_PATH, None if the cube needs a temporary report
+        """
+        path = None
+        if self.journal is not None:
+            path = self.journal.getPath(projID, cubeID)
+        if path is None and self.state is not None:
+            path = self.state.getPath(cubeID)
+        if path != MANAGED_PATH:
+            results = [self._peekCount(projID, cubeID, attribute, shared=True) for attribute in attributes]
+            if any(result is None for result in results):
+                return None
+            if path is None and not any(result == 10000 or isinstance(result, dict) for result in results):
+                # both paths give the same records
+                return REPORT_PATH
+        if path is not None:
+            self._recordCubePath(projID, cubeID, path)
+        return path
+
+    def _recordCubePath(self, projID, cubeID, path):
+        if self.journal is not None:
+            self.journal.recordPath(projID, cubeID, path)
+        if self.state is not None:
+            self.state.recordPath(cubeID, path)
+
+    def _collectCube_OLAP(self, projID, cube, attributes, reportID):
+        """
+        Count the attributes of one OLAP cube on its temporary report
+
+        :return: a list of (cube id, cube name, attribute id, attribute name, attribute form name, count, type) records
+        """
+        cutoff = AttributeCutoff(attributes, stop_at_exceed=False)
+        counts = self._mapAttributes(projID, cube[0], attributes, lambda attribute: self._countAttribute(projID, cube[0], attribute,
+                                     lambda cancelled: self.listElements_OLAP(projID, reportID, attribute, cancelled=cancelled), shared=True, cutoff=cutoff),
+                                     shared=True)
+        # an OLAP cube read through a report goes on after an attribute over the limit
+        records = self._collectRecords(projID, cube, attributes, counts, "OLAP", stop_at_exceed=False)
+        # stop the element fetches still in flight before the report is reused
+        counts.close()
+        return records
 
     def countManagedCube_OLAP(self, projID, cube, attributes):
         """
@@ -698,79 +1493,52 @@ class MSTRApp:
         :param projID: project ID
         :param cube: (cube ID, cube name)
         :param attributes: attribute list retrieved from the cube
+        :return: a list of (cube id, cube name, attribute id, attribute name, attribute form name, count, type) records
         """
         logging.info(f"Start counting distinct elements in Cube: {cube[1]}...")
-        for attribute in attributes:
-            distinctElemCount = self.listElements_MTDI(projID, cube[0], attribute)
-            if distinctElemCount == -1:
-                logging.info(f"Cube is not published")
-                break
-            elif distinctElemCount == 10000:
-                for form_index in range(len(attribute[3])):
-                    self.add_record(cube[1], attribute[1], attribute[2][form_index], ">10000", "EXCEED")
-                break
-            elif distinctElemCount:
-                for form_index in range(len(attribute[3])):
-                    if distinctElemCount[form_index] != 0:
-                        self.add_record(cube[1], attribute[1], attribute[2][form_index], distinctElemCount[form_index], "OLAP")
-            else:
-                logging.info(f"There is no element of string form in attribute \"{attribute[1]}\" to be indexed")
+        cutoff = AttributeCutoff(attributes)
+        counts = self._mapAttributes(projID, cube[0], attributes, lambda attribute: self._countAttribute(projID, cube[0], attribute,
+                                     lambda cancelled: self.listElements_MTDI(projID, cube[0], attribute, cancelled=cancelled), shared=True, cutoff=cutoff),
+                                     cutoff.lookahead, shared=True)
+        records = self._collectRecords(projID, cube, attributes, counts, "OLAP")
+        counts.close()
         logging.info(f"Distinct element count of Cube: {cube[1]} done.")
+        return records
 
-    def countElem_OLAP(self, proj, certified_flag):
+    def countElem_OLAP(self, proj, certified_flag, cubes = None):
         """
         Main function of count elements in the project's OLAP cubes
 
         :param proj: [project id, project name]
         :param certified_flag: true/false
+        :param cubes: the (cube id, cube name) to count, if already listed
         """
         start_time = time.time()
-        olap_cubes = self.listCube(proj[0], "OLAP", certified_flag)
-        logging.info(f"Count of OLAP cubes for indexing in {proj[1]}: {len(olap_cubes)}")
-        self.countElemInCube_OLAP(proj[0], olap_cubes)
+        olap_cubes = cubes if cubes is not None else self.listCube(proj[0], "OLAP", certified_flag)
+        # cubes are counted while the search is still paging, so the total is only known afterwards
+        try:
+            cube_count = self.countElemInCube_OLAP(proj[0], olap_cubes)
+        finally:
+            with self.metrics.phase("report"):
+                self.report_pool.releaseProject(proj[0])
+        logging.info(f"Count of OLAP cubes for indexing in {proj[1]}: {cube_count}")
         end_time = time.time()
         elapsed_time = end_time - start_time
         logging.info(f"The sizing time for {proj[1]}'s OLAP cubes was: {elapsed_time} seconds")
+        logging.info(f"Attribute cache: {self.attribute_cache.stats()}")
         
-    def eliminateDup(self):
+    def closeRecords(self, types = resultSink.RECORD_TYPES):
         """
-        Eliminate duplications in OLAP attribute list
-        """
-        columns=['cube_name', 'attribute_name', 'attribute_form_name', 'count_number']
-        df = pd.DataFrame(self.elem_count_OLAP, columns=columns)
-        unique_df = df.drop_duplicates(subset=['attribute_name', 'attribute_form_name'])
-        return unique_df
-    
-    def getRecordsInCSV(self, type):
-        """
-        Create csv files of OLAP and MTDI cubes element counts
+        Write the remaining records of the given types to their output files and log the totals
 
-        :param type: OLAP/MTDI/EXCEED
+        :param types: OLAP/MTDI/EXCEED record types to close
         """
-        field_names = ['cube_name', 'attribute_name', 'attribute_form_name', 'count_number']
-
-        if type == "OLAP":
-            with open("distinct_element_count_OLAP.csv", 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=field_names)
-                writer.writeheader()
-                for record in self.elem_count_OLAP:
-                    writer.writerow(record)
-            unique_df = self.eliminateDup()
-            logging.info(f"Distinct element counts in OLAP cubes so far: {unique_df['count_number'].sum()}")
-        elif type == "MTDI":
-            with open("distinct_element_count_MTDI.csv", 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=field_names)
-                writer.writeheader()
-                for record in self.elem_count_MTDI:
-                    writer.writerow(record)
-            df = pd.DataFrame(self.elem_count_MTDI, columns=field_names)
-            logging.info(f"Distinct element counts in MTDI cubes so far: {df['count_number'].sum()}")
-        elif type == "EXCEED":
-            with open("distinct_element_count_EXCEED.csv", 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=field_names[:3])
-                writer.writeheader()
-                for record in self.elem_exceeded_limit:
-                    writer.writerow(record[:3])
-            df = pd.DataFrame(self.elem_exceeded_limit, columns=field_names)
-            logging.info(f"{len(df) - 1} attributes exceeded 10K limit")
-
+        with self.record_lock:
+            with self.metrics.phase("output"):
+                for type in types:
+                    self.results.close(type)
+            totals = self.results.totals()
+        # an OLAP schema attribute appears once per cube using it, but is only summed once
+        logging.info(f"Distinct element counts in OLAP cubes so far: {totals['olap_unique_sum']}")
+        logging.info(f"Distinct element counts in MTDI cubes so far: {totals['count_sum']['MTDI']}")
+        logging.info(f"{totals['records']['EXCEED']} attribute forms exceeded 10K limit")
@@ -0,0 +1,112 @@
+from operator import itemgetter
+import hyperLogLog
+import fingerprintSet
+
+
+class DistinctCounter:
+    """
+    Incremental distinct counter for the indexed forms of one attribute.
+
+    Keeps one set per form index and ingests element pages as they arrive,
+    so the raw pages can be dropped right after add().
+    """
+    def __init__(self, form_indices, element_limit = None):
+        self.form_indices = list(form_indices)
+        self.element_limit = element_limit
+        self.form_values = [set() for _ in self.form_indices]
+        self.element_count = 0
+
+    def add(self, elements):
+        """
+        Ingest a page of elements
+
+        :param elements: a list of formValues lists, one per element
+        """
+        for values, index in zip(self.form_values, self.form_indices):
+            try:
+                values.update(map(itemgetter(index), elements))
+            except IndexError:
+                # ragged page: elements without this form do not count
+                values.update(element[index] for element in elements if index < len(element))
+        self.element_count += len(elements)
+
+    @property
+    def exceeded(self):
+        """
+        True once more elements than element_limit have been ingested
+        """
+        return self.element_limit is not None and self.element_count > self.element_limit
+
+    def counts(self):
+        """
+        :return: a list of distinct value counts, one per form index; missing values are not counted
+        """
+        return [len(values) - (None in values) for values in self.form_values]
+
+
+class FingerprintDistinctCounter(DistinctCounter):
+    """
+    Exact variant of DistinctCounter that keeps 64-bit fingerprints of the form values in
+    NumPy-backed sets, so long values such as URLs and image paths cost 8 bytes each.
+    """
+    def __init__(self, form_indices, element_limit = None):
+        super().__init__(form_indices, element_limit)
+        self.form_values = [fingerprintSet.FingerprintSet() for _ in self.form_indices]
+
+    def add(self, elements):
+        """
+        Ingest a page of elements
+
+        :param elements: a list of formValues lists, one per element
+        """
+        for values, index in zip(self.form_values, self.form_indices):
+            values.update(element[index] for element in elements if index < len(element))
+        self.element_count += len(elements)
+
+    def counts(self):
+        """
+        :return: a list of distinct value counts, one per form index; missing values are not counted
+        """
+        return [len(values) for values in self.form_values]
+
+
+class ApproxDistinctCounter:
+    """
+    Bounded-memory variant of DistinctCounter that feeds each indexed form into a HyperLogLog sketch.
+
+    It never reports the element limit as exceeded, so high-cardinality attributes get an estimate
+    instead of being dropped.
+    """
+    def __init__(self, form_indices, precision = 14):
+        self.form_indices = list(form_indices)
+        self.sketches = [hyperLogLog.HyperLogLog(precision) for _ in self.form_indices]
+        self.element_count = 0
+        self.exceeded = False
+
+    def add(self, elements):
+        """
+        Ingest a page of elements
+
+        :param elements: a list of formValues lists, one per element
+        """
+        for sketch, index in zip(self.sketches, self.form_indices):
+            for element in elements:
+                if index < len(element) and element[index] is not None:
+                    sketch.add(element[index])
+        self.element_count += len(elements)
+
+    def merge(self, other):
+        """
+        Fold the sketches of another counter over the same forms into this one
+
+        :param other: ApproxDistinctCounter
+        """
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        self.element_count += other.element_count
+
+    def counts(self):
+        """
+        :return: a list of estimated distinct value counts, one per form index
+        """
+        return [round(sketch.estimate()) for sketch in self.sketches]
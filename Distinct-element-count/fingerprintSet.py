@@ -0,0 +1,61 @@
+import hyperLogLog
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class FingerprintSet:
+    """
+    Exact distinct set that keeps a 64-bit fingerprint of each value instead of the value itself.
+
+    Fingerprints are the 64-bit blake2b digest of str(value), so values are told apart by their
+    text, as the REST API returns form values; two different texts share one with a chance of
+    about n^2 / 2^65, i.e. 3e-8 for a million values. The set
+    is a sorted, deduplicated NumPy array (8 bytes per distinct value) plus a buffer of new
+    fingerprints that is merged into it once it holds as many entries as the set.
+    """
+    def __init__(self, merge_threshold = 65536):
+        if np is None:
+            raise ImportError("Fingerprint sets require the numpy package")
+        self.merge_threshold = merge_threshold
+        self.values = np.empty(0, dtype=np.uint64)
+        self.pending = []
+        self.pending_count = 0
+
+    def update(self, values):
+        """
+        Add an iterable of values; None is not counted
+        """
+        fingerprints = np.fromiter((hyperLogLog.fingerprint(value) for value in values if value is not None), dtype=np.uint64)
+        if not len(fingerprints):
+            return
+        self.pending.append(fingerprints)
+        self.pending_count += len(fingerprints)
+        if self.pending_count >= max(self.merge_threshold, len(self.values)):
+            self._merge()
+
+    def _merge(self):
+        if not self.pending:
+            return
+        # both runs are sorted, so the stable sort (timsort) only merges them
+        merged = np.concatenate([self.values, np.unique(np.concatenate(self.pending))])
+        merged.sort(kind='stable')
+        keep = np.empty(len(merged), dtype=bool)
+        keep[:1] = True
+        np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+        self.values = merged[keep]
+        self.pending = []
+        self.pending_count = 0
+
+    def __len__(self):
+        self._merge()
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the fingerprints, merged and pending
+        """
+        return self.values.nbytes + sum(pending.nbytes for pending in self.pending)
@@ -4,7 +4,7 @@ class Generator:
     def __init__(self):
         pass
 
-    def generate(self, attributes, destinationFolderID):
+    def generate(self, attributes, destinationFolderID, name = "Temp report"):
         units = []
         for attribute in attributes:
             unit = {
@@ -16,7 +16,7 @@ class Generator:
 
         json_dict = {
             "information": {
-                "name": "Temp report",  # attribute name
+                "name": name,  # report name
                 "destinationFolderId": destinationFolderID
             },
             "sourceType": "normal",
@@ -0,0 +1,72 @@
+import hashlib
+import math
+
+
+def fingerprint(value):
+    """
+    Stable 64-bit hash of a form value, the same across runs and processes
+
+    :param value: form value
+    :return: unsigned 64-bit int
+    """
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def relativeError(precision):
+    """
+    :param precision: number of index bits, the sketch has 2 ** precision registers
+    :return: relative standard error of the estimate
+    """
+    return 1.04 / math.sqrt(1 << precision)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch (Flajolet et al.) with the small-range linear counting correction.
+
+    Memory is 2 ** precision bytes whatever the number of values added. Two sketches with the
+    same precision can be merged, e.g. when pages or workers count the same form separately.
+    """
+    def __init__(self, precision = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        x = fingerprint(value)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        # position of the leftmost 1-bit in the remaining 64 - precision bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        Fold another sketch of the same precision into this one
+
+        :param other: HyperLogLog
+        """
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """
+        :return: estimated number of distinct values added
+        """
+        if self.m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+        raw = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            return self.m * math.log(self.m / zeros)
+        return raw
+
+    @property
+    def relative_error(self):
+        return relativeError(self.precision)
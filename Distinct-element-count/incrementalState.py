@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+import logging
+
+
+class IncrementalState:
+    """
+    Per-cube results of the previous runs, keyed by cube id.
+
+    A cube keeps the version it was counted at (its modification and data update timestamps),
+    the distinct element result of each attribute and, for OLAP cubes, the path it was counted
+    through. While the version seen in this run
+    matches the stored one, the stored results are carried forward instead of re-counting.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.previous = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as state_file:
+                self.previous = json.load(state_file)
+        self.current = {}
+        self.carried_forward = set()
+        self.lock = threading.Lock()
+
+    def setVersion(self, projID, cubeID, version):
+        """
+        Register the version of a cube found in this run
+
+        :param version: string identifying the cube definition and data, None if unknown
+        """
+        with self.lock:
+            self.current[cubeID] = {'project': projID, 'version': version, 'attributes': {}}
+
+    def isUnchanged(self, cubeID):
+        previous = self.previous.get(cubeID)
+        current = self.current.get(cubeID)
+        return (previous is not None and current is not None and current['version'] is not None
+                and previous['version'] == current['version'])
+
+    def get(self, cubeID, attributeID):
+        """
+        :return: the previous result of an attribute if its cube has not changed since, else None
+        """
+        if not self.isUnchanged(cubeID):
+            return None
+        result = self.previous[cubeID]['attributes'].get(attributeID)
+        if result is not None:
+            with self.lock:
+                self.carried_forward.add(cubeID)
+        return result
+
+    def getPath(self, cubeID):
+        """
+        :return: the previous path of an OLAP cube, "report" or "managed", if it has not changed since, else None
+        """
+        if not self.isUnchanged(cubeID):
+            return None
+        return self.previous[cubeID].get('path')
+
+    def recordPath(self, cubeID, path):
+        with self.lock:
+            if cubeID in self.current:
+                self.current[cubeID]['path'] = path
+
+    def record(self, cubeID, attributeID, result):
+        with self.lock:
+            if cubeID in self.current:
+                self.current[cubeID]['attributes'][attributeID] = result
+
+    def save(self):
+        """
+        Write the state for the next run; cubes not seen in this run keep their previous entry
+        """
+        with self.lock:
+            state = dict(self.previous)
+            state.update(self.current)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as state_file:
+                json.dump(state, state_file)
+            os.replace(temp_path, self.path)
+        logging.info(f"Incremental state saved: {len(self.carried_forward)} unchanged cubes carried forward, "
+                     f"{len(self.current) - len(self.carried_forward)} cubes counted")
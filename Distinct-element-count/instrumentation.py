@@ -0,0 +1,183 @@
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+OBJECT_ID = re.compile(r'[0-9A-Fa-f]{32}')
+
+
+def endpointName(method, path):
+    """
+    :return: the endpoint of a request with its object ids and query left out, e.g. "GET /api/cubes/{id}"
+    """
+    return method.upper() + " " + OBJECT_ID.sub("{id}", path.split("?", 1)[0])
+
+
+class Metrics:
+    """
+    Counters and timers of one run.
+
+    Requests are kept per endpoint: count, errors, retries, bytes received and a latency
+    histogram. Phases (search, status, attributes, report, elements, count, output) add up
+    the seconds spent in them over all threads, so with workers they can exceed the wall
+    time. Every counted cube keeps its cost, to rank the slowest ones.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.endpoints = defaultdict(lambda: {'requests': 0, 'errors': 0, 'retries': 0, 'bytes': 0,
+                                              'latency_sum': 0.0, 'latency_max': 0.0,
+                                              'buckets': [0] * (len(LATENCY_BUCKETS) + 1)})
+        self.phases = defaultdict(lambda: {'seconds': 0.0, 'count': 0})
+        self.cubes = []
+        # requests sent so far, read by the request budget
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def observeRequest(self, endpoint, status, latency, received = 0):
+        """
+        :param endpoint: see endpointName
+        :param status: HTTP status code, None if the request failed without a response
+        :param latency: seconds until the response headers arrived
+        :param received: bytes of the response body, if known
+        """
+        bucket = next((index for index, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats['requests'] += 1
+            self.requests += 1
+            if status is None or status >= 400:
+                stats['errors'] += 1
+            stats['bytes'] += received
+            stats['latency_sum'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            stats['buckets'][bucket] += 1
+
+    def addBytes(self, endpoint, received):
+        with self.lock:
+            self.endpoints[endpoint]['bytes'] += received
+
+    def countRetry(self, endpoint):
+        with self.lock:
+            self.endpoints[endpoint]['retries'] += 1
+
+    def addPhase(self, phase, seconds):
+        with self.lock:
+            self.phases[phase]['seconds'] += seconds
+            self.phases[phase]['count'] += 1
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Time the enclosed block as part of a phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addPhase(phase, time.perf_counter() - start)
+
+    def cubeCost(self, projID, cube, type, seconds, records):
+        """
+        Keep the cost of a counted cube
+
+        :param cube: (cube id, cube name)
+        :param type: "OLAP" or "MTDI"
+        :param records: number of records the cube produced
+        """
+        with self.lock:
+            self.cubes.append({'project': projID, 'cube_id': cube[0], 'cube': cube[1], 'type': type,
+                               'seconds': round(seconds, 3), 'records': records})
+
+    def summary(self, slowest = 20):
+        """
+        :return: the run as a JSON-serialisable dict
+        """
+        with self.lock:
+            endpoints = {}
+            for endpoint, stats in sorted(self.endpoints.items()):
+                buckets = {}
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats['buckets']):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                endpoints[endpoint] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes': stats['bytes'],
+                    'latency': {
+                        'sum': round(stats['latency_sum'], 3),
+                        'mean': round(stats['latency_sum'] / stats['requests'], 4) if stats['requests'] else 0.0,
+                        'max': round(stats['latency_max'], 3),
+                        'buckets': buckets
+                    }
+                }
+            phases = {phase: {'seconds': round(stats['seconds'], 3), 'count': stats['count']}
+                      for phase, stats in sorted(self.phases.items())}
+            cubes = sorted(self.cubes, key=lambda cube: cube['seconds'], reverse=True)
+        return {
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'seconds': round(time.time() - self.started, 3),
+            'requests': sum(stats['requests'] for stats in endpoints.values()),
+            'bytes': sum(stats['bytes'] for stats in endpoints.values()),
+            'endpoints': endpoints,
+            'phases': phases,
+            'cubes': len(cubes),
+            'slowest_cubes': cubes[:slowest]
+        }
+
+    def writeJson(self, path):
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            json.dump(self.summary(), metrics_file, indent=2)
+
+    def prometheusText(self):
+        """
+        :return: the run in the Prometheus text exposition format
+        """
+        summary = self.summary()
+        lines = []
+
+        def metric(name, type, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        endpoints = summary['endpoints']
+        metric("mstr_requests_total", "counter", "REST requests sent",
+               [({'endpoint': endpoint}, stats['requests']) for endpoint, stats in endpoints.items()])
+        metric("mstr_request_errors_total", "counter", "REST requests answered with an error or without a response",
+               [({'endpoint': endpoint}, stats['errors']) for endpoint, stats in endpoints.items()])
+        metric("mstr_request_retries_total", "counter", "REST requests sent again after a failure",
+               [({'endpoint': endpoint}, stats['retries']) for endpoint, stats in endpoints.items()])
+        metric("mstr_response_bytes_total", "counter", "Bytes of the response bodies received",
+               [({'endpoint': endpoint}, stats['bytes']) for endpoint, stats in endpoints.items()])
+        lines.append("# HELP mstr_request_duration_seconds REST request latency")
+        lines.append("# TYPE mstr_request_duration_seconds histogram")
+        for endpoint, stats in endpoints.items():
+            label = f'endpoint="{_escape(endpoint)}"'
+            for bound, count in stats['latency']['buckets'].items():
+                lines.append(f'mstr_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"mstr_request_duration_seconds_sum{{{label}}} {stats['latency']['sum']}")
+            lines.append(f"mstr_request_duration_seconds_count{{{label}}} {stats['requests']}")
+        metric("mstr_phase_seconds_total", "counter", "Seconds spent in each phase, summed over threads",
+               [({'phase': phase}, stats['seconds']) for phase, stats in summary['phases'].items()])
+        metric("mstr_cube_seconds", "gauge", "Seconds spent counting the slowest cubes",
+               [({'project': cube['project'], 'cube_id': cube['cube_id'], 'type': cube['type']}, cube['seconds'])
+                for cube in summary['slowest_cubes']])
+        metric("mstr_run_seconds", "gauge", "Seconds since the run started", [({}, summary['seconds'])])
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.prometheusText())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,69 @@
+import codecs
+import json
+
+# whitespace and separators between the items of a JSON array
+SEPARATORS = ' \t\n\r,'
+
+
+def iterArray(chunks):
+    """
+    Decode the items of a top-level JSON array one by one, while its bytes are still arriving.
+
+    Only the undecoded tail of the stream and the current item are held in memory, so an
+    element page never exists as a whole string or object tree.
+
+    :param chunks: an iterable of bytes, e.g. response.iter_content()
+    :return: a generator of the decoded array items
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+    exhausted = False
+    while True:
+        # skip to the next item, reading on while only separators are left
+        while True:
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            if position < len(buffer) or exhausted:
+                break
+            buffer, position, exhausted = _read(chunks, utf8, buffer, position)
+        if position == len(buffer):
+            if started:
+                raise ValueError("JSON array is not closed")
+            return
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError(f"expected a JSON array, found {buffer[position]!r}")
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if exhausted:
+                raise
+            buffer, position, exhausted = _read(chunks, utf8, buffer, position)
+            continue
+        if end == len(buffer) and not exhausted:
+            # a number at the very end of the buffer may continue in the next chunk
+            buffer, position, exhausted = _read(chunks, utf8, buffer, position)
+            continue
+        position = end
+        yield item
+
+
+def _read(chunks, utf8, buffer, position):
+    """
+    Drop the decoded part of the buffer and append the next chunk
+
+    :return: (buffer, position, exhausted)
+    """
+    chunk = next(chunks, None)
+    if chunk is None:
+        return buffer[position:] + utf8.decode(b'', final=True), 0, True
+    return buffer[position:] + utf8.decode(chunk), 0, False
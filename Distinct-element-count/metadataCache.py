@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+import logging
+
+
+class MetadataCache:
+    """
+    Cache of metadata responses (projects, report folders, cube definitions, certified
+    dashboards), keyed by (project id, key) and valid for ttl seconds.
+
+    An entry keeps the parsed body together with the ETag and Last-Modified headers it came
+    with, so an expired entry can be revalidated with a conditional request instead of being
+    downloaded again. An entry can also carry a version, e.g. the modification time of its cube,
+    and is only returned for that version. Saved to and loaded from a JSON file to outlive the run;
+    the file records the server and user it was filled for, and is ignored for any other, as the
+    projects and folders a user sees depend on both.
+    """
+    def __init__(self, path = None, ttl = 86400, base_url = None, username = None):
+        self.path = path
+        self.ttl = ttl
+        self.base_url = base_url
+        self.username = username
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as cache_file:
+                saved = json.load(cache_file)
+        except (OSError, json.JSONDecodeError) as error:
+            logging.info(f"Metadata cache {self.path} ignored: {error}")
+            return
+        # files written by earlier versions are a bare list, without the server and user
+        if not isinstance(saved, dict) or (saved.get('base_url'), saved.get('username')) != (self.base_url, self.username):
+            logging.info(f"Metadata cache {self.path} ignored: it was not written for {self.username} on {self.base_url}")
+            return
+        now = time.time()
+        for projID, key, entry in saved['entries']:
+            # an expired entry is only worth keeping if the server can revalidate it
+            if now - entry['stored'] < self.ttl or entry.get('etag') or entry.get('last_modified'):
+                self.entries[(projID, key)] = entry
+        logging.info(f"Metadata cache: {len(self.entries)} entries loaded from {self.path}")
+
+    def get(self, projID, key, version = None):
+        """
+        :return: the cached body if it is fresh and of this version, else None
+        """
+        with self.lock:
+            entry = self.entries.get((projID, key))
+            if entry is not None and entry.get('version') == version and time.time() - entry['stored'] < self.ttl:
+                self.hits += 1
+                return entry['body']
+            self.misses += 1
+            return None
+
+    def validators(self, projID, key, version = None):
+        """
+        :return: the conditional request headers of an expired entry of this version, empty if there is none
+        """
+        with self.lock:
+            entry = self.entries.get((projID, key))
+        headers = {}
+        if entry is not None and entry.get('version') == version:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def revalidate(self, projID, key):
+        """
+        Restart the TTL of an entry the server answered 304 Not Modified for
+
+        :return: the cached body
+        """
+        with self.lock:
+            entry = self.entries[(projID, key)]
+            entry['stored'] = time.time()
+            self.revalidated += 1
+            return entry['body']
+
+    def put(self, projID, key, body, version = None, headers = None):
+        """
+        :param body: parsed response, or any JSON-serialisable value derived from it
+        :param headers: response headers, for the ETag and Last-Modified validators
+        """
+        headers = headers or {}
+        with self.lock:
+            self.entries[(projID, key)] = {
+                'stored': time.time(),
+                'version': version,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'body': body
+            }
+
+    def stats(self):
+        """
+        :return: dict with hits, misses, revalidated entries and number of entries
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated, 'entries': len(self.entries)}
+
+    def save(self):
+        logging.info(f"Metadata cache: {self.stats()}")
+        if not self.path:
+            return
+        with self.lock:
+            entries = [[projID, key, entry] for (projID, key), entry in self.entries.items()]
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'base_url': self.base_url, 'username': self.username, 'entries': entries}, cache_file)
+        os.replace(temp_path, self.path)
+        logging.info(f"Metadata cache: {len(entries)} entries saved to {self.path}")
@@ -0,0 +1,117 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import distinct_elem_count
+
+
+class ProjectScheduler:
+    """
+    Runs the projects of an environment side by side, cheapest first.
+
+    The cost of a project is estimated from the totals of one item searches for its OLAP and MTDI
+    cubes, without listing them. Projects are then counted in order of increasing cost,
+    project_workers at a time, each one streaming its cubes into counting as its search pages
+    arrive. All projects share the cube and element pools of the app, so -workers stays the global
+    budget of concurrent cube and element requests. Under a time or request budget a project lists
+    its cubes and attributes when it is scheduled, to count the most valuable cubes first; the
+    attribute lists are handed to the counting pass and not fetched twice. Planning stops with the
+    budget too: projects and cubes not planned yet are deferred without being listed.
+    """
+    def __init__(self, app, project_workers = 1):
+        self.app = app
+        self.project_workers = project_workers
+
+    def run(self, projects, certified, OLAP_flag = True, MTDI_flag = True):
+        """
+        Count the elements of all given projects
+
+        :param projects: a list of (project id, project name)
+        :param certified: true/false
+        :param OLAP_flag: count OLAP cubes
+        :param MTDI_flag: count MTDI cubes
+        """
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.project_workers, thread_name_prefix="project") as executor:
+            costs = list(executor.map(lambda proj: self.estimate(proj, OLAP_flag, MTDI_flag), projects))
+            # projects whose cost is unknown go last
+            order = sorted(zip(projects, costs), key=lambda item: (item[1] is None, item[1] or 0))
+            total_cost = sum(cost or 0 for cost in costs)
+            logging.info(f"Estimated {len(projects)} projects, {total_cost} cubes")
+            # the pool picks queued projects up in submission order, so the cheapest ones start first
+            futures = {executor.submit(self._countProject, proj, certified, OLAP_flag, MTDI_flag): (proj, cost) for proj, cost in order}
+            done_cost = 0
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                proj, cost = futures[future]
+                done_cost += cost or 0
+                logging.info(f"Project {proj[1]} done ({done}/{len(projects)} projects, "
+                             f"{done_cost}/{total_cost} estimated cubes, {time.time() - start_time:.1f} seconds)")
+
+    def estimate(self, proj, OLAP_flag = True, MTDI_flag = True):
+        """
+        Estimate what counting a project costs from the totals of its cube searches
+
+        :param proj: (project id, project name)
+        :return: the number of cubes of the counted types, None if a search did not report its total
+        """
+        cost = 0
+        for subtype, flag in ((distinct_elem_count.SUBTYPE_OLAP_CUBE, OLAP_flag), (distinct_elem_count.SUBTYPE_MTDI_CUBE, MTDI_flag)):
+            if not flag:
+                continue
+            count = self.app.countObjects(proj[0], subtype)
+            if count is None:
+                return None
+            cost += count
+        logging.info(f"Project {proj[1]}: estimated cost {cost} cubes")
+        return cost
+
+    def plan(self, proj, cubetype, certified):
+        """
+        List the cubes of a project and their attributes, most valuable first for the budget
+
+        :param proj: (project id, project name)
+        :param cubetype: "MTDI" or "OLAP"
+        :return: the (cube id, cube name) of the project, in counting order; cubes whose attributes were
+                 not listed before the budget was spent are deferred and left out
+        """
+        budget = self.app.budget
+        cubes = list(self.app.listCube(proj[0], cubetype, certified))
+        planned = []
+        for cube, attributes in zip(cubes, self.app._map(self.app.cube_executor, lambda cube: self._planCube(proj, cube), cubes)):
+            if attributes is None:
+                budget.defer(proj[0], cube, cubetype)
+            else:
+                planned.append((cube, attributes))
+        if budget.exhausted():
+            # the counting pass defers these as well, without the dossier requests of cubePriority
+            return [cube for cube, _ in planned]
+        cube_priority = {cube[0]: self.app.cubePriority(proj[0], cube, attributes, cubetype) for cube, attributes in planned}
+        # certified cubes first, then the cheapest, so a spent budget defers the least valuable work
+        return sorted((cube for cube, _ in planned), key=lambda cube: cube_priority[cube[0]])
+
+    def _planCube(self, proj, cube):
+        """
+        :return: the attributes of the cube, None if the budget is spent
+        """
+        if self.app.budget.exhausted():
+            return None
+        return self.app.planAttributes(proj[0], cube[0])
+
+    def _countProject(self, proj, certified, OLAP_flag, MTDI_flag):
+        budget = self.app.budget
+        cubetypes = [(cubetype, count) for cubetype, flag, count in (("OLAP", OLAP_flag, self.app.countElem_OLAP),
+                                                                    ("MTDI", MTDI_flag, self.app.countElem_MTDI)) if flag]
+        if budget is not None and budget.exhausted():
+            # a project started after the budget was spent is deferred without a single request
+            for cubetype, _ in cubetypes:
+                budget.defer(proj[0], None, cubetype)
+            return
+        self.app.setFolderID(proj[0])
+        for cubetype, count in cubetypes:
+            if budget is None:
+                # cubes are counted as the search pages arrive
+                count(proj, certified)
+            elif budget.exhausted():
+                budget.defer(proj[0], None, cubetype)
+            else:
+                count(proj, certified, self.plan(proj, cubetype, certified))
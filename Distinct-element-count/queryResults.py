@@ -0,0 +1,121 @@
+import argparse
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+# latest and earliest counted run of every (project, cube, attribute, form) since a start time
+UNIT_RUNS = """
+    SELECT project_id, cube_id, attribute_id, attribute_form_name, MIN(run_id) AS first_run, MAX(run_id) AS last_run
+    FROM result
+    WHERE run_id IN (SELECT id FROM run WHERE started_at >= :since)
+    GROUP BY project_id, cube_id, attribute_id, attribute_form_name
+"""
+UNIT_JOIN = """
+    JOIN result first ON first.project_id = units.project_id AND first.cube_id = units.cube_id
+        AND first.attribute_id = units.attribute_id AND first.attribute_form_name = units.attribute_form_name
+        AND first.run_id = units.first_run
+    JOIN result last ON last.project_id = units.project_id AND last.cube_id = units.cube_id
+        AND last.attribute_id = units.attribute_id AND last.attribute_form_name = units.attribute_form_name
+        AND last.run_id = units.last_run
+"""
+# EXCEED records have no count unless they were sampled, they are ranked as 10001 elements
+COUNT = "COALESCE({0}.count_number, 10001)"
+
+
+def growth(connection, since, top):
+    """
+    :return: the attribute forms whose count grew the most between their first and last run since a time
+    """
+    return connection.execute(f"""
+        SELECT last.cube_name, last.attribute_name, last.attribute_form_name, {COUNT.format('first')} AS before,
+               {COUNT.format('last')} AS after, {COUNT.format('last')} - {COUNT.format('first')} AS growth
+        FROM ({UNIT_RUNS}) units {UNIT_JOIN}
+        WHERE units.first_run < units.last_run
+        ORDER BY growth DESC
+        LIMIT :top
+    """, {'since': since, 'top': top}).fetchall()
+
+
+def overThreshold(connection, minimum, since = None, run = None):
+    """
+    :return: without since, the attribute forms of a run (default the latest) with at least minimum
+             elements; with since, those that reached minimum since that time
+    """
+    if since is not None:
+        return connection.execute(f"""
+            SELECT last.cube_name, last.attribute_name, last.attribute_form_name, {COUNT.format('first')} AS before,
+                   {COUNT.format('last')} AS after
+            FROM ({UNIT_RUNS}) units {UNIT_JOIN}
+            WHERE {COUNT.format('first')} < :minimum AND {COUNT.format('last')} >= :minimum
+            ORDER BY after DESC
+        """, {'since': since, 'minimum': minimum}).fetchall()
+    return connection.execute(f"""
+        SELECT cube_name, attribute_name, attribute_form_name, {COUNT.format('result')} AS count
+        FROM result
+        WHERE run_id = :run AND {COUNT.format('result')} >= :minimum
+        ORDER BY count DESC
+    """, {'run': run or latestRun(connection), 'minimum': minimum}).fetchall()
+
+
+def cubeTotals(connection, run = None, top = None):
+    """
+    :return: per cube of a run (default the latest): attribute forms, summed count, forms over 10K and seconds
+    """
+    return connection.execute("""
+        SELECT cube_name, type, COUNT(*) AS forms, SUM(count_number) AS total, SUM(type = 'EXCEED') AS exceeded,
+               MAX(cube_seconds) AS seconds
+        FROM result
+        WHERE run_id = :run
+        GROUP BY project_id, cube_id
+        ORDER BY total DESC
+        LIMIT :top
+    """, {'run': run or latestRun(connection), 'top': top or -1}).fetchall()
+
+
+def latestRun(connection):
+    row = connection.execute("SELECT MAX(id) FROM run").fetchone()
+    return row[0]
+
+
+def printRows(header, rows):
+    widths = [max([len(str(value)) for value in column] + [len(name)]) for name, column in zip(header, zip(*rows))] if rows else [len(name) for name in header]
+    print("  ".join(name.ljust(width) for name, width in zip(header, widths)))
+    for row in rows:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the result database written with -resultDb.')
+    parser.add_argument('database', help='Specify the SQLite result database')
+    queries = parser.add_subparsers(dest='query', required=True)
+    growth_parser = queries.add_parser('growth', help='Attribute forms whose count grew the most')
+    growth_parser.add_argument('-days', metavar='N', type=int, default=30, help='Specify how many days back to compare')
+    growth_parser.add_argument('-top', metavar='N', type=int, default=20, help='Specify the number of rows')
+    over_parser = queries.add_parser('over', help='Attribute forms with at least a number of elements')
+    over_parser.add_argument('-min', metavar='N', type=int, default=5000, help='Specify the threshold')
+    over_parser.add_argument('-days', metavar='N', type=int, default=None, help='Specify to list only the forms that crossed the threshold in the last N days')
+    over_parser.add_argument('-run', metavar='id', type=int, default=None, help='Specify the run (default: latest)')
+    cubes_parser = queries.add_parser('cubes', help='Totals per cube')
+    cubes_parser.add_argument('-run', metavar='id', type=int, default=None, help='Specify the run (default: latest)')
+    cubes_parser.add_argument('-top', metavar='N', type=int, default=None, help='Specify the number of rows')
+    args = parser.parse_args()
+
+    since = None
+    if getattr(args, 'days', None) is not None:
+        since = (datetime.now(timezone.utc) - timedelta(days=args.days)).isoformat(timespec='seconds')
+    connection = sqlite3.connect(f"file:{args.database}?mode=ro", uri=True)
+    try:
+        if args.query == 'growth':
+            printRows(['cube', 'attribute', 'form', 'before', 'after', 'growth'], growth(connection, since, args.top))
+        elif args.query == 'over':
+            if since is not None:
+                printRows(['cube', 'attribute', 'form', 'before', 'after'], overThreshold(connection, args.min, since))
+            else:
+                printRows(['cube', 'attribute', 'form', 'count'], overThreshold(connection, args.min, run=args.run))
+        elif args.query == 'cubes':
+            printRows(['cube', 'type', 'forms', 'total', 'over 10K', 'seconds'], cubeTotals(connection, args.run, args.top))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import atexit
+import logging
+import threading
+import uuid
+from collections import Counter
+import generateJson
+
+
+class ReportPool:
+    """
+    Pool of the temporary reports used to read the elements of OLAP cubes.
+
+    Instead of a create, save and delete cycle per cube, an idle report of the project is
+    reused as it is when it already holds the attributes of the next cube, else redefined for
+    it, and reports are only deleted once their project is done.
+    With in_memory the report instances are not saved at all, as long as the server serves
+    the elements of unsaved instances; this is probed once and the pool falls back to saving.
+
+    Every report is tracked until it is deleted and close() also runs at exit, so reports
+    are not left behind after an error or Ctrl-C.
+    """
+    def __init__(self, app, size = 1, in_memory = False):
+        self.app = app
+        self.size = size
+        # None until the first unsaved report has been probed
+        self.in_memory = None if in_memory else False
+        self.run_id = uuid.uuid4().hex[:8]
+        self.created = 0
+        # report id -> {'project', 'instance', 'name', 'attributes', 'saved'} for every report not deleted yet;
+        # 'saved' is set once a save was sent, a failed save may still have stored the report
+        self.reports = {}
+        # project id -> list of report ids not in use
+        self.idle = {}
+        self.round_trips = Counter()
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def acquire(self, projID, attributes):
+        """
+        Get a report holding the given attributes
+
+        :param projID: project id
+        :param attributes: attribute list retrieved from the cube
+        :return: report id, -1 if the cube contains managed objects, None if no report could be made
+        """
+        attributeIDs = {attribute[0] for attribute in attributes}
+        with self.lock:
+            idle = self.idle.get(projID)
+            reportID = None
+            if idle:
+                # a report holding every attribute of the cube is read as it is, without a redefinition or a save
+                fitting = [candidate for candidate in idle if attributeIDs <= self.reports[candidate]['attributes']]
+                reportID = fitting[-1] if fitting else idle[-1]
+                idle.remove(reportID)
+        if reportID is not None and attributeIDs <= self.reports[reportID]['attributes']:
+            self._count('reuse')
+            return reportID
+        if reportID is not None:
+            report = self.reports[reportID]
+            body = generateJson.Generator().generate(attributes, self.app.folderID(projID), report['name'])
+            self._count('redefine')
+            redefined = self.app._redefineReport(projID, reportID, report['instance'], body)
+            if redefined == -1:
+                # managed objects cannot be put on a report, the report itself is still fine
+                self.release(projID, reportID)
+                return -1
+            if redefined:
+                report['attributes'] = attributeIDs
+                self._persist(projID, reportID, attributes)
+                return reportID
+            self._delete(reportID)
+
+        with self.lock:
+            self.created += 1
+            name = f"Temp report {self.run_id}-{self.created}"
+        body = generateJson.Generator().generate(attributes, self.app.folderID(projID), name)
+        self._count('create')
+        reportID, instanceID = self.app._createReport(projID, body)
+        if reportID == -1 and instanceID == -1:
+            return -1
+        if not reportID:
+            logging.info(f"!!! Report creation failed !!!")
+            return None
+        with self.lock:
+            self.reports[reportID] = {'project': projID, 'instance': instanceID, 'name': name, 'attributes': attributeIDs, 'saved': False}
+        self._persist(projID, reportID, attributes)
+        return reportID
+
+    def _persist(self, projID, reportID, attributes):
+        """
+        Save the report instance, unless unsaved instances are known to serve elements
+        """
+        report = self.reports[reportID]
+        if self.in_memory is None and attributes:
+            self._count('probe')
+            self.in_memory = self.app._probeReport(projID, reportID, attributes[0])
+            logging.info(f"Unsaved temporary reports are {'' if self.in_memory else 'not '}supported by the server")
+        if self.in_memory:
+            return
+        self._count('save')
+        report['saved'] = True
+        self.app._saveReport(reportID, report['instance'])
+
+    def release(self, projID, reportID):
+        """
+        Give a report back once the elements of its cube have been read
+        """
+        with self.lock:
+            idle = self.idle.setdefault(projID, [])
+            if len(idle) < self.size:
+                idle.append(reportID)
+                return
+        self._delete(reportID)
+
+    def releaseProject(self, projID):
+        """
+        Delete the idle reports of a project that is done
+        """
+        with self.lock:
+            idle = self.idle.pop(projID, [])
+        for reportID in idle:
+            self._delete(reportID)
+
+    def _delete(self, reportID):
+        with self.lock:
+            report = self.reports.pop(reportID, None)
+        if report is None or not report['saved']:
+            # instances that were never saved go away with the session
+            return
+        self._count('delete')
+        if not self.app._delReport(report['project'], reportID):
+            logging.info(f"Temporary report {report['name']} ({reportID}) could not be deleted, remove it manually")
+
+    def _count(self, round_trip):
+        with self.lock:
+            self.round_trips[round_trip] += 1
+
+    def close(self):
+        """
+        Delete every report that is still around, idle or not
+        """
+        with self.lock:
+            self.idle = {}
+            reportIDs = list(self.reports)
+        for reportID in reportIDs:
+            self._delete(reportID)
+        if self.round_trips:
+            logging.info(f"Temporary report round trips: {dict(self.round_trips)}")
+            self.round_trips.clear()
@@ -0,0 +1,253 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+import requests
+from requests.adapters import HTTPAdapter
+import adaptiveLimiter
+import instrumentation
+
+# requests that can be sent again without side effects
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# transient gateway errors; 500 is left out, MSTR answers it for cubes that are not published
+RETRY_STATUS = {502, 503, 504}
+# errors raised while the body of a streamed response is read, after request() has returned
+STREAM_ERRORS = (requests.exceptions.ChunkedEncodingError, requests.ConnectionError, requests.Timeout)
+
+
+class AuthenticationError(Exception):
+    """
+    Raised when logging in to MSTR or creating an API token fails
+    """
+
+
+class RestSession:
+    """
+    Shared transport layer for the MSTR REST calls.
+
+    Wraps a pooled requests.Session so every call reuses keep-alive connections,
+    negotiates gzip/deflate and carries the auth token and session cookies. Requests go
+    through an AdaptiveLimiter sized to the pool; throttled (429) requests are sent again
+    once the server allows it.
+
+    Idempotent requests that fail on a connection error or a gateway error are retried
+    with exponential backoff and full jitter. A request rejected with 401 logs in again
+    through the relogin callback and is replayed once.
+
+    A successful streamed request keeps its limiter slot while its body is downloaded, until
+    finish() is called; a stream broken off while it is read is for the caller to retry.
+    """
+    def __init__(self, base_url, pool_size = 10, timeout = 300, verify = True, max_rps = None,
+                 latency_target = None, throttle_retries = 5, max_retries = 4, backoff_base = 0.5,
+                 backoff_cap = 30, metrics = None) -> None:
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limiter = adaptiveLimiter.AdaptiveLimiter(pool_size, 1, pool_size, max_rps, latency_target)
+        self.throttle_retries = throttle_retries
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # called without arguments to log in again once the auth token has expired
+        self.relogin = None
+        self.auth_lock = threading.Lock()
+        self.counters = Counter()
+        self.counter_lock = threading.Lock()
+        # optional instrumentation.Metrics observing every request
+        self.metrics = metrics
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'Content-Type': 'application/json'
+        })
+
+    def setAuthToken(self, authtoken):
+        """
+        Attach the auth token to every following request
+
+        :param authtoken: X-MSTR-AuthToken returned by login
+        """
+        self.session.headers['X-MSTR-AuthToken'] = authtoken
+
+    def cookies(self):
+        """
+        :return: the session cookies as a name -> value dict
+        """
+        return self.session.cookies.get_dict()
+
+    def authToken(self):
+        """
+        :return: the auth token currently attached to the requests, None if logged out
+        """
+        return self.session.headers.get('X-MSTR-AuthToken')
+
+    def clear(self):
+        """
+        Drop the auth token and the session cookies
+        """
+        self.session.headers.pop('X-MSTR-AuthToken', None)
+        self.session.cookies.clear()
+
+    def request(self, method, path, projID = None, headers = None, **kwargs):
+        """
+        Send a REST request through the pooled session
+
+        :param method: HTTP method
+        :param path: path relative to the base url, e.g. "/api/projects"
+        :param projID: project id sent as X-MSTR-ProjectID, if any
+        :param headers: additional headers for this request only
+        :return: requests.Response
+        """
+        request_headers = {}
+        if projID is not None:
+            request_headers['X-MSTR-ProjectID'] = projID
+        if headers:
+            request_headers.update(headers)
+        kwargs.setdefault('timeout', self.timeout)
+        retries = 0
+        throttled = 0
+        renewed = False
+        while True:
+            token = self.authToken()
+            try:
+                response = self._send(method, path, request_headers, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                delay = self.retryDelay(method, path, None, retries)
+                if delay is None:
+                    raise
+                logging.info(f"{method} {path} failed ({error}), retrying in {delay:.1f} seconds")
+                retries += 1
+                time.sleep(delay)
+                continue
+            status = response.status_code
+            if status == 401 and not renewed and self.canRenewToken(path):
+                renewed = True
+                response.close()
+                self.renewToken(token)
+                continue
+            if status == 429 and throttled < self.throttle_retries:
+                # a throttled request was not processed, it is safe to send again after the pause
+                throttled += 1
+                self.countThrottled(method, path)
+                logging.info(f"{method} {path} throttled by the server, attempt {throttled}")
+                response.close()
+                continue
+            delay = self.retryDelay(method, path, status, retries)
+            if delay is None:
+                return response
+            # give the connection of a streamed response back before the next attempt
+            response.close()
+            logging.info(f"{method} {path} answered {status}, retrying in {delay:.1f} seconds")
+            retries += 1
+            time.sleep(delay)
+
+    def retryDelay(self, method, path, status, retries):
+        """
+        Decide whether a failed request is sent again
+
+        :param method: HTTP method
+        :param path: request path, for the log
+        :param status: HTTP status code, None for a connection error or timeout
+        :param retries: number of retries made so far
+        :return: seconds to wait before the retry, None to give up
+        """
+        if method.upper() not in IDEMPOTENT_METHODS or (status is not None and status not in RETRY_STATUS):
+            return None
+        if retries >= self.max_retries:
+            self.countEvent('gave_up')
+            logging.info(f"{method} {path} still failing after {retries} retries, giving up")
+            return None
+        self.countEvent('retries')
+        if self.metrics is not None:
+            self.metrics.countRetry(instrumentation.endpointName(method, path))
+        return backoffDelay(retries, self.backoff_base, self.backoff_cap)
+
+    def countEvent(self, counter):
+        with self.counter_lock:
+            self.counters[counter] += 1
+
+    def countThrottled(self, method, path):
+        self.countEvent('throttled')
+        if self.metrics is not None:
+            self.metrics.countRetry(instrumentation.endpointName(method, path))
+
+    def canRenewToken(self, path):
+        return self.relogin is not None and not path.startswith("/api/auth/")
+
+    def renewToken(self, stale_token):
+        """
+        Log in again after a 401, once for all the requests that were sent with the same expired token
+
+        :param stale_token: the auth token the rejected request was sent with
+        """
+        with self.auth_lock:
+            if self.authToken() != stale_token:
+                # another request has logged in again already
+                return
+            self.countEvent('relogins')
+            logging.info("Auth token rejected, logging in again")
+            self.relogin()
+
+    def _send(self, method, path, headers, kwargs):
+        endpoint = instrumentation.endpointName(method, path)
+        self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers, **kwargs)
+        except requests.RequestException:
+            latency = time.monotonic() - start
+            self.limiter.release(None, latency)
+            if self.metrics is not None:
+                self.metrics.observeRequest(endpoint, None, latency)
+            raise
+        latency = time.monotonic() - start
+        retry_after = response.headers.get('Retry-After')
+        if response.status_code == 429 and retry_after is None:
+            # no hint from the server, wait at least a second before the next attempt
+            retry_after = 1
+        if kwargs.get('stream') and response.status_code == 200:
+            # the body is still to come, the slot is given back by finish()
+            response.slot = (response.status_code, latency, retry_after)
+        else:
+            self.limiter.release(response.status_code, latency, retry_after)
+        if self.metrics is not None:
+            if 'Content-Length' in response.headers:
+                received = int(response.headers['Content-Length'])
+            else:
+                # the body of a streamed response is counted by whoever reads it, see response.endpoint
+                received = 0 if kwargs.get('stream') else len(response.content)
+            self.metrics.observeRequest(endpoint, response.status_code, latency, received)
+        response.endpoint = endpoint
+        return response
+
+    def finish(self, response):
+        """
+        Close a streamed response once its body has been read or abandoned, and give its request slot back
+
+        :param response: requests.Response returned by request(..., stream=True)
+        """
+        response.close()
+        slot = getattr(response, 'slot', None)
+        if slot is not None:
+            response.slot = None
+            self.limiter.release(*slot)
+
+    def close(self):
+        logging.info(f"Request limiter: {self.limiter.stats()}")
+        logging.info(f"Request retries: {dict(self.counters)}")
+        self.session.close()
+
+
+def backoffDelay(retries, base, cap):
+    """
+    Exponential backoff with full jitter
+
+    :param retries: number of retries made so far
+    :return: seconds to wait, drawn uniformly up to base * 2^retries, capped
+    """
+    return random.uniform(0, min(cap, base * 2 ** retries))
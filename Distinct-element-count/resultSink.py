@@ -0,0 +1,200 @@
+import csv
+import json
+import logging
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+RECORD_TYPES = ("OLAP", "MTDI", "EXCEED")
+# columns of every record; EXCEED records have no count unless they are sampled
+FIELD_NAMES = ['project_id', 'cube_id', 'cube_name', 'attribute_id', 'attribute_name', 'attribute_form_name',
+               'count_number', 'error_bound', 'ci_low', 'ci_high', 'cube_seconds', 'recorded_at']
+
+
+def fieldNames(type, approx = False, sampled = False):
+    """
+    :param type: OLAP/MTDI/EXCEED
+    :param approx: true when the counts are HyperLogLog estimates, which carry an error bound
+    :param sampled: true when attributes over the limit are estimated from a sample, with a confidence interval
+    :return: the columns written for records of this type
+    """
+    if type == "EXCEED":
+        excluded = ('error_bound',) if sampled else ('count_number', 'error_bound', 'ci_low', 'ci_high')
+    else:
+        excluded = ('ci_low', 'ci_high') if approx else ('error_bound', 'ci_low', 'ci_high')
+    return [name for name in FIELD_NAMES if name not in excluded]
+
+
+class ResultSink:
+    """
+    Output file receiving records as they are produced.
+
+    Records are kept in a buffer and written every buffer_size records, so an interrupted run
+    loses at most one buffer. Subclasses implement _open, _writeRows and _close.
+    """
+    def __init__(self, path, field_names, buffer_size = 1000):
+        self.path = path
+        self.field_names = field_names
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.rows = 0
+        self._open()
+
+    def write(self, record):
+        """
+        :param record: dict with at least the sink's field names
+        """
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._writeRows(self.buffer)
+            self.rows += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self._close()
+
+
+class CsvSink(ResultSink):
+    def _open(self):
+        self.file = open(self.path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.field_names, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def _writeRows(self, records):
+        self.writer.writerows(records)
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+
+class JsonLinesSink(ResultSink):
+    def _open(self):
+        self.file = open(self.path, 'w', encoding='utf-8')
+
+    def _writeRows(self, records):
+        self.file.writelines(json.dumps({name: record.get(name) for name in self.field_names}) + "\n" for record in records)
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+
+class ParquetSink(ResultSink):
+    """
+    Parquet file with one row group per buffer
+    """
+    def _open(self):
+        if pa is None:
+            raise ImportError("Parquet output requires the pyarrow package")
+        types = {'count_number': pa.int64(), 'error_bound': pa.int64(), 'ci_low': pa.int64(), 'ci_high': pa.int64(), 'cube_seconds': pa.float64()}
+        self.schema = pa.schema([(name, types.get(name, pa.string())) for name in self.field_names])
+        self.writer = pq.ParquetWriter(self.path, self.schema)
+
+    def _writeRows(self, records):
+        columns = {name: [record.get(name) for record in records] for name in self.field_names}
+        # ">10000" of an attribute that could not be sampled has no place in an integer column
+        if 'count_number' in columns:
+            columns['count_number'] = [count if isinstance(count, int) else None for count in columns['count_number']]
+        self.writer.write_table(pa.table(columns, schema=self.schema))
+
+    def _close(self):
+        self.writer.close()
+
+
+SINKS = {'csv': CsvSink, 'jsonl': JsonLinesSink, 'parquet': ParquetSink}
+
+
+class ResultWriter:
+    """
+    Routes records to one sink per record type and keeps running totals.
+
+    The files are named distinct_element_count_<type>.<format> and opened on the first record
+    of their type, or empty by close. Without a format, records are only totalled. With a
+    resultStore.ResultStore, every record is also stored in it, and the store is closed with
+    the last type. Callers serialise write and close.
+    """
+    def __init__(self, format = "csv", directory = ".", approx = False, buffer_size = 1000, store = None, sampled = False):
+        if format is not None and format not in SINKS:
+            raise ValueError(f"Unknown output format {format}, expected one of {', '.join(SINKS)}")
+        if format == "parquet" and pa is None:
+            raise ImportError("Parquet output requires the pyarrow package")
+        self.format = format
+        self.directory = directory
+        self.approx = approx
+        self.sampled = sampled
+        self.buffer_size = buffer_size
+        self.store = store
+        self.sinks = {}
+        self.closed = set()
+        self.records = {type: 0 for type in RECORD_TYPES}
+        self.count_sum = {type: 0 for type in RECORD_TYPES}
+        # OLAP schema attributes recur across cubes; their forms are only summed once per project
+        self.olap_forms = set()
+        self.olap_unique_sum = 0
+
+    def path(self, type):
+        return os.path.join(self.directory, f"distinct_element_count_{type}.{self.format}")
+
+    def _sink(self, type):
+        if type not in self.sinks:
+            self.sinks[type] = SINKS[self.format](self.path(type), fieldNames(type, self.approx, self.sampled), self.buffer_size)
+        return self.sinks[type]
+
+    def write(self, record, type):
+        """
+        :param record: dict keyed by FIELD_NAMES
+        :param type: OLAP/MTDI/EXCEED
+        """
+        self.records[type] += 1
+        if isinstance(record.get('count_number'), int):
+            self.count_sum[type] += record['count_number']
+            if type == "OLAP":
+                key = (record['project_id'], record['attribute_id'], record['attribute_form_name'])
+                if key not in self.olap_forms:
+                    self.olap_forms.add(key)
+                    self.olap_unique_sum += record['count_number']
+        if type in self.closed:
+            return
+        if self.format is not None:
+            self._sink(type).write(record)
+        if self.store is not None:
+            self.store.write(record, type)
+
+    def totals(self):
+        """
+        :return: dict with the records per type, the summed counts per type and the OLAP sum without repeated attributes
+        """
+        return {
+            'records': dict(self.records),
+            'count_sum': dict(self.count_sum),
+            'olap_unique_sum': self.olap_unique_sum
+        }
+
+    def flush(self):
+        for sink in self.sinks.values():
+            sink.flush()
+        if self.store is not None:
+            self.store.flush()
+
+    def close(self, type):
+        """
+        Write the rest of a type's records and close its file, creating it if no record came
+        """
+        if type in self.closed:
+            return
+        self.closed.add(type)
+        if self.format is not None:
+            self._sink(type).close()
+            logging.info(f"{self.sinks[type].rows} {type} records written to {self.path(type)}")
+        if self.store is not None and self.closed.issuperset(RECORD_TYPES):
+            self.store.close()
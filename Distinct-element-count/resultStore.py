@@ -0,0 +1,118 @@
+import logging
+import sqlite3
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS run (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    base_url TEXT,
+    records INTEGER
+);
+CREATE INDEX IF NOT EXISTS run_started ON run (started_at);
+CREATE TABLE IF NOT EXISTS result (
+    run_id INTEGER NOT NULL REFERENCES run (id),
+    project_id TEXT NOT NULL,
+    cube_id TEXT NOT NULL,
+    cube_name TEXT,
+    attribute_id TEXT NOT NULL,
+    attribute_name TEXT,
+    attribute_form_name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    count_number INTEGER,
+    error_bound INTEGER,
+    ci_low INTEGER,
+    ci_high INTEGER,
+    cube_seconds REAL,
+    recorded_at TEXT
+);
+CREATE INDEX IF NOT EXISTS result_unit ON result (project_id, cube_id, attribute_id, attribute_form_name, run_id);
+CREATE INDEX IF NOT EXISTS result_run ON result (run_id, type);
+"""
+COLUMNS = ('project_id', 'cube_id', 'cube_name', 'attribute_id', 'attribute_name', 'attribute_form_name',
+           'count_number', 'error_bound', 'ci_low', 'ci_high', 'cube_seconds', 'recorded_at')
+
+
+class ResultStore:
+    """
+    SQLite database keeping the records of every run, for queries across runs.
+
+    A run row is added when the store is opened and finished when it is closed. Records are
+    buffered and inserted batch_size at a time, one transaction per batch. Results are indexed
+    by (project, cube, attribute, form, run), runs by their start time. The database is in WAL
+    mode, so it can be queried while a run writes to it. Callers serialise write and close.
+    """
+    def __init__(self, path, base_url = None, batch_size = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.records = 0
+        # records arrive from the project threads, one at a time under the app's record lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        # databases written before the confidence interval columns existed
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(result)")}
+        for column in ('ci_low', 'ci_high'):
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE result ADD COLUMN {column} INTEGER")
+        with self.connection:
+            cursor = self.connection.execute("INSERT INTO run (started_at, base_url) VALUES (?, ?)",
+                                             (_now(), base_url))
+        self.run_id = cursor.lastrowid
+        logging.info(f"Results stored in {path} as run {self.run_id}")
+
+    def write(self, record, type):
+        """
+        :param record: dict keyed by resultSink.FIELD_NAMES
+        :param type: OLAP/MTDI/EXCEED
+        """
+        row = {column: record.get(column) for column in COLUMNS}
+        # EXCEED records of attributes that were not sampled have no count, ">10000" is not stored
+        if not isinstance(row['count_number'], int):
+            row['count_number'] = None
+        self.buffer.append((self.run_id, type, *row.values()))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO result (run_id, type, " + ", ".join(COLUMNS) + ") VALUES (" + ", ".join("?" * (len(COLUMNS) + 2)) + ")",
+                self.buffer)
+        self.records += len(self.buffer)
+        self.buffer = []
+
+    def lastCounts(self, projID):
+        """
+        :return: dict of (cube id, attribute id) -> largest form count of the attribute in the last
+                 earlier run that counted it, 10001 for attributes over the limit
+        """
+        rows = self.connection.execute("""
+            SELECT result.cube_id, result.attribute_id, MAX(COALESCE(result.count_number, 10001))
+            FROM result
+            JOIN (SELECT cube_id, attribute_id, MAX(run_id) AS run_id FROM result
+                  WHERE project_id = :project AND run_id < :run GROUP BY cube_id, attribute_id) latest
+                USING (cube_id, attribute_id, run_id)
+            WHERE result.project_id = :project
+            GROUP BY result.cube_id, result.attribute_id
+        """, {'project': projID, 'run': self.run_id}).fetchall()
+        return {(cubeID, attributeID): count for cubeID, attributeID, count in rows}
+
+    def close(self):
+        """
+        Insert the remaining records and mark the run finished
+        """
+        self.flush()
+        with self.connection:
+            self.connection.execute("UPDATE run SET finished_at = ?, records = ? WHERE id = ?",
+                                    (_now(), self.records, self.run_id))
+        self.connection.close()
+        logging.info(f"{self.records} records stored in {self.path}")
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
@@ -0,0 +1,79 @@
+import json
+import time
+import logging
+import threading
+
+# result of an attribute that was not counted because the budget was spent
+DEFERRED = "deferred"
+# assumed element count of an attribute without history, half the element limit
+UNKNOWN_ESTIMATE = 5000
+
+
+class RunBudget:
+    """
+    Time and request budget of a run.
+
+    Checked before every cube and every attribute is counted. Once it is spent, no new work
+    starts: the cubes and attributes in flight finish, so the budget is overrun by at most the
+    work in flight. The units that were not counted are kept as deferred and written to a
+    JSON-lines file; run again with -resume to count them, the checkpoint journal skips the rest.
+    """
+    def __init__(self, seconds = None, max_requests = None, metrics = None):
+        self.seconds = seconds
+        self.max_requests = max_requests
+        self.metrics = metrics
+        self.started = time.monotonic()
+        self.deferred = []
+        self.spent_reason = None
+        self.lock = threading.Lock()
+
+    def exhausted(self):
+        """
+        :return: true once the time or the requests of the budget are spent
+        """
+        if self.spent_reason is not None:
+            return True
+        reason = None
+        if self.seconds is not None and time.monotonic() - self.started >= self.seconds:
+            reason = f"time budget of {self.seconds} seconds"
+        elif self.max_requests is not None and self.metrics is not None and self.metrics.requests >= self.max_requests:
+            reason = f"budget of {self.max_requests} requests"
+        if reason is None:
+            return False
+        with self.lock:
+            if self.spent_reason is None:
+                self.spent_reason = reason
+                logging.info(f"Spent the {reason}, deferring the remaining work")
+        return True
+
+    def defer(self, projID, cube, type, attribute = None):
+        """
+        Keep a unit that was not counted
+
+        :param cube: (cube id, cube name), None for all cubes of the type in the project
+        :param type: "OLAP" or "MTDI"
+        :param attribute: the attribute tuple, None for a whole cube
+        """
+        with self.lock:
+            self.deferred.append({
+                'project_id': projID,
+                'cube_id': cube[0] if cube is not None else None,
+                'cube_name': cube[1] if cube is not None else None,
+                'type': type,
+                'attribute_id': attribute[0] if attribute is not None else None,
+                'attribute_name': attribute[1] if attribute is not None else None
+            })
+
+    def writeDeferred(self, path):
+        """
+        Write the deferred units, one JSON object per line
+
+        :return: the number of units written
+        """
+        with self.lock:
+            deferred = list(self.deferred)
+        with open(path, 'w', encoding='utf-8') as deferred_file:
+            for unit in deferred:
+                deferred_file.write(json.dumps(unit) + "\n")
+        logging.info(f"{len(deferred)} deferred units written to {path}")
+        return len(deferred)
@@ -0,0 +1,159 @@
+import math
+import random
+from collections import Counter
+
+# two-sided 95% normal quantile
+Z_95 = 1.959964
+METHODS = ("chao1", "gee")
+
+
+def sampleOffsets(total, windows, window_size, seed = None):
+    """
+    Offsets of the element windows to fetch: the elements are cut into windows equal strata and
+    each window starts at a random position inside its stratum. When the windows would cover
+    every element anyway, the offsets tile the whole attribute.
+
+    :param total: element count of the attribute
+    :param windows: number of windows
+    :param window_size: elements per window
+    :param seed: seed of the window positions, e.g. the attribute id, so reruns fetch the same sample
+    :return: a sorted list of offsets
+    """
+    if windows * window_size >= total:
+        return list(range(0, total, window_size))
+    rng = random.Random(seed)
+    stride = total / windows
+    return [int(index * stride) + rng.randrange(max(int(stride) - window_size, 0) + 1) for index in range(windows)]
+
+
+def frequencyCounts(occurrences):
+    """
+    :param occurrences: Counter of value -> times it was sampled
+    :return: (distinct values in the sample, Counter of j -> number of values seen exactly j times)
+    """
+    return len(occurrences), Counter(occurrences.values())
+
+
+def estimate(windows, total, method = "chao1", z = Z_95):
+    """
+    Estimate the distinct values of a form over all elements of an attribute from windows of them.
+
+    The estimators take the sampled elements as independent, but elements next to each other tend
+    to share values, so their own variance is too small for a sample of windows. The variance is
+    the larger of it and the delete-one-window jackknife variance, which follows how much the
+    windows differ from each other. A sample without any value seen twice only bounds the
+    count from below, its upper bound is one value per element.
+
+    :param windows: the form values of the sampled elements, one list per window, None for missing values
+    :param total: element count of the attribute
+    :param method: "chao1" or "gee"
+    :param z: normal quantile of the confidence interval
+    :return: [estimate, lower bound, upper bound], rounded to integers
+    """
+    window_counts = [Counter(value for value in window if value is not None) for window in windows]
+    window_sizes = [len(window) for window in windows]
+    sample = sum(window_sizes)
+    if sample == 0:
+        return [0, 0, 0]
+    occurrences = Counter()
+    for window_count in window_counts:
+        occurrences.update(window_count)
+    distinct, frequencies = frequencyCounts(occurrences)
+    unseen, variance = _unseen(frequencies, sample, total, method)
+    if len(windows) > 1:
+        jackknife = _jackknifeVariance(occurrences, distinct, frequencies, window_counts, window_sizes, sample, total, method)
+        # without doubletons the model variance is huge whatever the sample, e.g. on an ID form
+        variance = max(variance, jackknife) if frequencies[2] else jackknife
+    # every element that was not sampled can add at most one value
+    ceiling = distinct + max(total - sample, 0)
+    low, high = _logNormalInterval(distinct, unseen, variance, z)
+    if not frequencies[2]:
+        # no value was seen twice, nothing rules out that every element has its own value
+        high = ceiling
+    return [round(min(distinct + unseen, ceiling)), round(min(low, ceiling)), round(min(high, ceiling))]
+
+
+def _unseen(frequencies, sample, total, method):
+    """
+    :return: (estimated unseen values, model variance of the estimate)
+    """
+    if method == "gee":
+        return _gee(frequencies, sample, total)
+    return _chao1(frequencies, sample, total)
+
+
+def _jackknifeVariance(occurrences, distinct, frequencies, window_counts, window_sizes, sample, total, method):
+    """
+    Delete-one-window jackknife variance of the estimated distinct count. The estimators only
+    read the values seen once and twice, so each window only updates those counts by the values
+    it holds instead of counting the sample again.
+    """
+    estimates = []
+    for window_count, window_size in zip(window_counts, window_sizes):
+        remaining = distinct
+        f1 = frequencies[1]
+        f2 = frequencies[2]
+        for value, count in window_count.items():
+            before = occurrences[value]
+            after = before - count
+            f1 -= before == 1
+            f2 -= before == 2
+            f1 += after == 1
+            f2 += after == 2
+            remaining -= after == 0
+        unseen, _ = _unseen({1: f1, 2: f2}, sample - window_size, total, method)
+        estimates.append(remaining + unseen)
+    mean = sum(estimates) / len(estimates)
+    return (len(estimates) - 1) / len(estimates) * sum((value - mean) ** 2 for value in estimates)
+
+
+def _chao1(frequencies, sample, total):
+    """
+    Chao1 lower bound for sampling without replacement (Chao and Lin, 2012): values seen once
+    and twice predict the unseen ones, discounted by the sampled share of the elements, so a
+    sample of every element predicts none.
+
+    :return: (estimated unseen values, variance of the estimate)
+    """
+    f1 = frequencies[1]
+    f2 = frequencies[2]
+    fraction = sample / total if total else 1.0
+    if fraction >= 1 or f1 == 0:
+        return 0.0, 0.0
+    correction = sample / (sample - 1) if sample > 1 else 1.0
+    finite = fraction / (1 - fraction) * f1
+    if f2 > 0:
+        unseen = f1 * f1 / (correction * 2 * f2 + finite)
+        ratio = f1 / f2
+        variance = f2 * (ratio ** 4 / 4 + ratio ** 3 + ratio ** 2 / 2)
+    else:
+        # bias-corrected form, defined without doubletons
+        unseen = f1 * (f1 - 1) / (correction * 2 + finite)
+        variance = f1 * (f1 - 1) / 2 + f1 * (2 * f1 - 1) ** 2 / 4
+    return unseen, variance
+
+
+def _gee(frequencies, sample, total):
+    """
+    Guaranteed-Error Estimator (Charikar et al., 2000): values seen more than once are counted
+    as they are, values seen once are scaled by sqrt(total / sample). Its ratio error is bounded
+    for any value distribution, where Chao1 can underestimate badly on skewed ones.
+
+    :return: (estimated unseen values, variance of the estimate, taking f1 as Poisson)
+    """
+    f1 = frequencies[1]
+    if sample >= total or f1 == 0:
+        return 0.0, 0.0
+    scale = math.sqrt(total / sample) - 1
+    return scale * f1, scale * scale * f1
+
+
+def _logNormalInterval(distinct, unseen, variance, z):
+    """
+    Confidence interval of distinct + unseen, taking the unseen part as log-normal (Chao, 1987),
+    so the lower bound never drops below the values already seen
+    """
+    if unseen <= 0:
+        return distinct, distinct
+    spread = math.exp(z * math.sqrt(math.log(1 + variance / (unseen * unseen))))
+    return distinct + unseen / spread, distinct + unseen * spread
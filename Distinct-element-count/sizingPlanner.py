@@ -0,0 +1,167 @@
+import json
+import math
+import time
+import logging
+import threading
+
+import distinct_elem_count
+import samplingEstimator
+
+ELEMENT_LIMIT = 10000
+PAGE_SIZE = 100000
+
+
+class SizingPlanner:
+    """
+    Dry run: estimates what counting the given projects would cost, without downloading
+    elements or creating reports.
+
+    Projects, cubes and attributes are enumerated as the counting pass does. Every attribute with
+    a string form is probed with a single element request on its cube, OLAP cubes included; the
+    element count the server reports and the size of that one element give the pages and bytes
+    its download would take. OLAP schema
+    attributes are shared through the attribute cache, so only their first cube in a project pays
+    for them. The projected wall time assumes every request takes the mean probe latency plus its
+    transfer at the given bandwidth, spread over concurrency requests in flight.
+    """
+    def __init__(self, app, concurrency = 1, bandwidth = 20 * 2 ** 20):
+        self.app = app
+        self.concurrency = concurrency
+        self.bandwidth = bandwidth
+        self.probes = 0
+        self.probe_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def run(self, projects, certified, OLAP_flag = True, MTDI_flag = True):
+        """
+        :param projects: a list of (project id, project name)
+        :return: the project plans in the order the scheduler would count them, cheapest first
+        """
+        plans = [self.planProject(proj, certified, OLAP_flag, MTDI_flag) for proj in projects]
+        latency = self.meanLatency()
+        for plan in plans:
+            plan['seconds'] = self.projectSeconds(plan['requests'], plan['bytes'], latency)
+            for cube in plan['cubes']:
+                cube['seconds'] = self.projectSeconds(cube['requests'], cube['bytes'], latency)
+            plan['cubes'].sort(key=lambda cube: cube['seconds'], reverse=True)
+        plans.sort(key=lambda plan: plan['seconds'])
+        return plans
+
+    def planProject(self, proj, certified, OLAP_flag = True, MTDI_flag = True):
+        """
+        :param proj: (project id, project name)
+        :return: dict with the project, its cubes and its estimated requests and bytes
+        """
+        plan = {'project': proj, 'cubes': [], 'attributes': 0, 'requests': 0, 'bytes': 0, 'unknown': 0}
+        seen_attributes = set()
+        for cubetype, flag in (("OLAP", OLAP_flag), ("MTDI", MTDI_flag)):
+            if not flag:
+                continue
+            cubes = list(self.app.listCube(proj[0], cubetype, certified))
+            # the search pages and the status batches of the cube listing
+            plan['requests'] += len(cubes) // self.app.search_page_size + 1 + math.ceil(len(cubes) / distinct_elem_count.cube_status_batch)
+            for cube in cubes:
+                cube_plan = self._planCube(proj[0], cube, cubetype, seen_attributes)
+                plan['cubes'].append(cube_plan)
+                plan['attributes'] += cube_plan['attributes']
+                plan['requests'] += cube_plan['requests']
+                plan['bytes'] += cube_plan['bytes']
+                plan['unknown'] += cube_plan['unknown']
+            if cubetype == "OLAP" and cubes:
+                # the pooled temporary reports are deleted once the project is done
+                plan['requests'] += min(self.app.report_pool.size, len(cubes))
+        logging.info(f"Project {proj[1]}: {len(plan['cubes'])} cubes, {plan['attributes']} attributes, "
+                     f"{plan['requests']} requests, {plan['bytes']} bytes estimated")
+        return plan
+
+    def _planCube(self, projID, cube, cubetype, seen_attributes):
+        attributes = [attribute for attribute in self.app.listAttributes(projID, cube[0]) if attribute[3]]
+        # the cube definition
+        cube_plan = {'cube': cube, 'type': cubetype, 'attributes': len(attributes), 'requests': 1, 'bytes': 0, 'unknown': 0}
+        if cubetype == "OLAP":
+            # OLAP schema attributes are counted once per project, later cubes hit the attribute cache
+            attributes = [attribute for attribute in attributes if (attribute[0], tuple(attribute[4])) not in seen_attributes]
+            seen_attributes.update((attribute[0], tuple(attribute[4])) for attribute in attributes)
+            if attributes:
+                # defining the temporary report and saving or probing it
+                cube_plan['requests'] += 2
+        probes = self.app._map(self.app.element_executor, lambda attribute: self._probe(projID, cube[0], attribute), attributes)
+        for total, element_bytes in probes:
+            if total == -1:
+                # the counting pass stops at the first attribute of an unpublished cube
+                cube_plan['requests'] += 1
+                break
+            if total is None:
+                cube_plan['unknown'] += 1
+                cube_plan['requests'] += 1
+                continue
+            requests, elements = self.attributeDownload(total)
+            cube_plan['requests'] += requests
+            cube_plan['bytes'] += elements * element_bytes
+            if total > ELEMENT_LIMIT and self.app.approx_precision is None and cubetype == "MTDI":
+                # the counting pass stops at the first MTDI attribute over the limit
+                break
+        probes.close()
+        return cube_plan
+
+    def _probe(self, projID, cubeID, attribute):
+        start = time.perf_counter()
+        result = self.app.probeElements(projID, cubeID, attribute)
+        with self.lock:
+            self.probes += 1
+            self.probe_seconds += time.perf_counter() - start
+        return result
+
+    def attributeDownload(self, total):
+        """
+        :param total: element count of the attribute
+        :return: (element requests, elements downloaded) of counting it, as _pageElements pages
+        """
+        if self.app.approx_precision is not None:
+            # no limit: full pages until one comes back short
+            return total // PAGE_SIZE + 1, total
+        # pages are capped at one element past the limit, an attribute over it stops after that page
+        limit = min(PAGE_SIZE, ELEMENT_LIMIT + 1)
+        if total > ELEMENT_LIMIT and self.app.sample_windows:
+            # then its sample windows, all of them unless they would cover the attribute anyway
+            windows = len(samplingEstimator.sampleOffsets(total, self.app.sample_windows, self.app.sample_window_size))
+            return 1 + windows, limit + min(windows * self.app.sample_window_size, total)
+        return 1, min(total, limit)
+
+    def meanLatency(self):
+        with self.lock:
+            return self.probe_seconds / self.probes if self.probes else 0.0
+
+    def projectSeconds(self, requests, bytes, latency):
+        """
+        :return: projected wall time of requests sending bytes, concurrency at a time
+        """
+        return (requests * latency + bytes / self.bandwidth) / max(self.concurrency, 1)
+
+    def printPlan(self, plans, top = 10):
+        """
+        Print the projects in the order they would be counted, with their costliest cubes
+        """
+        latency = self.meanLatency()
+        print(f"{self.probes} probes, mean latency {latency * 1000:.1f} ms, bandwidth {self.bandwidth / 2 ** 20:.1f} MiB/s, concurrency {self.concurrency}")
+        print(f"{'project':<40} {'cubes':>6} {'attributes':>11} {'requests':>9} {'MiB':>9} {'est. s':>9} {'unknown':>8}")
+        for plan in plans:
+            print(f"{plan['project'][1][:40]:<40} {len(plan['cubes']):6} {plan['attributes']:11} {plan['requests']:9} "
+                  f"{plan['bytes'] / 2 ** 20:9.1f} {plan['seconds']:9.1f} {plan['unknown']:8}")
+            for cube in plan['cubes'][:top]:
+                print(f"    {cube['type']:<5} {cube['cube'][1][:30]:<30} {'':6} {cube['attributes']:11} {cube['requests']:9} "
+                      f"{cube['bytes'] / 2 ** 20:9.1f} {cube['seconds']:9.1f} {cube['unknown']:8}")
+        total_requests = sum(plan['requests'] for plan in plans)
+        total_bytes = sum(plan['bytes'] for plan in plans)
+        print(f"Total: {total_requests} requests, {total_bytes / 2 ** 20:.1f} MiB, "
+              f"about {self.projectSeconds(total_requests, total_bytes, latency):.0f} seconds at concurrency {self.concurrency}")
+
+    def writeJson(self, plans, path):
+        with open(path, 'w', encoding='utf-8') as plan_file:
+            json.dump({
+                'probes': self.probes,
+                'mean_latency': round(self.meanLatency(), 4),
+                'bandwidth': self.bandwidth,
+                'concurrency': self.concurrency,
+                'projects': plans
+            }, plan_file, indent=2)
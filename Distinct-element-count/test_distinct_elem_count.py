@@ -1,20 +1,58 @@
 import distinct_elem_count
+import async_distinct_elem_count
+import projectScheduler
+import sizingPlanner
+import restSession
 import os
 import argparse
 import getpass
 
-os.environ["MSTR_BASE_URL"] = "https://aqueduct-tech3.customer.cloud.microstrategy.com/MicroStrategyLibrary"
-os.environ["MSTR_USERNAME"] = "xinyli"
-os.environ["MSTR_PASSWORD"] = "1Sarah_L.010726"
-
 def main():
     parser = argparse.ArgumentParser(description='Count distinct elements in MicroStrategy projects.')
     parser.add_argument('-projID', metavar='project_id', type=str, help='Specify project ID to run against')
     parser.add_argument('-certified', action='store_true', help='Specify if count elements against certified dashboards or all dashboards')
     parser.add_argument('-OLAP', action='store_true', help='Specify the cube type (OLAP)')
     parser.add_argument('-MTDI', action='store_true', help='Specify the cube type (MTDI)')
+    parser.add_argument('-poolSize', metavar='pool_size', type=int, default=10, help='Specify the number of pooled HTTP connections kept alive')
+    parser.add_argument('-timeout', metavar='seconds', type=float, default=300, help='Specify the timeout of a single REST request')
+    parser.add_argument('-workers', metavar='N', type=int, default=1, help='Specify the number of cubes and attribute element fetches processed concurrently')
+    parser.add_argument('-projectWorkers', metavar='N', type=int, default=1, help='Specify the number of projects counted concurrently, cheapest first')
+    parser.add_argument('-maxRps', metavar='N', type=float, default=None, help='Specify the maximum number of REST requests sent per second')
+    parser.add_argument('-latencyTarget', metavar='seconds', type=float, default=None, help='Specify the response time above which the number of in-flight requests is reduced')
+    parser.add_argument('-searchPageSize', metavar='N', type=int, default=1000, help='Specify the number of search results fetched per request')
+    parser.add_argument('-approx', metavar='precision', type=int, nargs='?', const=14, default=None, help='Specify to estimate distinct counts with HyperLogLog sketches of the given precision (default 14)')
+    parser.add_argument('-compactSets', action='store_true', help='Specify to count exactly on 64-bit fingerprints of the form values to save memory')
+    parser.add_argument('-sample', metavar='windows', type=int, nargs='?', const=20, default=None, help='Specify to estimate the attributes over the element limit from this many windows of their elements (default 20)')
+    parser.add_argument('-sampleWindowSize', metavar='N', type=int, default=1000, help='Specify the number of elements per -sample window')
+    parser.add_argument('-sampleMethod', metavar='method', type=str, default='chao1', choices=['chao1', 'gee'], help='Specify the estimator of -sample: chao1 or gee')
+    parser.add_argument('-async', dest='async_engine', action='store_true', help='Specify to fetch attributes and elements with the asyncio engine')
+    parser.add_argument('-projectConcurrency', metavar='N', type=int, default=50, help='Specify the number of in-flight requests per project for the asyncio engine')
+    parser.add_argument('-checkpoint', metavar='path', type=str, default='checkpoint.jsonl', help='Specify the checkpoint journal of completed attributes')
+    parser.add_argument('-resume', action='store_true', help='Specify to skip the attributes already recorded in the checkpoint journal')
+    parser.add_argument('-attributeCacheSize', metavar='N', type=int, default=10000, help='Specify the number of OLAP attribute results shared across cubes, 0 to disable')
+    parser.add_argument('-attributeCache', metavar='path', type=str, default=None, help='Specify a file to keep the OLAP attribute results across runs')
+    parser.add_argument('-attributeCacheTtl', metavar='seconds', type=float, default=86400, help='Specify how long an OLAP attribute result in the -attributeCache file is reused before the attribute is counted again')
+    parser.add_argument('-metadataCache', metavar='path', type=str, nargs='?', const='metadata_cache.json', default=None, help='Specify a file to keep projects, report folders, cube definitions and certified dashboards across runs (default metadata_cache.json)')
+    parser.add_argument('-metadataTtl', metavar='seconds', type=float, default=86400, help='Specify how long cached metadata is used before it is revalidated')
+    parser.add_argument('-incremental', metavar='path', type=str, nargs='?', const='incremental_state.json', default=None, help='Specify to re-count only the cubes changed since the run that wrote this state file')
+    parser.add_argument('-reportPoolSize', metavar='N', type=int, default=None, help='Specify the number of temporary reports kept per project for reuse across OLAP cubes (default: -workers)')
+    parser.add_argument('-inMemoryReports', action='store_true', help='Specify to read OLAP elements from unsaved temporary report instances when the server allows it')
+    parser.add_argument('-output', metavar='format', type=str, default='csv', choices=['csv', 'jsonl', 'parquet'], help='Specify the format of the output files: csv, jsonl or parquet')
+    parser.add_argument('-outputDir', metavar='path', type=str, default='.', help='Specify the folder receiving the output files')
+    parser.add_argument('-resultDb', metavar='path', type=str, nargs='?', const='results.db', default=None, help='Specify to also store the records in a SQLite database keeping every run (default results.db), see queryResults.py')
+    parser.add_argument('-timeBudget', metavar='seconds', type=float, default=None, help='Specify the time after which no new cube or attribute is started, the rest is deferred')
+    parser.add_argument('-maxRequests', metavar='N', type=int, default=None, help='Specify the number of REST requests after which no new cube or attribute is started')
+    parser.add_argument('-deferred', metavar='path', type=str, default='deferred.jsonl', help='Specify the file listing the cubes and attributes deferred by -timeBudget or -maxRequests')
+    parser.add_argument('-plan', metavar='path', type=str, nargs='?', const='plan.json', default=None, help='Specify to only estimate the requests, bytes and time of the run, written to this file (default plan.json), without counting')
+    parser.add_argument('-planBandwidth', metavar='MiB/s', type=float, default=20, help='Specify the transfer rate assumed by -plan')
+    parser.add_argument('-metrics', metavar='path', type=str, default='metrics.json', help='Specify the JSON file receiving the request, phase and cube timings of the run')
+    parser.add_argument('-prometheus', metavar='path', type=str, default=None, help='Specify a file to also write the timings in the Prometheus text format')
     args = parser.parse_args()
 
+    if args.async_engine and (args.timeBudget is not None or args.maxRequests is not None):
+        print("The -timeBudget and -maxRequests flags cannot be combined with -async.")
+        exit(1)
+
     if not os.getenv("MSTR_BASE_URL"):
         os.environ["MSTR_BASE_URL"] = input("Enter MSTR base URL (http://.../MicroStrategy): ")
     if not os.getenv("MSTR_USERNAME"):
@@ -22,7 +60,42 @@ def main():
     if not os.getenv("MSTR_PASSWORD"):
         os.environ["MSTR_PASSWORD"] = getpass.getpass("Enter your MSTR password: ")
 
-    mstr = distinct_elem_count.MSTRApp()
+    options = {
+        'pool_size': args.poolSize,
+        'timeout': args.timeout,
+        'search_page_size': args.searchPageSize,
+        'approx_precision': args.approx,
+        'compact_sets': args.compactSets,
+        'sample_windows': args.sample,
+        'sample_window_size': args.sampleWindowSize,
+        'sample_method': args.sampleMethod,
+        # a dry run must not truncate the journal or add a run to the result database
+        'checkpoint_path': None if args.plan else args.checkpoint,
+        'resume': args.resume,
+        'state_path': args.incremental,
+        'attribute_cache_size': args.attributeCacheSize,
+        'attribute_cache_path': args.attributeCache,
+        'attribute_cache_ttl': args.attributeCacheTtl,
+        'metadata_cache_path': args.metadataCache,
+        'metadata_ttl': args.metadataTtl,
+        'report_pool_size': args.reportPoolSize,
+        'in_memory_reports': args.inMemoryReports,
+        'max_rps': args.maxRps,
+        'latency_target': args.latencyTarget,
+        'output_format': args.output,
+        'output_dir': args.outputDir,
+        'result_db': None if args.plan else args.resultDb,
+        'time_budget': args.timeBudget,
+        'max_requests': args.maxRequests
+    }
+    try:
+        if args.async_engine:
+            mstr = async_distinct_elem_count.AsyncMSTRApp(project_concurrency=args.projectConcurrency, **options)
+        else:
+            mstr = distinct_elem_count.MSTRApp(workers=args.workers, **options)
+    except (restSession.AuthenticationError, ImportError, ValueError) as error:
+        print(error)
+        exit(1)
     
     # Default setting: against all projects
     projects = mstr.listProjects()
@@ -52,16 +125,39 @@ def main():
         print("Both OLAP and MTDI flags cannot be specified simultaneously.")
         exit()
 
-    for proj in projects:
-        mstr.setFolderID(proj[0])
-        if OLAP_flag:
-            mstr.countElem_OLAP(proj, certified)
-        if MTDI_flag:
-            mstr.countElem_MTDI(proj, certified)
+    if args.plan:
+        concurrency = args.projectConcurrency if args.async_engine else args.workers
+        planner = sizingPlanner.SizingPlanner(mstr, concurrency, args.planBandwidth * 2 ** 20)
+        plans = planner.run(projects, certified, OLAP_flag, MTDI_flag)
+        planner.printPlan(plans)
+        planner.writeJson(plans, args.plan)
+        mstr.metadata_cache.save()
+        return
+
+    try:
+        if args.async_engine:
+            mstr.run(projects, certified, OLAP_flag, MTDI_flag)
+        else:
+            projectScheduler.ProjectScheduler(mstr, args.projectWorkers).run(projects, certified, OLAP_flag, MTDI_flag)
+    finally:
+        # do not leave temporary reports behind, even on Ctrl-C
+        mstr.report_pool.close()
+        # keep everything counted so far for -resume, even when the run dies
+        if mstr.journal is not None:
+            mstr.journal.close()
+        if mstr.state is not None:
+            mstr.state.save()
+        mstr.attribute_cache.save()
+        mstr.metadata_cache.save()
+        # records are written as they come, this writes the last buffered ones
+        mstr.closeRecords()
+        if mstr.budget is not None and mstr.budget.deferred:
+            deferred = mstr.budget.writeDeferred(args.deferred)
+            print(f"Spent the {mstr.budget.spent_reason}: {deferred} cubes and attributes deferred to {args.deferred}, run again with -resume to count them")
 
-    mstr.getRecordsInCSV("OLAP")
-    mstr.getRecordsInCSV("MTDI")
-    mstr.getRecordsInCSV("EXCEED")
+    mstr.metrics.writeJson(args.metrics)
+    if args.prometheus:
+        mstr.metrics.writePrometheus(args.prometheus)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
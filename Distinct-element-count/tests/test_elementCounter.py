@@ -0,0 +1,84 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import elementCounter
+
+pd = pytest.importorskip("pandas")
+
+
+def randomElements(rng, element_count, form_count, values):
+    """
+    Elements shaped like the formValues lists of the REST API, with missing and empty values
+    and, one time in ten, an element that lacks its last forms
+
+    :param values: function (rng) returning one form value
+    :return: list of formValues lists
+    """
+    elements = []
+    for _ in range(element_count):
+        element = [None if rng.random() < 0.1 else values(rng) for _ in range(form_count)]
+        if rng.random() < 0.1:
+            element = element[:rng.randrange(form_count)]
+        elements.append(element)
+    return elements
+
+
+def mixedValue(rng):
+    return rng.choice([
+        lambda: "",
+        lambda: f"value {rng.randrange(50)}",
+        lambda: rng.randrange(50),
+        lambda: rng.randrange(50) + 0.5
+    ])()
+
+
+def stringValue(rng):
+    return rng.choice(["", f"https://example.com/{rng.randrange(200)}.png"])
+
+
+def pandasCounts(elements, form_indices, form_count):
+    """
+    :return: nunique of every indexed form, ragged elements padded with missing values
+    """
+    frame = pd.DataFrame([element + [None] * (form_count - len(element)) for element in elements],
+                         columns=range(form_count), dtype=object)
+    return [int(frame[index].nunique()) for index in form_indices]
+
+
+def countPages(counter, elements, page_size):
+    for start in range(0, len(elements), page_size):
+        counter.add(elements[start:start + page_size])
+    return counter.counts()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_counts_match_pandas_nunique(seed):
+    rng = random.Random(seed)
+    form_count = rng.randrange(1, 5)
+    form_indices = sorted(rng.sample(range(form_count), rng.randrange(1, form_count + 1)))
+    elements = randomElements(rng, rng.randrange(0, 3000), form_count, mixedValue)
+    counter = elementCounter.DistinctCounter(form_indices, 10000)
+    assert countPages(counter, elements, rng.randrange(1, 1000)) == pandasCounts(elements, form_indices, form_count)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fingerprint_counts_match_pandas_nunique(seed):
+    pytest.importorskip("numpy")
+    rng = random.Random(seed)
+    elements = randomElements(rng, 5000, 3, stringValue)
+    counter = elementCounter.FingerprintDistinctCounter([0, 2], 10000)
+    assert countPages(counter, elements, 1000) == pandasCounts(elements, [0, 2], 3)
+
+
+@pytest.mark.parametrize("element_count, exceeded", [(10000, False), (10001, True)])
+def test_element_limit_boundary(element_count, exceeded):
+    elements = [[f"id {index}", f"group {index % 7}"] for index in range(element_count)]
+    counter = elementCounter.DistinctCounter([0, 1], 10000)
+    counts = countPages(counter, elements, 1000)
+    assert counter.exceeded == exceeded
+    assert counts == pandasCounts(elements, [0, 1], 2)
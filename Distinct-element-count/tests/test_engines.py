@@ -0,0 +1,55 @@
+import csv
+import os
+import subprocess
+import sys
+
+import pytest
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PACKAGE, "benchmarks"))
+
+import mockServer
+
+
+@pytest.fixture
+def server():
+    environment = mockServer.MockEnvironment(projects=1, olap_cubes=3, mtdi_cubes=3, attributes=4,
+                                             cardinalities=[10, 100, 20000], seed=3)
+    server = mockServer.startServer(environment)
+    yield server
+    server.shutdown()
+
+
+def readRecords(directory):
+    """
+    :return: the records of every output file, without the columns that change from run to run
+    """
+    records = {}
+    for type in ("OLAP", "MTDI", "EXCEED"):
+        with open(os.path.join(directory, f"distinct_element_count_{type}.csv"), encoding='utf-8') as output_file:
+            records[type] = sorted(tuple(value for column, value in row.items() if column not in ('cube_seconds', 'recorded_at'))
+                                   for row in csv.DictReader(output_file))
+    return records
+
+
+def runTool(server, directory, flags):
+    """
+    Run the command line tool against the mock server, in a process of its own so its threads and
+    its logout never wait on the server thread of this one
+    """
+    directory.mkdir()
+    env = dict(os.environ, MSTR_BASE_URL=f"http://127.0.0.1:{server.server_port}/MicroStrategyLibrary",
+               MSTR_USERNAME="test", MSTR_PASSWORD="test")
+    subprocess.run([sys.executable, os.path.join(PACKAGE, "test_distinct_elem_count.py")] + flags, cwd=directory, env=env,
+                   stdin=subprocess.DEVNULL, capture_output=True, check=True, timeout=300)
+    return readRecords(directory)
+
+
+def test_sampled_records_match_across_engines(server, tmp_path):
+    pytest.importorskip("aiohttp")
+    flags = ["-sample", "4", "-sampleWindowSize", "500"]
+    sync_records = runTool(server, tmp_path / "sync", flags)
+    async_records = runTool(server, tmp_path / "async", flags + ["-async"])
+    # attributes over the element limit are estimated, with a confidence interval
+    assert any(record[-1] for record in sync_records["EXCEED"])
+    assert async_records == sync_records